@@ -19,7 +19,6 @@ no remoteable methods nor is there any interaction with the nova.db modules.
 """
 
 import collections
-import copy
 
 import os_traits
 from oslo_concurrency import lockutils
@@ -29,20 +28,110 @@ from oslo_utils import uuidutils
 from cyborg.common.i18n import _
 
 LOG = logging.getLogger(__name__)
-_LOCK_NAME = 'provider-tree-lock'
 
 # Point-in-time representation of a resource provider in the tree.
-# Note that, whereas namedtuple enforces read-only-ness of instances as a
-# whole, nothing prevents modification of the internals of attributes of
-# complex types (children/inventory/traits/aggregates).  However, any such
-# modifications still have no effect on the ProviderTree the instance came
-# from.  Like, you can Sharpie a moustache on a Polaroid of my face, but that
-# doesn't make a moustache appear on my actual face.
+# The inventory, traits and aggregates are immutable (a _FrozenDict of
+# _FrozenDicts, and frozensets), so a ProviderData can share them with the
+# tree instead of copying, and stays valid however the tree changes later.
 ProviderData = collections.namedtuple(
     'ProviderData', ['uuid', 'name', 'generation', 'parent_uuid', 'inventory',
                      'traits', 'aggregates'])
 
 
+class ProviderChange(collections.namedtuple('ProviderChange',
+                                            ['old', 'new'])):
+    """The ProviderData of one provider before and after a change.
+
+    old is None if the provider was added, new is None if it was removed.
+    """
+
+    @property
+    def uuid(self):
+        return (self.new or self.old).uuid
+
+    @property
+    def reparented(self):
+        return (self.old is not None and self.new is not None and
+                self.old.parent_uuid != self.new.parent_uuid)
+
+    @property
+    def inventory_changed(self):
+        return self.old is None or self.old.inventory != self.new.inventory
+
+    @property
+    def traits_added(self):
+        return self.new.traits - (self.old.traits if self.old else frozenset())
+
+    @property
+    def traits_removed(self):
+        return self.old.traits - self.new.traits if self.old else frozenset()
+
+    @property
+    def aggregates_added(self):
+        return self.new.aggregates - (
+            self.old.aggregates if self.old else frozenset())
+
+    @property
+    def aggregates_removed(self):
+        return (self.old.aggregates - self.new.aggregates if self.old
+                else frozenset())
+
+
+class ProviderTreeDiff(collections.namedtuple('ProviderTreeDiff',
+                                              ['removed', 'changed'])):
+    """The changes needed to turn one ProviderTree into another.
+
+    removed is a list, in bottom-up order, of the ProviderData of providers
+    which are gone.  changed is a list, in top-down order, of ProviderChange
+    for providers which were added or whose name, parent, inventory, traits
+    or aggregates differ.  Generations are not compared.
+    """
+
+    @property
+    def added(self):
+        return [c.new for c in self.changed if c.old is None]
+
+    @property
+    def reparented(self):
+        return [c for c in self.changed if c.reparented]
+
+    def is_empty(self):
+        return not (self.removed or self.changed)
+
+
+class _FrozenDict(dict):
+    """A dict which refuses to be modified.
+
+    Still a dict, so it serializes to JSON and compares equal to plain dicts.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(_("%s is immutable") % self.__class__.__name__)
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+def _freeze_inventory(inventory):
+    """Return an immutable copy of an inventory dict of dicts."""
+    if isinstance(inventory, _FrozenDict):
+        return inventory
+    return _FrozenDict((rc, _FrozenDict(rec))
+                       for rc, rec in (inventory or {}).items())
+
+
 class _Provider(object):
     """Represents a resource provider in the tree.
 
@@ -57,15 +146,24 @@ class _Provider(object):
         self.name = name
         self.generation = generation
         self.parent_uuid = parent_uuid
+        # The parent _Provider, while this provider is attached to it
+        self.parent = None
         # Contains a dict, keyed by uuid of child resource providers having
         # this provider as a parent
         self.children = {}
-        # dict of inventory records, keyed by resource class
-        self.inventory = {}
-        # Set of trait names
-        self.traits = set()
-        # Set of aggregate UUIDs
-        self.aggregates = set()
+        # _FrozenDict of inventory records, keyed by resource class
+        self.inventory = _freeze_inventory({})
+        # frozenset of trait names
+        self.traits = frozenset()
+        # frozenset of aggregate UUIDs
+        self.aggregates = frozenset()
+        # The ProviderData for the current state, built on demand.  Reset to
+        # None by anything which changes that state.
+        self._data = None
+        # Hashes of this provider's content and of its whole subtree, built
+        # on demand and reset by _content_changed.
+        self._hash = None
+        self._subtree_hash = None
 
     @classmethod
     def from_dict(cls, pdict):
@@ -85,14 +183,14 @@ class _Provider(object):
 
         :Return: a collections.namedtuple
             include inventory, traits, aggregates, uuid, name, generation,
-            and parent_uuid.
+            and parent_uuid.  The same object is returned until the provider
+            changes, so unchanged providers can be recognized by identity.
         """
-        inventory = copy.deepcopy(self.inventory)
-        traits = copy.copy(self.traits)
-        aggregates = copy.copy(self.aggregates)
-        return ProviderData(
-            self.uuid, self.name, self.generation, self.parent_uuid,
-            inventory, traits, aggregates)
+        if self._data is None:
+            self._data = ProviderData(
+                self.uuid, self.name, self.generation, self.parent_uuid,
+                self.inventory, self.traits, self.aggregates)
+        return self._data
 
     def get_provider_uuids(self):
         """Returns a list, in top-down traversal order, of UUIDs of this
@@ -124,12 +222,40 @@ class _Provider(object):
                     return subchild
         return None
 
+    def content_hash(self):
+        """Hash of everything diff() compares, except the children."""
+        if self._hash is None:
+            self._hash = hash((self.uuid, self.name, self.parent_uuid,
+                               self.inventory, self.traits, self.aggregates))
+        return self._hash
+
+    def subtree_hash(self):
+        """Hash of the content of this provider and all its descendants."""
+        if self._subtree_hash is None:
+            self._subtree_hash = hash((
+                self.content_hash(),
+                frozenset(c.subtree_hash() for c in self.children.values())))
+        return self._subtree_hash
+
+    def _content_changed(self, own=True):
+        self._data = None
+        if own:
+            self._hash = None
+        p = self
+        while p is not None and (p._subtree_hash is not None or p is self):
+            p._subtree_hash = None
+            p = p.parent
+
     def add_child(self, provider):
         self.children[provider.uuid] = provider
+        provider.parent = self
+        self._content_changed(own=False)
 
     def remove_child(self, provider):
         if provider.uuid in self.children:
             del self.children[provider.uuid]
+            provider.parent = None
+            self._content_changed(own=False)
 
     def has_inventory(self):
         """Returns whether the provider has any inventory records at all."""
@@ -171,6 +297,7 @@ class _Provider(object):
             LOG.debug("Updating resource provider %(rp_uuid)s generation "
                       "from %(old)s to %(new)s", msg_args)
             self.generation = generation
+            self._data = None
 
     def update_inventory(self, inventory, generation):
         """Update the stored inventory for the provider along with a resource
@@ -179,7 +306,8 @@ class _Provider(object):
         """
         self._update_generation(generation)
         if self.has_inventory_changed(inventory):
-            self.inventory = copy.deepcopy(inventory)
+            self.inventory = _freeze_inventory(inventory)
+            self._content_changed()
             return True
         return False
 
@@ -194,7 +322,8 @@ class _Provider(object):
         """
         self._update_generation(generation)
         if self.have_traits_changed(new):
-            self.traits = set(new)  # create a copy of the new traits
+            self.traits = frozenset(new)
+            self._content_changed()
             return True
         return False
 
@@ -219,7 +348,8 @@ class _Provider(object):
         """
         self._update_generation(generation)
         if self.have_aggregates_changed(new):
-            self.aggregates = set(new)  # create a copy of the new aggregates
+            self.aggregates = frozenset(new)
+            self._content_changed()
             return True
         return False
 
@@ -238,8 +368,14 @@ class ProviderTree(object):
 
     def __init__(self):
         """Create an empty provider tree."""
-        self.lock = lockutils.internal_lock(_LOCK_NAME)
+        # Readers share the lock; only changes to the tree are exclusive.
+        self.lock = lockutils.ReaderWriterLock()
         self.roots = []
+        # Every provider in the tree, keyed by UUID, so lookups don't have
+        # to walk the tree.  Names map to the list of providers carrying
+        # them, oldest first.
+        self._by_uuid = {}
+        self._by_name = {}
 
     def get_provider_uuids(self, name_or_uuid=None):
         """Return a list, in top-down traversable order, of the UUIDs of all
@@ -251,12 +387,12 @@ class ProviderTree(object):
                              ProviderTree.
         """
         if name_or_uuid is not None:
-            with self.lock:
+            with self.lock.read_lock():
                 return self._find_with_lock(name_or_uuid).get_provider_uuids()
 
         # If no name_or_uuid, get UUIDs for all providers recursively.
         ret = []
-        with self.lock:
+        with self.lock.read_lock():
             for root in self.roots:
                 ret.extend(root.get_provider_uuids())
         return ret
@@ -277,7 +413,9 @@ class ProviderTree(object):
                                provider_dicts, all its descendants must also be
                                present.
         :raises: ValueError if any provider in provider_dicts has a parent that
-                 is not in this ProviderTree or elsewhere in provider_dicts.
+                 is not in this ProviderTree or elsewhere in provider_dicts, or
+                 if the parent links in provider_dicts form a cycle.  The tree
+                 is left untouched in either case.
         """
         if not provider_dicts:
             return
@@ -286,47 +424,45 @@ class ProviderTree(object):
         # *adding* via this method.
         to_add_by_uuid = {pd['uuid']: pd for pd in provider_dicts}
 
-        with self.lock:
-            # Sanity check for orphans.  Every parent UUID must either be None
-            # (the provider is a root), or be in the tree already, or exist as
-            # a key in to_add_by_uuid (we're adding it).
-            all_parents = set([None]) | set(to_add_by_uuid)
-            # NOTE(efried): Can't use get_provider_uuids directly because we're
-            # already under lock.
-            for root in self.roots:
-                all_parents |= set(root.get_provider_uuids())
+        with self.lock.write_lock():
+            # Order the providers parents-first (Kahn's algorithm over the
+            # parent links), checking for orphans on the way.  Every parent
+            # UUID must either be None (the provider is a root), or be in the
+            # tree already, or exist as a key in to_add_by_uuid (we're adding
+            # it).  Providers of the first two kinds are ready to inject;
+            # the rest wait for their parent.
+            children_by_parent = collections.defaultdict(list)
+            ready = collections.deque()
             missing_parents = set()
-            for pd in to_add_by_uuid.values():
+            for uuid, pd in to_add_by_uuid.items():
                 parent_uuid = pd.get('parent_provider_uuid')
-                if parent_uuid not in all_parents:
+                if parent_uuid in to_add_by_uuid:
+                    children_by_parent[parent_uuid].append(uuid)
+                elif parent_uuid is None or parent_uuid in self._by_uuid:
+                    ready.append(uuid)
+                else:
                     missing_parents.add(parent_uuid)
             if missing_parents:
                 raise ValueError(
                     _("The following parents were not found: %s") %
                     ', '.join(missing_parents))
 
-            # Ready to do the work.
-            # Use to_add_by_uuid to keep track of which providers are left to
-            # be added.
-            while to_add_by_uuid:
-                # Find a provider that's suitable to inject.
-                for uuid, pd in to_add_by_uuid.items():
-                    # Roots are always okay to inject (None won't be a key in
-                    # to_add_by_uuid).  Otherwise, we have to make sure we
-                    # already added the parent (and, by recursion, all
-                    # ancestors) if present in the input.
-                    parent_uuid = pd.get('parent_provider_uuid')
-                    if parent_uuid not in to_add_by_uuid:
-                        break
-                else:
-                    # This should never happen - we already ensured all parents
-                    # exist in the tree, which means we can't have any branches
-                    # that don't wind up at the root, which means we can't have
-                    # cycles.  But to quell the paranoia...
-                    raise ValueError(
-                        _("Unexpectedly failed to find parents already in the"
-                          "tree for any of the following: %s") %
-                        ','.join(set(to_add_by_uuid)))
+            ordered = []
+            while ready:
+                uuid = ready.popleft()
+                ordered.append(uuid)
+                ready.extend(children_by_parent.pop(uuid, []))
+            if len(ordered) != len(to_add_by_uuid):
+                # Whatever we never reached hangs off a parent link cycle.
+                raise ValueError(
+                    _("The following providers form a parent cycle: %s") %
+                    ', '.join(set(to_add_by_uuid) - set(ordered)))
+
+            # Ready to do the work.  Each provider is injected exactly once,
+            # after its parent (and, by induction, all its ancestors).
+            for uuid in ordered:
+                pd = to_add_by_uuid[uuid]
+                parent_uuid = pd.get('parent_provider_uuid')
 
                 # Add or replace the provider, either as a root or under its
                 # parent
@@ -342,9 +478,7 @@ class ProviderTree(object):
                 else:
                     parent = self._find_with_lock(parent_uuid)
                     parent.add_child(provider)
-
-                # Remove this entry to signify we're done with it.
-                to_add_by_uuid.pop(uuid)
+                self._index_with_lock(provider)
 
     def _remove_with_lock(self, name_or_uuid):
         found = self._find_with_lock(name_or_uuid)
@@ -353,6 +487,26 @@ class ProviderTree(object):
             parent.remove_child(found)
         else:
             self.roots.remove(found)
+        self._unindex_with_lock(found)
+
+    def _index_with_lock(self, provider):
+        self._by_uuid[provider.uuid] = provider
+        # Placement enforces unique names, but don't let a duplicate hide
+        # the provider that was here first, or vanish when that one goes.
+        self._by_name.setdefault(provider.name, []).append(provider)
+
+    def _unindex_with_lock(self, provider):
+        """Drop provider and all its descendants from the lookup indexes."""
+        to_drop = [provider]
+        while to_drop:
+            p = to_drop.pop()
+            self._by_uuid.pop(p.uuid, None)
+            named = self._by_name.get(p.name, [])
+            if p in named:
+                named.remove(p)
+                if not named:
+                    del self._by_name[p.name]
+            to_drop.extend(p.children.values())
 
     def remove(self, name_or_uuid):
         """Safely removes the provider identified by the supplied name_or_uuid
@@ -362,7 +516,7 @@ class ProviderTree(object):
         :param name_or_uuid: Either name or UUID of the resource provider to
                              remove from the tree.
         """
-        with self.lock:
+        with self.lock.write_lock():
             self._remove_with_lock(name_or_uuid)
 
     def new_root(self, name, uuid, generation=None):
@@ -376,7 +530,7 @@ class ProviderTree(object):
                  exists in the tree.
         """
 
-        with self.lock:
+        with self.lock.write_lock():
             exists = True
             try:
                 self._find_with_lock(uuid)
@@ -389,13 +543,16 @@ class ProviderTree(object):
 
             p = _Provider(name, uuid=uuid, generation=generation)
             self.roots.append(p)
+            self._index_with_lock(p)
             return p.uuid
 
     def _find_with_lock(self, name_or_uuid):
-        for root in self.roots:
-            found = root.find(name_or_uuid)
-            if found:
-                return found
+        found = self._by_uuid.get(name_or_uuid)
+        if found:
+            return found
+        named = self._by_name.get(name_or_uuid)
+        if named:
+            return named[0]
         raise ValueError(_("No such provider %s") % name_or_uuid)
 
     def data(self, name_or_uuid):
@@ -407,14 +564,85 @@ class ProviderTree(object):
         :raises: ValueError if a provider with name_or_uuid was not found in
                  the tree.
         """
-        with self.lock:
+        with self.lock.read_lock():
             return self._find_with_lock(name_or_uuid).data()
 
+    def snapshot(self):
+        """Return a point-in-time view of the whole tree.
+
+        :return: An OrderedDict, in top-down traversal order, of ProviderData
+                 keyed by provider UUID.  Nothing is copied: records of
+                 providers which have not changed are shared (by identity)
+                 between successive snapshots, which makes comparing two
+                 snapshots cheap.
+        """
+        with self.lock.read_lock():
+            ret = collections.OrderedDict()
+            to_visit = collections.deque(self.roots)
+            while to_visit:
+                provider = to_visit.popleft()
+                ret[provider.uuid] = provider.data()
+                to_visit.extend(provider.children.values())
+            return ret
+
+    def diff(self, other):
+        """Compare this tree with another one.
+
+        Subtrees whose content hash is the same in both trees are skipped
+        without looking inside, so comparing two large, mostly identical
+        trees costs roughly in proportion to the differences.
+
+        :param other: The ProviderTree representing the desired state.
+        :return: A ProviderTreeDiff of the changes which would turn this tree
+                 into other.
+        """
+        # Always lock in the same order, so two threads diffing the same
+        # pair of trees in opposite directions can't deadlock behind waiting
+        # writers.
+        first, second = sorted([self, other], key=id)
+        with first.lock.read_lock(), second.lock.read_lock():
+            return self._diff_with_lock(other)
+
+    def _diff_with_lock(self, other):
+        removed = []
+        changed = []
+
+        def remove_subtree(old):
+            if old.uuid in other._by_uuid:
+                # Moved elsewhere; it (and what's below it) is dealt with
+                # when walk() gets to it there.
+                return
+            removed.append(old.data())
+            for child in old.children.values():
+                remove_subtree(child)
+
+        def walk(news):
+            for new in news:
+                old = self._by_uuid.get(new.uuid)
+                if old is None:
+                    changed.append(ProviderChange(None, new.data()))
+                else:
+                    if old.subtree_hash() == new.subtree_hash():
+                        continue
+                    if old.content_hash() != new.content_hash():
+                        changed.append(ProviderChange(old.data(), new.data()))
+                    for child in old.children.values():
+                        if child.uuid not in new.children:
+                            remove_subtree(child)
+                walk(new.children.values())
+
+        for root in self.roots:
+            remove_subtree(root)
+        walk(other.roots)
+        # remove_subtree is called top-down; deletion wants bottom-up.
+        removed.reverse()
+        return ProviderTreeDiff(removed, changed)
+
     def exists(self, name_or_uuid):
         """Given either a name or a UUID, return True if the tree contains the
         provider, False otherwise.
         """
-        with self.lock:
+        with self.lock.read_lock():
             try:
                 self._find_with_lock(name_or_uuid)
                 return True
@@ -435,7 +663,7 @@ class ProviderTree(object):
                 already exists; or if parent_uuid points to a nonexistent
                 provider.
         """
-        with self.lock:
+        with self.lock.write_lock():
             try:
                 self._find_with_lock(uuid or name)
             except ValueError:
@@ -447,6 +675,7 @@ class ProviderTree(object):
             parent_node = self._find_with_lock(parent)
             p = _Provider(name, uuid, generation, parent_node.uuid)
             parent_node.add_child(p)
+            self._index_with_lock(p)
             return p.uuid
 
     def has_inventory(self, name_or_uuid):
@@ -456,7 +685,7 @@ class ProviderTree(object):
         :raises: ValueError if a provider with uuid was not found in the tree.
         :param name_or_uuid: Either name or UUID of the resource provider
         """
-        with self.lock:
+        with self.lock.read_lock():
             p = self._find_with_lock(name_or_uuid)
             return p.has_inventory()
 
@@ -471,7 +700,7 @@ class ProviderTree(object):
         :param inventory: dict, keyed by resource class, of inventory
                           information.
         """
-        with self.lock:
+        with self.lock.read_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.has_inventory_changed(inventory)
 
@@ -494,7 +723,7 @@ class ProviderTree(object):
         :param generation: The resource provider generation to set.  If not
                            specified, the provider's generation is not changed.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.update_inventory(inventory, generation)
 
@@ -524,7 +753,7 @@ class ProviderTree(object):
                  the traits parameter is empty, even if the provider has no
                  traits.
         """
-        with self.lock:
+        with self.lock.read_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.has_traits(traits)
 
@@ -539,7 +768,7 @@ class ProviderTree(object):
         :param traits: Iterable of string trait names to compare against the
                        provider's traits.
         """
-        with self.lock:
+        with self.lock.read_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.have_traits_changed(traits)
 
@@ -560,7 +789,7 @@ class ProviderTree(object):
         :param generation: The resource provider generation to set.  If None,
                            the provider's generation is not changed.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.update_traits(traits, generation=generation)
 
@@ -571,7 +800,7 @@ class ProviderTree(object):
                              to be affected.
         :param traits: String names of traits to be added.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             final_traits = provider.traits | set(traits)
             provider.update_traits(final_traits)
@@ -583,7 +812,7 @@ class ProviderTree(object):
                              to be affected.
         :param traits: String names of traits to be removed.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             final_traits = provider.traits - set(traits)
             provider.update_traits(final_traits)
@@ -602,7 +831,7 @@ class ProviderTree(object):
                  are absent.  Returns True if the aggregates parameter is
                  empty, even if the provider has no aggregate associations.
         """
-        with self.lock:
+        with self.lock.read_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.in_aggregates(aggregates)
 
@@ -617,7 +846,7 @@ class ProviderTree(object):
         :param aggregates: Iterable of string aggregate UUIDs to compare
                            against the provider's aggregates.
         """
-        with self.lock:
+        with self.lock.read_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.have_aggregates_changed(aggregates)
 
@@ -639,7 +868,7 @@ class ProviderTree(object):
         :param generation: The resource provider generation to set.  If None,
                            the provider's generation is not changed.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             return provider.update_aggregates(aggregates,
                                               generation=generation)
@@ -651,7 +880,7 @@ class ProviderTree(object):
                              are to be affected.
         :param aggregates: String UUIDs of aggregates to be added.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             final_aggs = provider.aggregates | set(aggregates)
             provider.update_aggregates(final_aggs)
@@ -664,7 +893,7 @@ class ProviderTree(object):
                              are to be affected.
         :param aggregates: String UUIDs of aggregates to be removed.
         """
-        with self.lock:
+        with self.lock.write_lock():
             provider = self._find_with_lock(name_or_uuid)
             final_aggs = provider.aggregates - set(aggregates)
             provider.update_aggregates(final_aggs)
@@ -18,6 +18,8 @@ Track resources like FPGA GPU and QAT for a host.  Provides the
 conductor with useful information about availability through the accelerator
 model.
 """
+import uuid
+
 from oslo_log import log as logging
 from oslo_messaging.rpc.client import RemoteError
 from oslo_utils import uuidutils
@@ -44,6 +46,21 @@ DEPLOYABLE_HOST_MAPS = {"assignable": "assignable",
                         }
 
 
+def _idempotency_key(action, obj):
+    """Return the idempotency key of a cast asking for action on obj.
+
+    The key covers the object, the version of its row the change is based
+    on and the change itself.  Sending the same change again, for example
+    from the next sync before the conductor applied the first, reuses the
+    key so the conductor applies it once.  A later change reads a newer
+    row and gets a new key, even if it sets the same values.
+    """
+    version = obj.updated_at if obj.obj_attr_is_set('updated_at') else None
+    changes = sorted(obj.obj_get_changes().items())
+    return str(uuid.uuid5(uuid.NAMESPACE_OID,
+                          repr((action, obj.uuid, version, changes))))
+
+
 class ResourceTracker(object):
     """Agent helper class for keeping track of resource usage as instances
     are built and destroyed.
@@ -121,7 +138,8 @@ class ResourceTracker(object):
             # if parent_uuid:
             dep["parent_uuid"] = parent_uuid
             obj_dep = objects.Deployable(context, **dep)
-            new_dep = self.conductor_api.deployable_create(context, obj_dep)
+            new_dep = self.conductor_api.deployable_create(context, obj_dep,
+                                                           host=self.host)
             return new_dep
 
         # NOTE(Shaohe Feng) need more agreement on how to keep consistency.
@@ -140,7 +158,9 @@ class ResourceTracker(object):
             accl = accls[mutual]
             if self._fpga_compare_and_update(fpgas[mutual], accl):
                 try:
-                    self.conductor_api.deployable_update(context, accl)
+                    self.conductor_api.deployable_update_async(
+                        context, accl, _idempotency_key('update', accl),
+                        host=self.host)
                 except RemoteError as e:
                     LOG.error(e)
         # Add
@@ -178,7 +198,10 @@ class ResourceTracker(object):
         # Delete
         for obsolete in accl_bdfs - bdfs:
             try:
-                self.conductor_api.deployable_delete(context, accls[obsolete])
+                self.conductor_api.deployable_delete_async(
+                    context, accls[obsolete],
+                    _idempotency_key('delete', accls[obsolete]),
+                    host=self.host)
             except RemoteError as e:
                 LOG.error(e)
             del accls[obsolete]
@@ -14,7 +14,10 @@
 #    under the License.
 
 import datetime
+import hashlib
+import itertools
 
+from oslo_serialization import jsonutils
 import pecan
 import wsme
 from wsme import types as wtypes
@@ -35,6 +38,101 @@ class APIBase(wtypes.Base):
                     if hasattr(self, k) and getattr(self, k) != wsme.Unset)
 
 
+class Projection(object):
+    """Render DB rows of selected columns straight to a JSON list body.
+
+    A read-only fast path for list endpoints.  The DB returns a tuple of
+    just `fields` per row and each tuple becomes the dict the endpoint's
+    WSME type would have rendered, without building an ORM model, a
+    CyborgObject and a WSME object for every row on the way.
+    """
+
+    def __init__(self, collection, fields, resource=None,
+                 null_defaults=None):
+        """Create a projection.
+
+        :param collection: key the list is returned under.
+        :param fields: names of the values in each row, in order.
+        :param resource: if given, add self and bookmark links to
+                         /v2/<resource>/<uuid> to each item.
+        :param null_defaults: values to render instead of NULL, by field.
+        """
+        self.collection = collection
+        self.fields = tuple(fields)
+        self.resource = resource
+        self.null_defaults = null_defaults or {}
+
+    def _item(self, row, url):
+        item = {}
+        for name, value in zip(self.fields, row):
+            if value is None:
+                value = self.null_defaults.get(name)
+            elif isinstance(value, datetime.datetime):
+                # DB datetimes are naive UTC; render them like the
+                # timezone-aware ones on objects.
+                value = value.isoformat()
+                if not value.endswith('+00:00'):
+                    value += '+00:00'
+            item[name] = value
+        if self.resource is None:
+            item['links'] = []
+        else:
+            args = (url, self.resource, item['uuid'])
+            item['links'] = [{'href': '%s/v2/%s/%s' % args, 'rel': 'self'},
+                             {'href': '%s/%s/%s' % args, 'rel': 'bookmark'}]
+        return item
+
+    def render(self, rows):
+        """Return the JSON collection body for rows."""
+        url = pecan.request.public_url
+        pecan.response.content_type = 'application/json'
+        return jsonutils.dumps(
+            {self.collection: [self._item(row, url) for row in rows]})
+
+    def stream(self, rows, batch_size):
+        """Return a response whose body streams the collection for rows.
+
+        The body is the same JSON as render() would return, produced by a
+        WSGI iterator one chunk per batch_size rows as the server writes
+        it out, so rows are only read from the DB as they are sent.
+        """
+        url = pecan.request.public_url
+        pecan.response.content_type = 'application/json'
+        pecan.response.app_iter = self._chunks(iter(rows), batch_size, url)
+        pecan.response.content_length = None
+        return pecan.response
+
+    def _chunks(self, rows, batch_size, url):
+        sep = ''
+        yield ('{"%s": [' % self.collection).encode('utf-8')
+        while True:
+            batch = [jsonutils.dumps(self._item(row, url))
+                     for row in itertools.islice(rows, batch_size)]
+            if not batch:
+                break
+            yield (sep + ', '.join(batch)).encode('utf-8')
+            sep = ', '
+        yield b']}'
+
+
+def not_modified(*parts):
+    """Tag the response with a strong ETag and check If-None-Match.
+
+    :param parts: JSON-serializable values that together determine the
+                  response body, e.g. the versions of the tables it is read
+                  from and the request parameters that shape it.
+    :returns: True, with the status set to 304, if the client already has
+              the body; the caller should then return without building it.
+    """
+    etag = hashlib.sha1(jsonutils.dumps(
+        parts, sort_keys=True).encode('utf-8')).hexdigest()
+    pecan.response.etag = etag
+    if etag in pecan.request.if_none_match:
+        pecan.response.status = 304
+        return True
+    return False
+
+
 class CyborgController(rest.RestController):
 
     def _handle_patch(self, method, remainder, request=None):
@@ -21,6 +21,7 @@ from wsme import types as wtypes
 
 from oslo_log import log
 from oslo_serialization import jsonutils
+from oslo_utils import excutils
 
 from cyborg.api.controllers import base
 from cyborg.api.controllers import link
@@ -135,10 +136,14 @@ class ARQBindingsController(base.CyborgController):
         # binding. Instead, we cheat by picking a VF and setting the
         # state. TODO Pick a VF
         arq['state'] = 'Bound'
-        arq.bind(devrp_uuid) # HACK this shd be a conductor RPC
+        arq.bind(context, devrp_uuid) # HACK this shd be a conductor RPC
         MYLOG.warning('ctrlr post bind: arq=(%s)', arq)
 
-        arq.save(context) # HACK Delegate db writes to the conductor
+        try:
+            arq.save(context) # HACK Delegate db writes to the conductor
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                arq.unbind(context)
 
         return None
 
@@ -164,5 +169,6 @@ class ARQBindingsController(base.CyborgController):
         arq['device_rp_uuid'] = ''
         # Retain instance_uuid in ARQ for troubleshooting
         arq['state'] = 'Unbound' # HACK Shd go back to what Nova set it to
+        arq.unbind(context)
 
         arq.save(context) # HACK Delegate db writes to the conductor
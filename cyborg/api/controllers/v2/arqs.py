@@ -15,6 +15,7 @@
 
 import json
 import pecan
+import six
 from six.moves import http_client
 import wsme
 from wsme import types as wtypes
@@ -29,7 +30,9 @@ from cyborg.api.controllers.v2 import utils as api_utils
 from cyborg.api import expose
 from cyborg.common import exception
 from cyborg.common import policy
+from cyborg.conf import CONF
 from cyborg import objects
+from cyborg.objects.extarq import ExtARQ
 from cyborg.quota import QUOTAS
 from cyborg.agent.rpcapi import AgentAPI
 
@@ -94,6 +97,14 @@ class ARQCollection(base.APIBase):
                                   for obj_arq in obj_arqs]
         return collection
 
+# The attributes ARQ renders, read straight from the DB by get_all.
+ARQ_PROJECTION = base.Projection(
+    'arqs', ['created_at', 'updated_at', 'uuid', 'state',
+             'device_profile_name', 'host_name', 'device_rp_uuid',
+             'instance_uuid'],
+    null_defaults=ExtARQ._db_null_defaults)
+
+
 class ARQsController(base.CyborgController):
     """REST controller for ARQs."""
 
@@ -142,27 +153,46 @@ class ARQsController(base.CyborgController):
         return ARQ.convert_with_links(new_arq)
 
     # @policy.authorize_wsgi("cyborg:arq", "get_all")
-    @expose.expose(ARQCollection, wtypes.text, types.uuid)
+    @pecan.expose(content_type='application/json')
     def get_all(self, state=None, instance=None):
-        """Retrieve a list of arqs."""
+        """Retrieve a list of arqs.
+
+        Rendered through ARQ_PROJECTION, which gives the same JSON as
+        ARQCollection without building an object per ARQ.
+        """
         # HACK Need to implement 'arq=uuid1,...' query parameter
         context = pecan.request.context
-        obj_arqs = objects.ARQ.list(context)
+        filters = {}
         if state is not None:
             if state != 'resolved':
-                raise RuntimeError('Only state "resolved" is supported')
-            new_arqs = [arq for arq in obj_arqs
-                           if arq['state'] == 'Bound' or
-                              arq['state'] == 'BindFailed'
-                       ]
-            obj_arqs = new_arqs
+                pecan.abort(http_client.BAD_REQUEST,
+                            'Only state "resolved" is supported')
+            filters['state'] = ['Bound', 'BindFailed']
         if instance is not None:
-            new_arqs = [arq for arq in obj_arqs
-                           if arq['instance_uuid'] == instance
-                       ]
-            obj_arqs = new_arqs
-
-        return ARQCollection.convert_with_links(obj_arqs)
+            try:
+                filters['instance_uuid'] = types.uuid.validate(instance)
+            except exception.InvalidUUID as e:
+                pecan.abort(e.code, six.text_type(e))
+        # Read-only listing: fine to serve from the DB read replica.
+        # The versions are read before the rows, so a change landing in
+        # between can only give the body an outdated ETag, never a 304 for
+        # an outdated body.
+        versions = ExtARQ.dbapi.table_versions_get(
+            context, ['extarqs', 'device_profiles'], use_slave=True)
+        if base.not_modified('arqs', versions, filters,
+                             pecan.request.public_url):
+            return ''
+        batch_size = CONF.api.list_stream_batch_size
+        if batch_size:
+            rows = ExtARQ.dbapi.extarq_stream(
+                context, ARQ_PROJECTION.fields, filters=filters,
+                batch_size=batch_size, use_slave=True)
+            return ARQ_PROJECTION.stream(rows, batch_size)
+        rows = ExtARQ.dbapi.extarq_list(
+            context, use_slave=True, filters=filters,
+            columns=ARQ_PROJECTION.fields)
+
+        return ARQ_PROJECTION.render(rows)
 
     # @policy.authorize_wsgi("cyborg:arq", "delete")
     @expose.expose(None, wtypes.text, status_code=http_client.NO_CONTENT)
@@ -29,7 +29,10 @@ from cyborg.api.controllers.v2 import utils as api_utils
 from cyborg.api import expose
 from cyborg.common import exception
 from cyborg.common import policy
+from cyborg.conf import CONF
 from cyborg import objects
+from cyborg.objects.device_profile import DeviceProfile as \
+    DeviceProfileObject
 from cyborg.quota import QUOTAS
 from cyborg.agent.rpcapi import AgentAPI
 
@@ -87,6 +90,13 @@ class DeviceProfileCollection(base.APIBase):
                                   for obj_devprof in obj_devprofs]
         return collection
 
+# The attributes DeviceProfile renders, read straight from the DB by
+# get_all.
+DEVICE_PROFILE_PROJECTION = base.Projection(
+    'device_profiles', ['created_at', 'updated_at', 'uuid', 'name', 'json'],
+    resource='device_profiles')
+
+
 class DeviceProfilesController(base.CyborgController):
     """REST controller for DeviceProfiles."""
 
@@ -109,25 +119,43 @@ class DeviceProfilesController(base.CyborgController):
         return DeviceProfile.convert_with_links(new_devprof)
 
     # @policy.authorize_wsgi("cyborg:device_profile", "get_all")
-    @expose.expose(DeviceProfileCollection, wtypes.text, wtypes.text)
+    @pecan.expose(content_type='application/json')
     def get_all(self, name='None', use='None'):
-        """Retrieve a list of device_profiles."""
+        """Retrieve a list of device_profiles.
+
+        Rendered through DEVICE_PROFILE_PROJECTION, which gives the same
+        JSON as DeviceProfileCollection without building an object per
+        device profile.
+        """
         name = pecan.request.GET.get('name')
         use  = pecan.request.GET.get('use')
 
         context = pecan.request.context
-        obj_devprofs = objects.DeviceProfile.list(context)
+        # Read-only listing: fine to serve from the DB read replica.
+        # See ARQsController.get_all for why the version is read first.
+        versions = DeviceProfileObject.dbapi.table_versions_get(
+            context, ['device_profiles'], use_slave=True)
+        if base.not_modified('device_profiles', versions, name,
+                             pecan.request.public_url):
+            return ''
+        batch_size = CONF.api.list_stream_batch_size
+        if batch_size:
+            rows = DeviceProfileObject.dbapi.device_profile_stream(
+                context, DEVICE_PROFILE_PROJECTION.fields,
+                batch_size=batch_size, use_slave=True)
+        else:
+            rows = DeviceProfileObject.dbapi.device_profile_list(
+                context, use_slave=True,
+                columns=DEVICE_PROFILE_PROJECTION.fields)
         if name:
-            new_obj_devprofs = [devprof for devprof in obj_devprofs
-                                 if devprof['name'] in name]
-            obj_devprofs = new_obj_devprofs
+            rows = (row for row in rows if row.name in name)
         if use is not None and use == 'scheduling':
             # TODO Figure out how to support this
             # Returning just the devprof groups causes Pecan issues
             pass
-        # HACK fix convert_links
-        return DeviceProfileCollection.convert_with_links(obj_devprofs)
-        #return obj_devprofs
+        if batch_size:
+            return DEVICE_PROFILE_PROJECTION.stream(rows, batch_size)
+        return DEVICE_PROFILE_PROJECTION.render(rows)
 
     # @policy.authorize_wsgi("cyborg:device_profile", "delete")
     @expose.expose(DeviceProfile, wtypes.text, status_code=http_client.NO_CONTENT)
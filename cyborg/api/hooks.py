@@ -13,13 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import threading
+
 from oslo_config import cfg
-from oslo_context import context
+from oslo_log import log
 from pecan import hooks
 
+from cyborg import context
 from cyborg.common import policy
 from cyborg.conductor import rpcapi
 
+LOG = log.getLogger(__name__)
+
 
 class ConfigHook(hooks.PecanHook):
     """Attach the config object to the request so controllers can get to it."""
@@ -69,10 +75,16 @@ class ContextHook(hooks.PecanHook):
         The flag is set to True, if X-Roles contains either an administrator
         or admin substring. Otherwise it is set to False.
 
+    It also keeps a histogram of the DB connection checkouts each request
+    made, returned by checkout_stats() and logged every report_every
+    requests.
     """
 
-    def __init__(self, public_api_routes):
+    def __init__(self, public_api_routes, report_every=1000):
         self.public_api_routes = public_api_routes
+        self.report_every = report_every
+        self._checkouts = collections.Counter()
+        self._lock = threading.Lock()
         super(ContextHook, self).__init__()
 
     def before(self, state):
@@ -92,3 +104,31 @@ class ContextHook(hooks.PecanHook):
         is_admin = policy.authorize('is_admin', creds, creds)
         state.request.context = context.RequestContext(
             is_admin=is_admin, **creds)
+
+    def after(self, state):
+        ctx = getattr(state.request, 'context', None)
+        if ctx is None:
+            return
+        LOG.debug("%(method)s %(path)s used %(count)d DB connection "
+                  "checkout(s)", {'method': state.request.method,
+                                  'path': state.request.path,
+                                  'count': ctx.db_checkouts})
+        with self._lock:
+            self._checkouts[ctx.db_checkouts] += 1
+            requests = sum(self._checkouts.values())
+        if self.report_every and requests % self.report_every == 0:
+            LOG.info("DB connection checkouts per request: %s",
+                     self.checkout_stats())
+
+    def checkout_stats(self):
+        """Return the request count, total and mean DB connection checkouts
+        per request, and a histogram of requests keyed by checkout count.
+        """
+        with self._lock:
+            histogram = dict(self._checkouts)
+        requests = sum(histogram.values())
+        checkouts = sum(count * n for count, n in histogram.items())
+        return {'requests': requests,
+                'checkouts': checkouts,
+                'mean': float(checkouts) / requests if requests else 0.0,
+                'histogram': histogram}
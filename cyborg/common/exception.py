@@ -191,6 +191,14 @@ class PlacementInventoryUpdateConflict(Conflict):
                 "%(resource_provider)s, resource class %(resource_class)s.")
 
 
+class AttachHandleNotFound(NotFound):
+    _msg_fmt = _("Attach handle %(id)s could not be found.")
+
+
+class AttachHandleNotAvailable(Conflict):
+    _msg_fmt = _("Device %(device_id)s has no free attach handle.")
+
+
 class ObjectActionError(CyborgException):
     _msg_fmt = _('Object action %(action)s failed because: %(reason)s')
 
@@ -227,6 +235,14 @@ class ResourceProviderTraitRetrievalFailed(CyborgException):
                 " %(uuid)s")
 
 
+class TraitRetrievalFailed(CyborgException):
+    msg_fmt = _("Failed to get traits %(error)s")
+
+
+class TraitCreationFailed(CyborgException):
+    msg_fmt = _("Failed to create trait %(name)s: %(error)s")
+
+
 class ResourceProviderCreationFailed(CyborgException):
     msg_fmt = _("Failed to create resource provider %(name)s")
 
@@ -303,6 +319,16 @@ class QuotaResourceUnknown(QuotaNotFound):
     message = _("Unknown quota resources %(unknown)s.")
 
 
+class OverQuota(CyborgException):
+    _msg_fmt = _("Quota exceeded for resources: %(overs)s")
+    code = http_client.FORBIDDEN
+
+
+class ConductorBusy(CyborgException):
+    _msg_fmt = _("Conductor is too busy to handle %(method)s: %(reason)s")
+    code = http_client.SERVICE_UNAVAILABLE
+
+
 class InvalidReservationExpiration(Invalid):
     message = _("Invalid reservation expiration %(expire)s.")
 
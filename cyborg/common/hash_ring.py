@@ -0,0 +1,93 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Consistent hashing of agent hosts onto the active conductors."""
+
+import bisect
+import hashlib
+import threading
+
+from oslo_log import log
+from oslo_utils import timeutils
+
+from cyborg.conf import CONF
+from cyborg import context as cyborg_context
+from cyborg.db import api as dbapi
+
+LOG = log.getLogger(__name__)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16)
+
+
+class HashRing(object):
+    """Map keys onto a set of nodes with consistent hashing.
+
+    Each node is placed on the ring at `replicas` points, so keys spread
+    evenly and adding or removing a node only moves the keys that node
+    gains or loses.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = frozenset(nodes)
+        ring = sorted((_hash('%s-%d' % (node, i)), node)
+                      for node in self.nodes for i in range(replicas))
+        self._hashes = [h for h, _node in ring]
+        self._ring_nodes = [node for _h, node in ring]
+
+    def get_node(self, key):
+        """Return the node owning key, or None if the ring is empty."""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key))
+        return self._ring_nodes[index % len(self._ring_nodes)]
+
+
+class HashRingManager(object):
+    """Keep a HashRing of the conductors with a live heartbeat.
+
+    The ring is rebuilt from the conductors table at most once every
+    [conductor]hash_ring_reset_interval seconds.
+    """
+
+    def __init__(self):
+        self.dbapi = dbapi.get_instance()
+        self._lock = threading.Lock()
+        self._ring = None
+        self._built_at = None
+
+    def _load(self):
+        context = cyborg_context.get_admin_context()
+        hosts = self.dbapi.conductor_get_active(
+            context, CONF.conductor.heartbeat_timeout, use_slave=True)
+        return HashRing(hosts, CONF.conductor.hash_ring_replicas)
+
+    @property
+    def ring(self):
+        with self._lock:
+            if (self._ring is None or timeutils.is_older_than(
+                    self._built_at, CONF.conductor.hash_ring_reset_interval)):
+                self._ring = self._load()
+                self._built_at = timeutils.utcnow()
+                LOG.debug("Rebuilt conductor hash ring: %s",
+                          sorted(self._ring.nodes))
+            return self._ring
+
+    def reset(self):
+        """Rebuild the ring on next use."""
+        with self._lock:
+            self._ring = None
+
+    def get_owner(self, host):
+        """Return the conductor owning host, or None if there is none."""
+        return self.ring.get_node(host)
@@ -15,8 +15,11 @@
 
 """Policy Engine For Cyborg."""
 
+import collections
 import functools
+import os
 import sys
+import threading
 
 from oslo_concurrency import lockutils
 from oslo_config import cfg
@@ -33,6 +36,11 @@ _ENFORCER = None
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
+# Credentials (also found in targets built from them) that vary per request
+# without changing what a rule decides.
+_UNCACHED_CREDS = frozenset(['auth_token', 'request_id', 'global_request_id',
+                             'service_token'])
+
 
 default_policies = [
     # Legacy setting, don't remove. Likely to be overridden by operators who
@@ -129,6 +137,135 @@ def list_policies():
         + fpga_policies
 
 
+class DecisionCache(object):
+    """A bounded LRU cache of policy decisions.
+
+    Decisions are tied to the rules they were made with: the cache empties
+    itself when the enforcer's rules object is replaced, or when the policy
+    files snapshot passed in changes.  The snapshot is needed because
+    oslo.policy may merge changed files from policy_dirs into the rules
+    object it already has.
+    """
+
+    def __init__(self, size, report_every=10000):
+        self.size = size
+        self.report_every = report_every
+        self._decisions = collections.OrderedDict()
+        self._rules = None
+        self._files = None
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def _is_current(self, rules, files):
+        return rules is self._rules and files == self._files
+
+    def get(self, key, rules, files=()):
+        """Return the cached decision for key, or None.
+
+        :param rules: the enforcer's current rules object.
+        :param files: snapshot of the policy files the rules came from.
+        """
+        with self._lock:
+            if not self._is_current(rules, files):
+                if self._rules is not None:
+                    self._stats['invalidations'] += 1
+                    LOG.debug("Policy rules reloaded, dropping %d cached "
+                              "decision(s)", len(self._decisions))
+                self._decisions.clear()
+                self._rules = rules
+                self._files = files
+            decision = self._decisions.get(key)
+            if decision is None:
+                self._stats['misses'] += 1
+            else:
+                self._stats['hits'] += 1
+                self._decisions.pop(key)
+                self._decisions[key] = decision
+            lookups = self._stats['hits'] + self._stats['misses']
+        if self.report_every and lookups % self.report_every == 0:
+            LOG.info("Policy decision cache: %s", self.stats())
+        return decision
+
+    def put(self, key, rules, decision, files=()):
+        with self._lock:
+            if not self._is_current(rules, files):
+                return
+            self._decisions[key] = decision
+            while len(self._decisions) > self.size:
+                self._decisions.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._decisions.clear()
+            self._rules = None
+            self._files = None
+
+    def stats(self):
+        """Return hit, miss and eviction counts and the hit ratio."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._decisions)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_ratio'] = (float(stats.get('hits', 0)) / lookups
+                              if lookups else 0.0)
+        return stats
+
+
+_DECISIONS = None
+
+
+def get_decision_cache():
+    """Return the policy decision cache, or None if it is disabled."""
+    global _DECISIONS
+
+    if _DECISIONS is None or _DECISIONS.size != CONF.api.policy_cache_size:
+        _DECISIONS = DecisionCache(CONF.api.policy_cache_size)
+    return _DECISIONS if _DECISIONS.size else None
+
+
+def _policy_files(enforcer):
+    """Return the mtimes of the policy file and of the policy_dirs files."""
+    path = enforcer.conf.find_file(enforcer.policy_file)
+    paths = [path] if path else []
+    for policy_dir in enforcer.conf.oslo_policy.policy_dirs:
+        path = enforcer.conf.find_file(policy_dir)
+        if path and os.path.isdir(path):
+            # The directory's own mtime changes when a file is removed.
+            paths.append(path)
+            paths.extend(os.path.join(path, name)
+                         for name in sorted(os.listdir(path)))
+    files = []
+    for path in paths:
+        try:
+            files.append((path, os.path.getmtime(path)))
+        except OSError:
+            # Removed since it was listed; the directory mtime shows it.
+            pass
+    return tuple(files)
+
+
+def _freeze(values, skip=()):
+    """Return a hashable snapshot of a creds or target dict."""
+    items = []
+    for key, value in values.items():
+        if key in skip:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = frozenset(value)
+        items.append((key, value))
+    return frozenset(items)
+
+
+def _decision_key(rule, target, creds):
+    try:
+        return (rule, _freeze(creds, _UNCACHED_CREDS),
+                _freeze(target, _UNCACHED_CREDS))
+    except TypeError:
+        # Unhashable values in creds or target; decide without the cache.
+        return None
+
+
 @lockutils.synchronized('policy_enforcer', 'cyborg-')
 def init_enforcer(policy_file=None, rules=None,
                   default_rule=None, use_conf=True):
@@ -158,6 +295,8 @@ def init_enforcer(policy_file=None, rules=None,
                                 default_rule=default_rule,
                                 use_conf=use_conf)
     _ENFORCER.register_defaults(list_policies())
+    if _DECISIONS is not None:
+        _DECISIONS.clear()
 
 
 def get_enforcer():
@@ -180,14 +319,34 @@ def authorize(rule, target, creds, do_raise=False, *args, **kwargs):
     """A shortcut for policy.Enforcer.authorize()
 
     Checks authorization of a rule against the target and credentials, and
-    raises an exception if the rule is not defined.
+    raises an exception if the rule is not defined.  Decisions are served
+    from the decision cache when possible.
     """
     enforcer = get_enforcer()
-    try:
-        return enforcer.authorize(rule, target, creds, do_raise=do_raise,
-                                  *args, **kwargs)
-    except policy.PolicyNotAuthorized:
+    cache = get_decision_cache()
+    key = None
+    if cache is not None and not args and not kwargs:
+        key = _decision_key(rule, target, creds)
+    if key is None:
+        try:
+            return enforcer.authorize(rule, target, creds, do_raise=do_raise,
+                                      *args, **kwargs)
+        except policy.PolicyNotAuthorized:
+            raise exception.HTTPForbidden(resource=rule)
+
+    # Pick up changed policy files before trusting the cache.  The files
+    # are looked at before the rules load, so a change racing the load
+    # still differs from the snapshot on the next request.
+    files = _policy_files(enforcer)
+    enforcer.load_rules()
+    rules = enforcer.rules
+    decision = cache.get(key, rules, files)
+    if decision is None:
+        decision = enforcer.authorize(rule, target, creds)
+        cache.put(key, rules, decision, files)
+    if do_raise and not decision:
         raise exception.HTTPForbidden(resource=rule)
+    return decision
 
 
 # This decorator MUST appear first (the outermost decorator)
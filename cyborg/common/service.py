@@ -47,13 +47,17 @@ class RPCService(service.Service):
     def start(self):
         super(RPCService, self).start()
 
+        admin_context = context.get_admin_context()
+        if hasattr(self.manager, 'init_host'):
+            self.manager.init_host(admin_context)
+
         target = messaging.Target(topic=self.topic, server=self.host)
         endpoints = [self.manager]
         serializer = objects_base.CyborgObjectSerializer()
         self.rpcserver = rpc.get_server(target, endpoints, serializer)
-        self.rpcserver.start()
+        self.rpcserver.start(
+            override_pool_size=getattr(self.manager, 'rpc_pool_size', None))
 
-        admin_context = context.get_admin_context()
         self.tg.add_dynamic_timer(
             self.manager.periodic_tasks,
             periodic_interval_max=CONF.periodic_interval,
@@ -71,6 +75,13 @@ class RPCService(service.Service):
             LOG.exception('Service error occurred when stopping the '
                           'RPC server. Error: %s', e)
 
+        if hasattr(self.manager, 'del_host'):
+            try:
+                self.manager.del_host(context.get_admin_context())
+            except Exception as e:
+                LOG.exception('Service error occurred when cleaning up '
+                              'the host. Error: %s', e)
+
         super(RPCService, self).stop(graceful=graceful)
         LOG.info('Stopped RPC server for service %(service)s on host '
                  '%(host)s.',
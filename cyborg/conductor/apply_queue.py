@@ -0,0 +1,145 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Background apply queue for updates the conductor receives as casts."""
+
+import collections
+import threading
+
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+
+
+class _Op(object):
+    """A queued call, with the idempotency keys folded into it."""
+
+    __slots__ = ('keys', 'func', 'args', 'coalesce')
+
+    def __init__(self, key, func, args, coalesce):
+        self.keys = [key]
+        self.func = func
+        self.args = args
+        self.coalesce = coalesce
+
+
+def _merge_changes(pending_obj, obj):
+    """Copy the changed fields of obj onto pending_obj."""
+    for field in obj.obj_what_changed():
+        setattr(pending_obj, field, getattr(obj, field))
+
+
+class ApplyQueue(object):
+    """Apply updates in the background, at most once per idempotency key.
+
+    Casts carry an idempotency key chosen by the sender.  A key that was
+    already queued or applied is dropped, so a redelivered or retried cast
+    does not write twice.  Calls are queued per object they change and
+    applied in order.  A coalescing update whose object's latest pending
+    call is the same kind of update is merged into it instead: the changed
+    fields of the new object are copied onto the pending one, so a burst
+    of partial updates for one object costs a single DB write and loses
+    none of the changes.  Nothing else is ever merged or replaced, so an
+    update never swallows a pending delete.
+
+    The queue and the keys seen live only in memory: updates still queued
+    when the conductor stops are lost, and a cast redelivered after a
+    restart is applied again.
+    """
+
+    def __init__(self, seen_size=10000):
+        self._seen_size = seen_size
+        # Idempotency keys queued or applied, oldest first.
+        self._seen = collections.OrderedDict()
+        # Object key -> list of _Op to apply in order; oldest object first.
+        self._pending = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._stats = collections.Counter()
+
+    def submit(self, idempotency_key, object_key, func, *args, **kwargs):
+        """Queue func(*args) to be applied in the background.
+
+        :param coalesce: if True, the last of args is a versioned object
+                         whose changed fields func saves, and the call may
+                         be merged into a pending call of the same func for
+                         the same object_key.
+        :returns: False if idempotency_key was seen before and the update
+                  was dropped, True otherwise.
+        """
+        coalesce = kwargs.pop('coalesce', False)
+        with self._cond:
+            self._stats['submitted'] += 1
+            if idempotency_key in self._seen:
+                self._stats['duplicates'] += 1
+                return False
+            self._seen[idempotency_key] = True
+            while len(self._seen) > self._seen_size:
+                self._seen.popitem(last=False)
+            ops = self._pending.setdefault(object_key, [])
+            last = ops[-1] if ops else None
+            if (coalesce and last is not None and last.coalesce and
+                    last.func == func):
+                _merge_changes(last.args[-1], args[-1])
+                last.keys.append(idempotency_key)
+                self._stats['coalesced'] += 1
+            else:
+                ops.append(_Op(idempotency_key, func, args, coalesce))
+            self._start_worker_locked()
+            self._cond.notify()
+        return True
+
+    def _start_worker_locked(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run,
+                                            name='conductor-apply-queue')
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            self.drain()
+
+    def drain(self):
+        """Apply every pending update; return the number applied."""
+        applied = 0
+        while True:
+            with self._cond:
+                if not self._pending:
+                    return applied
+                object_key, ops = self._pending.popitem(last=False)
+            for op in ops:
+                try:
+                    op.func(*op.args)
+                except Exception:
+                    LOG.exception("Failed to apply update %(keys)s for "
+                                  "%(object)s", {'keys': op.keys,
+                                                 'object': object_key})
+                    with self._cond:
+                        self._stats['failed'] += 1
+                        # Let a retry of the same casts through.
+                        for key in op.keys:
+                            self._seen.pop(key, None)
+                else:
+                    applied += 1
+                    with self._cond:
+                        self._stats['applied'] += 1
+
+    def stats(self):
+        """Return counters and the current queue depth."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['depth'] = sum(len(ops) for ops in self._pending.values())
+        return stats
@@ -0,0 +1,139 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per-method concurrency limits for the conductor RPC endpoints."""
+
+import collections
+import contextlib
+import threading
+
+from oslo_log import log
+from oslo_utils import timeutils
+
+from cyborg.common import exception
+
+LOG = log.getLogger(__name__)
+
+
+class ConcurrencyLimiter(object):
+    """Bound how many calls of one RPC method run at once.
+
+    Calls beyond the limit wait in a bounded queue.  A call that finds the
+    queue full, or waits longer than the timeout, raises ConductorBusy so
+    the caller sees backpressure instead of piling up in the executor.
+    """
+
+    def __init__(self, name, limit=0, max_queued=0, timeout=0):
+        self.name = name
+        self.limit = limit
+        self.max_queued = max_queued
+        self.timeout = timeout or None
+        self._sem = threading.Semaphore(limit) if limit > 0 else None
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+        self._active = 0
+        self._waiting = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _reject(self, reason):
+        with self._lock:
+            self._stats['rejected'] += 1
+        LOG.warning("Rejecting %(method)s: %(reason)s",
+                    {'method': self.name, 'reason': reason})
+        raise exception.ConductorBusy(method=self.name, reason=reason)
+
+    def _acquire(self):
+        if self._sem is None or self._sem.acquire(blocking=False):
+            return
+        with self._lock:
+            full = self.max_queued and self._waiting >= self.max_queued
+            if not full:
+                self._waiting += 1
+        if full:
+            self._reject("%d requests already queued" % self.max_queued)
+        try:
+            acquired = self._sem.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            self._reject("waited more than %ss" % self.timeout)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the method's slots for the duration of the block."""
+        start = timeutils.now()
+        self._acquire()
+        waited = timeutils.now() - start
+        with self._lock:
+            self._active += 1
+            self._stats['calls'] += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+            if self._sem is not None:
+                self._sem.release()
+
+    def stats(self):
+        """Return call counts, queue depth and wait times in seconds."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(limit=self.limit, active=self._active,
+                         depth=self._waiting,
+                         wait_total=self._wait_total,
+                         wait_max=self._wait_max)
+        calls = stats.get('calls', 0)
+        stats['wait_avg'] = self._wait_total / calls if calls else 0.0
+        return stats
+
+
+class MethodLimiters(object):
+    """Create and hold a ConcurrencyLimiter for each RPC method."""
+
+    def __init__(self, limits=None, default_limit=0, max_queued=0,
+                 timeout=0):
+        self._limits = dict((name, int(limit))
+                            for name, limit in (limits or {}).items())
+        self._default_limit = default_limit
+        self._max_queued = max_queued
+        self._timeout = timeout
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_conf(cls, conf):
+        """Build the limiters from a [conductor] option group."""
+        return cls(limits=conf.max_concurrent_requests,
+                   default_limit=conf.default_max_concurrent_requests,
+                   max_queued=conf.max_queued_requests,
+                   timeout=conf.queue_timeout)
+
+    def get(self, name):
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limiter = ConcurrencyLimiter(
+                    name, self._limits.get(name, self._default_limit),
+                    self._max_queued, self._timeout)
+                self._limiters[name] = limiter
+        return limiter
+
+    def stats(self):
+        """Return the stats of every method called so far, by name."""
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return dict((limiter.name, limiter.stats()) for limiter in limiters)
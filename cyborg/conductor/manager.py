@@ -13,29 +13,154 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+
+from oslo_db import exception as db_exc
 import oslo_messaging as messaging
+from oslo_service import periodic_task
 
+from cyborg.common import hash_ring
+from cyborg.conductor import apply_queue
+from cyborg.conductor import concurrency
+from cyborg.conductor import rpcapi
 from cyborg.conf import CONF
+from cyborg.db import api as dbapi
 from cyborg import objects
+from cyborg.objects import base as objects_base
+from cyborg.quota import QUOTAS
 
 from oslo_log import log
 LOG = log.getLogger(__name__)
 MYLOG = LOG
 
-class ConductorManager(object):
+
+def limited(func):
+    """Run an RPC endpoint under its per-method concurrency limit."""
+    @functools.wraps(func)
+    def wrapper(self, context, *args, **kwargs):
+        with self._limiters.get(func.__name__).slot():
+            return func(self, context, *args, **kwargs)
+    return wrapper
+
+
+def routed(cast=False):
+    """Hand a host-scoped RPC endpoint on to the conductor owning the host.
+
+    The endpoint runs here when it is given no host, when this conductor
+    owns the host or no owner is known, or when another conductor already
+    handed it on.  A forwarded call waits for the owner's reply, a
+    forwarded cast does not.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, context, *args, **kwargs):
+            forwarded = kwargs.pop('forwarded', False)
+            host = kwargs.get('host')
+            if not forwarded and host is not None:
+                owner = self._owner_of(host)
+                if owner is not None and owner != self.host:
+                    cctxt = self._forward_client().prepare(
+                        topic=self.topic, server=owner, version='1.3')
+                    send = cctxt.cast if cast else cctxt.call
+                    return send(context, func.__name__, forwarded=True,
+                                **kwargs)
+            return func(self, context, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ConductorManager(periodic_task.PeriodicTasks):
     """Cyborg Conductor manager main class."""
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.3'
     target = messaging.Target(version=RPC_API_VERSION)
 
     def __init__(self, topic, host=None):
-        super(ConductorManager, self).__init__()
+        super(ConductorManager, self).__init__(CONF)
         self.topic = topic
         self.host = host or CONF.host
+        # The queue calls the unlimited _* helpers: its single worker is
+        # bounded already, and a cast rejected with ConductorBusy would
+        # have no caller left to retry it.
+        self._apply_queue = apply_queue.ApplyQueue()
+        self._limiters = concurrency.MethodLimiters.from_conf(CONF.conductor)
+        # Read by RPCService when it starts the RPC server.
+        self.rpc_pool_size = CONF.conductor.executor_thread_pool_size
+        self.dbapi = dbapi.get_instance()
+        self.ring_manager = hash_ring.HashRingManager()
+        self._client = None
+
+    def init_host(self, context):
+        """Join the conductor hash ring; called before serving RPCs."""
+        self.dbapi.conductor_heartbeat(context, self.host)
+        self.ring_manager.reset()
+
+    def del_host(self, context):
+        """Leave the conductor hash ring; called after the last RPC."""
+        self.dbapi.conductor_unregister(context, self.host)
+
+    def _forward_client(self):
+        if self._client is None:
+            self._client = rpcapi.ConductorAPI(topic=self.topic).client
+        return self._client
+
+    def _owner_of(self, host):
+        """Return the conductor owning host, or None if it is unknown."""
+        try:
+            return self.ring_manager.get_owner(host)
+        except db_exc.DBError:
+            LOG.warning("Cannot load the conductor hash ring; handling "
+                        "host %s here.", host)
+            return None
+
+    def owns_host(self, host):
+        """Whether this conductor owns the host-scoped work for host.
+
+        Host-scoped RPCs are handed on to the owner of their host, and
+        periodic tasks working on a set of hosts skip the hosts this
+        returns False for, so each host is handled by one conductor.  While
+        no owner is known every conductor owns every host.
+        """
+        owner = self._owner_of(host)
+        return owner is None or owner == self.host
 
     def periodic_tasks(self, context, raise_on_error=False):
-        pass
-
+        return self.run_periodic_tasks(context, raise_on_error=raise_on_error)
+
+    @periodic_task.periodic_task(spacing=CONF.conductor.heartbeat_interval)
+    def _conductor_heartbeat(self, context):
+        self.dbapi.conductor_heartbeat(context, self.host)
+
+    @periodic_task.periodic_task(spacing=CONF.reservation_sweep_interval)
+    def _expire_reservations(self, context):
+        """Roll back expired quota reservations and resync usages."""
+        QUOTAS.expire(context)
+
+    @periodic_task.periodic_task(spacing=CONF.periodic_interval)
+    def _reconcile_hosts(self, context):
+        """Free leaked attach handles on the hosts this conductor owns."""
+        for host in self.dbapi.device_hostnames(context):
+            if not self.owns_host(host):
+                continue
+            released = self.dbapi.attach_handle_reconcile(context, host)
+            if released:
+                LOG.info("Released %(count)d leaked attach handles on "
+                         "host %(host)s.", {'count': released, 'host': host})
+
+    @periodic_task.periodic_task(spacing=CONF.periodic_interval)
+    def _report_concurrency_stats(self, context):
+        """Log per-method queue depth and wait times for tuning."""
+        for method, stats in sorted(self.concurrency_stats().items()):
+            LOG.debug("Conductor %(method)s: %(stats)s",
+                      {'method': method, 'stats': stats})
+
+    def concurrency_stats(self):
+        """Return per-method limiter stats plus the apply queue's."""
+        stats = self._limiters.stats()
+        stats['apply_queue'] = self._apply_queue.stats()
+        return stats
+
+    @limited
     def accelerator_create(self, context, obj_acc):
         """Create a new accelerator.
 
@@ -51,6 +176,7 @@ class ConductorManager(object):
         obj_acc.create(context)
         return obj_acc
 
+    @limited
     def accelerator_update(self, context, obj_acc):
         """Update an accelerator.
 
@@ -61,6 +187,7 @@ class ConductorManager(object):
         obj_acc.save(context)
         return obj_acc
 
+    @limited
     def accelerator_delete(self, context, obj_acc):
         """Delete an accelerator.
 
@@ -69,34 +196,79 @@ class ConductorManager(object):
         """
         obj_acc.destroy(context)
 
-    def deployable_create(self, context, obj_dep):
+    @routed()
+    @limited
+    def deployable_create(self, context, obj_dep, host=None):
         """Create a new deployable.
 
         :param context: request context.
         :param obj_dep: a changed (but not saved) obj_dep object.
+        :param host: agent host the deployable is on.
         :returns: created obj_dep object.
         """
         obj_dep.create(context)
         return obj_dep
 
-    def deployable_update(self, context, obj_dep):
+    @routed()
+    @limited
+    def deployable_update(self, context, obj_dep, host=None):
         """Update a deployable.
 
         :param context: request context.
         :param obj_dep: a deployable object to update.
+        :param host: agent host the deployable is on.
         :returns: updated deployable object.
         """
+        return self._deployable_update(context, obj_dep)
+
+    def _deployable_update(self, context, obj_dep):
         obj_dep.save(context)
         return obj_dep
 
-    def deployable_delete(self, context, obj_dep):
+    @routed()
+    @limited
+    def deployable_delete(self, context, obj_dep, host=None):
         """Delete a deployable.
 
         :param context: request context.
         :param obj_dep: a deployable object to delete.
+        :param host: agent host the deployable is on.
         """
+        self._deployable_delete(context, obj_dep)
+
+    def _deployable_delete(self, context, obj_dep):
         obj_dep.destroy(context)
 
+    @routed(cast=True)
+    def deployable_update_async(self, context, obj_dep, idempotency_key,
+                                host=None):
+        """Queue a deployable update sent as a cast.
+
+        :param context: request context.
+        :param obj_dep: a deployable object to update.
+        :param idempotency_key: key the update is applied at most once for.
+        :param host: agent host the deployable is on.
+        """
+        self._apply_queue.submit(idempotency_key,
+                                 ('deployable', obj_dep.uuid),
+                                 self._deployable_update, context, obj_dep,
+                                 coalesce=True)
+
+    @routed(cast=True)
+    def deployable_delete_async(self, context, obj_dep, idempotency_key,
+                                host=None):
+        """Queue a deployable deletion sent as a cast.
+
+        :param context: request context.
+        :param obj_dep: a deployable object to delete.
+        :param idempotency_key: key the deletion is applied at most once for.
+        :param host: agent host the deployable is on.
+        """
+        self._apply_queue.submit(idempotency_key,
+                                 ('deployable', obj_dep.uuid),
+                                 self._deployable_delete, context, obj_dep)
+
+    @limited
     def deployable_get(self, context, uuid):
         """Retrieve a deployable.
 
@@ -106,23 +278,35 @@ class ConductorManager(object):
         """
         return objects.Deployable.get(context, uuid)
 
-    def deployable_get_by_host(self, context, host):
+    @routed()
+    @limited
+    def deployable_get_by_host(self, context, host, compact=False):
         """Retrieve a deployable.
 
         :param context: request context.
         :param host: host on which the deployable is located.
+        :param compact: reply with the compact list format.
         :returns: requested deployable object.
         """
-        return objects.Deployable.get_by_host(context, host)
+        deployables = objects.Deployable.get_by_host(context, host)
+        if compact:
+            return objects_base.CompactObjectList(deployables)
+        return deployables
 
-    def deployable_list(self, context):
+    @limited
+    def deployable_list(self, context, compact=False):
         """Retrieve a list of deployables.
 
         :param context: request context.
+        :param compact: reply with the compact list format.
         :returns: a list of deployable objects.
         """
-        return objects.Deployable.list(context)
+        deployables = objects.Deployable.list(context)
+        if compact:
+            return objects_base.CompactObjectList(deployables)
+        return deployables
 
+    @limited
     def arq_create(self, context, obj_arq, device_profile_id=None):
         """Create a new arq.
 
@@ -133,6 +317,7 @@ class ConductorManager(object):
         obj_arq.create(context, device_profile_id)
         return obj_arq
 
+    @limited
     def arq_update(self, context, obj_arq):
         """Update an arq.
 
@@ -140,9 +325,24 @@ class ConductorManager(object):
         :param obj_arq: an arq object to update.
         :returns: updated arq object.
         """
+        return self._arq_update(context, obj_arq)
+
+    def _arq_update(self, context, obj_arq):
         obj_arq.save(context)
         return obj_arq
 
+    def arq_update_async(self, context, obj_arq, idempotency_key):
+        """Queue an arq update sent as a cast.
+
+        :param context: request context.
+        :param obj_arq: an arq object to update.
+        :param idempotency_key: key the update is applied at most once for.
+        """
+        self._apply_queue.submit(idempotency_key, ('arq', obj_arq.uuid),
+                                 self._arq_update, context, obj_arq,
+                                 coalesce=True)
+
+    @limited
     def arq_delete(self, context, obj_arq):
         """Delete an arq.
 
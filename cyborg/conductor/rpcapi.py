@@ -35,10 +35,16 @@ class ConductorAPI(object):
     API version history:
 
     |    1.0 - Initial version.
+    |    1.1 - Add deployable_update_async, deployable_delete_async and
+    |          arq_update_async casts.
+    |    1.2 - Add compact to deployable_get_by_host and deployable_list.
+    |    1.3 - Host-scoped deployable calls carry the agent host, and the
+    |          conductor receiving one hands it on to the conductor owning
+    |          that host.
 
     """
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self, topic=None):
         super(ConductorAPI, self).__init__()
@@ -50,6 +56,24 @@ class ConductorAPI(object):
                                      version_cap=self.RPC_API_VERSION,
                                      serializer=serializer)
 
+    def _send(self, context, method, host, version=None, cast=False,
+              **kwargs):
+        """Send a host-scoped RPC to any conductor on the topic.
+
+        Conductors from version 1.3 on are also sent the host, so the one
+        receiving the RPC can hand it on to the conductor owning that host.
+        """
+        prepare_kwargs = {'topic': self.topic}
+        if host is not None and self.client.can_send_version('1.3'):
+            version = '1.3'
+            kwargs['host'] = host
+        if version is not None:
+            prepare_kwargs['version'] = version
+        cctxt = self.client.prepare(**prepare_kwargs)
+        if cast:
+            return cctxt.cast(context, method, **kwargs)
+        return cctxt.call(context, method, **kwargs)
+
     def accelerator_create(self, context, obj_acc):
         """Signal to conductor service to create an accelerator.
 
@@ -100,34 +124,85 @@ class ConductorAPI(object):
         cctxt = self.client.prepare(topic=self.topic)
         return cctxt.call(context, 'get_all', obj_acc=obj_acc)
 
-    def deployable_create(self, context, obj_dep):
+    def deployable_create(self, context, obj_dep, host=None):
         """Signal to conductor service to create a deployable.
 
         :param context: request context.
         :param obj_dep: a created (but not saved) deployable object.
+        :param host: agent host the deployable is on; the conductor owning
+                     it handles the call.
         :returns: created deployable object.
         """
-        cctxt = self.client.prepare(topic=self.topic)
-        return cctxt.call(context, 'deployable_create', obj_dep=obj_dep)
+        return self._send(context, 'deployable_create', host,
+                          obj_dep=obj_dep)
 
-    def deployable_update(self, context, obj_dep):
+    def deployable_update(self, context, obj_dep, host=None):
         """Signal to conductor service to update a deployable.
 
         :param context: request context.
         :param obj_dep: a deployable object to update.
+        :param host: agent host the deployable is on; the conductor owning
+                     it handles the call.
         :returns: updated deployable object.
         """
-        cctxt = self.client.prepare(topic=self.topic)
-        return cctxt.call(context, 'deployable_update', obj_dep=obj_dep)
+        return self._send(context, 'deployable_update', host,
+                          obj_dep=obj_dep)
 
-    def deployable_delete(self, context, obj_dep):
+    def deployable_delete(self, context, obj_dep, host=None):
         """Signal to conductor service to delete a deployable.
 
         :param context: request context.
         :param obj_dep: a deployable object to delete.
+        :param host: agent host the deployable is on; the conductor owning
+                     it handles the call.
         """
-        cctxt = self.client.prepare(topic=self.topic)
-        cctxt.call(context, 'deployable_delete', obj_dep=obj_dep)
+        self._send(context, 'deployable_delete', host, obj_dep=obj_dep)
+
+    def deployable_update_async(self, context, obj_dep, idempotency_key,
+                                host=None):
+        """Cast a deployable update to the conductor without waiting.
+
+        The conductor applies each idempotency key at most once, so the
+        caller should pick one key per logical update and send it again
+        with every retry or resend of that update.  Falls back to a
+        blocking deployable_update() if the conductor predates version 1.1.
+
+        The conductor only queues the update in memory: a cast it has not
+        applied yet is lost if it restarts, and is healed by the sender's
+        next sync.
+
+        :param context: request context.
+        :param obj_dep: a deployable object to update.
+        :param idempotency_key: identifies this update.
+        :param host: agent host the deployable is on; the conductor owning
+                     it applies the cast.
+        """
+        if not self.client.can_send_version('1.1'):
+            self.deployable_update(context, obj_dep, host=host)
+            return
+        self._send(context, 'deployable_update_async', host, version='1.1',
+                   cast=True, obj_dep=obj_dep,
+                   idempotency_key=idempotency_key)
+
+    def deployable_delete_async(self, context, obj_dep, idempotency_key,
+                                host=None):
+        """Cast a deployable deletion to the conductor without waiting.
+
+        See deployable_update_async() for the idempotency key and what
+        happens if the conductor restarts.
+
+        :param context: request context.
+        :param obj_dep: a deployable object to delete.
+        :param idempotency_key: identifies this deletion.
+        :param host: agent host the deployable is on; the conductor owning
+                     it applies the cast.
+        """
+        if not self.client.can_send_version('1.1'):
+            self.deployable_delete(context, obj_dep, host=host)
+            return
+        self._send(context, 'deployable_delete_async', host, version='1.1',
+                   cast=True, obj_dep=obj_dep,
+                   idempotency_key=idempotency_key)
 
     def deployable_get(self, context, uuid):
         """Signal to conductor service to get a deployable.
@@ -143,9 +218,16 @@ class ConductorAPI(object):
         """Signal to conductor service to get a deployable by host.
 
         :param context: request context.
-        :param host: host on which the deployable is located.
+        :param host: host on which the deployable is located; the
+                     conductor owning it handles the call.
         :returns: requested deployable object.
         """
+        for version in ('1.3', '1.2'):
+            if self.client.can_send_version(version):
+                cctxt = self.client.prepare(topic=self.topic,
+                                            version=version)
+                return cctxt.call(context, 'deployable_get_by_host',
+                                  host=host, compact=True)
         cctxt = self.client.prepare(topic=self.topic)
         return cctxt.call(context, 'deployable_get_by_host', host=host)
 
@@ -155,6 +237,9 @@ class ConductorAPI(object):
         :param context: request context.
         :returns: a list of deployable objects.
         """
+        if self.client.can_send_version('1.2'):
+            cctxt = self.client.prepare(topic=self.topic, version='1.2')
+            return cctxt.call(context, 'deployable_list', compact=True)
         cctxt = self.client.prepare(topic=self.topic)
         return cctxt.call(context, 'deployable_list')
 
@@ -181,6 +266,23 @@ class ConductorAPI(object):
         cctxt = self.client.prepare(topic=self.topic)
         return cctxt.call(context, 'arq_update', obj_arq=obj_arq)
 
+    def arq_update_async(self, context, obj_arq, idempotency_key):
+        """Cast an arq update to the conductor without waiting.
+
+        See deployable_update_async() for the idempotency key and what
+        happens if the conductor restarts.
+
+        :param context: request context.
+        :param obj_arq: an arq object to update.
+        :param idempotency_key: identifies this update.
+        """
+        if not self.client.can_send_version('1.1'):
+            self.arq_update(context, obj_arq)
+            return
+        cctxt = self.client.prepare(topic=self.topic, version='1.1')
+        cctxt.cast(context, 'arq_update_async', obj_arq=obj_arq,
+                   idempotency_key=idempotency_key)
+
     def arq_delete(self, context, obj_arq):
         """Signal to conductor service to delete an arq.
 
@@ -16,6 +16,7 @@
 from oslo_config import cfg
 
 from cyborg.conf import api
+from cyborg.conf import conductor
 from cyborg.conf import database
 from cyborg.conf import default
 from cyborg.conf import service_token
@@ -25,6 +26,7 @@ from cyborg.conf import keystone
 CONF = cfg.CONF
 
 api.register_opts(CONF)
+conductor.register_opts(CONF)
 database.register_opts(CONF)
 default.register_opts(CONF)
 default.register_placement_opts(CONF)
@@ -48,6 +48,20 @@ opts = [
     cfg.StrOpt('api_paste_config',
                default="api-paste.ini",
                help="Configuration file for WSGI definition of API."),
+    cfg.IntOpt('list_stream_batch_size',
+               default=0,
+               min=0,
+               help=_('If greater than 0, list ARQs and device profiles by '
+                      'streaming the response body, reading this many rows '
+                      'at a time from the database instead of building the '
+                      'whole collection in memory. 0 disables streaming.')),
+    cfg.IntOpt('policy_cache_size',
+               default=1024,
+               min=0,
+               help=_('Number of policy decisions to keep in an LRU cache, '
+                      'keyed by rule, credentials and target. The cache is '
+                      'emptied whenever the policy rules are reloaded. 0 '
+                      'disables the cache.')),
 ]
 
 opt_group = cfg.OptGroup(name='api',
@@ -0,0 +1,87 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_config import cfg
+
+from cyborg.common.i18n import _
+
+
+opts = [
+    cfg.IntOpt('executor_thread_pool_size',
+               default=64,
+               min=1,
+               help=_('Number of green threads the conductor RPC server '
+                      'uses to dispatch requests.')),
+    cfg.DictOpt('max_concurrent_requests',
+                default={'arq_create': '16', 'arq_delete': '16'},
+                help=_('Maximum number of requests handled at once, per '
+                       'RPC method, as method:limit pairs. Keep the bursty '
+                       'ARQ methods below executor_thread_pool_size so '
+                       'they cannot starve the agents\' deployable syncs. '
+                       'Methods not listed use '
+                       'default_max_concurrent_requests.')),
+    cfg.IntOpt('default_max_concurrent_requests',
+               default=0,
+               min=0,
+               help=_('Maximum number of requests handled at once for an '
+                      'RPC method not listed in max_concurrent_requests. '
+                      '0 means unlimited.')),
+    cfg.IntOpt('max_queued_requests',
+               default=32,
+               min=0,
+               help=_('Maximum number of requests that may wait for a '
+                      'limited RPC method. Further requests are rejected '
+                      'right away so callers can back off. 0 means '
+                      'unbounded.')),
+    cfg.IntOpt('queue_timeout',
+               default=30,
+               min=0,
+               help=_('Seconds a request may wait for a limited RPC method '
+                      'before it is rejected. 0 means wait forever.')),
+    cfg.IntOpt('heartbeat_interval',
+               default=10,
+               min=1,
+               help=_('Seconds between a conductor\'s heartbeats.')),
+    cfg.IntOpt('heartbeat_timeout',
+               default=60,
+               min=1,
+               help=_('Seconds after its last heartbeat that a conductor is '
+                      'considered dead and its agent hosts move to the '
+                      'other conductors.')),
+    cfg.IntOpt('hash_ring_reset_interval',
+               default=30,
+               min=0,
+               help=_('Seconds a cached conductor hash ring is used before '
+                      'it is rebuilt from the heartbeats.')),
+    cfg.IntOpt('hash_ring_replicas',
+               default=64,
+               min=1,
+               help=_('Number of points each conductor gets on the hash '
+                      'ring. More points spread agent hosts more evenly.')),
+]
+
+opt_group = cfg.OptGroup(name='conductor',
+                         title='Options for the cyborg-conductor service')
+
+
+CONDUCTOR_OPTS = (opts)
+
+
+def register_opts(conf):
+    conf.register_group(opt_group)
+    conf.register_opts(opts, group=opt_group)
+
+
+def list_opts():
+    return {
+        opt_group: CONDUCTOR_OPTS
+    }
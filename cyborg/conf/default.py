@@ -90,6 +90,35 @@ placement_opts = [
                'being equal, two requests for allocation candidates will '
                'return the same results in the same order; but no guarantees '
                'are made as to how that order is determined.')),
+    cfg.IntOpt(
+        'resource_provider_association_refresh',
+        default=300,
+        min=0,
+        help=_('Interval for updating resource provider aggregate and trait '
+               'associations, in seconds.  Within this interval the locally '
+               'cached associations are used without asking placement.')),
+    cfg.IntOpt(
+        'association_cache_size',
+        default=1000,
+        min=0,
+        help=_('Maximum number of resource providers whose aggregates and '
+               'traits are cached by placement generation.  Once the refresh '
+               'interval expires, a provider whose generation is unchanged is '
+               'not re-fetched.  Set to 0 to disable the cache.')),
+    cfg.BoolOpt(
+        'allocation_candidates_coalesce',
+        default=True,
+        help=_('If True, concurrent identical allocation candidate queries '
+               'share a single request to placement instead of each '
+               'issuing their own.')),
+    cfg.FloatOpt(
+        'allocation_candidates_cache_ttl',
+        default=0.0,
+        min=0.0,
+        help=_('Number of seconds for which a successful allocation '
+               'candidates response is reused for identical queries. Keep '
+               'this very short since the candidates go stale as soon as '
+               'anything claims resources. 0 disables the cache.')),
 ]
 
 
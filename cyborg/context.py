@@ -98,6 +98,9 @@ class RequestContext(context.RequestContext):
             self.service_catalog = []
 
         self.user_auth_plugin = user_auth_plugin
+        # Number of DB connection pool checkouts made on behalf of this
+        # request; see cyborg.db.sqlalchemy.api.
+        self.db_checkouts = 0
         # if self.is_admin is None:
         #    self.is_admin = policy.check_is_admin(self)
 
@@ -41,13 +41,32 @@ class Connection(object):
     def __init__(self):
         """Constructor."""
 
+    @abc.abstractmethod
+    def read_transaction(self, context, use_slave=False):
+        """Return a context manager that opens (or joins) a read transaction.
+
+        Every DB API call made with the same context inside the block shares
+        the transaction and its connection checkout.
+        """
+
     # deployable
     @abc.abstractmethod
     def deployable_create(self, context, values):
         """Create a new deployable."""
 
     @abc.abstractmethod
-    def deployable_get(self, context, uuid):
+    def deployable_bulk_upsert(self, context, values_list, chunk_size=None):
+        """Create or update deployables in one transaction.
+
+        Rows are matched on uuid; a row without one is created.
+
+        :param values_list: A list of dicts of deployable column values.
+        :param chunk_size: Rows written per statement.
+        :returns: The uuids of the rows, in input order.
+        """
+
+    @abc.abstractmethod
+    def deployable_get(self, context, uuid, use_slave=False):
         """Get requested deployable."""
 
     @abc.abstractmethod
@@ -55,7 +74,7 @@ class Connection(object):
         """Get requested deployable by host."""
 
     @abc.abstractmethod
-    def deployable_list(self, context):
+    def deployable_list(self, context, use_slave=False):
         """Get requested list of deployables."""
 
     @abc.abstractmethod
@@ -70,12 +89,13 @@ class Connection(object):
     def deployable_get_by_filters(self, context,
                                   filters, sort_key='created_at',
                                   sort_dir='desc', limit=None,
-                                  marker=None, columns_to_join=None):
+                                  marker=None, columns_to_join=None,
+                                  use_slave=False):
         """Get requested deployable by filters."""
 
     @abc.abstractmethod
     def deployable_get_by_filters_with_attributes(self, context,
-                                                  filters):
+                                                  filters, use_slave=False):
         """Get requested deployable by filters with attributes."""
     # attributes
     @abc.abstractmethod
@@ -83,15 +103,62 @@ class Connection(object):
         """Create a new attribute."""
 
     @abc.abstractmethod
-    def attribute_get(self, context, uuid):
+    def attach_handle_allocate(self, context, device_id):
+        """Atomically claim a free attach handle of a device.
+
+        :param device_id: The id of the device.
+        :returns: The claimed attach handle.
+        :raises: AttachHandleNotAvailable if the device has no free handle.
+        """
+
+    @abc.abstractmethod
+    def attach_handle_release(self, context, handle_id):
+        """Mark an attach handle free again; idempotent.
+
+        :param handle_id: The id of the attach handle.
+        :raises: AttachHandleNotFound if there is no such handle.
+        """
+
+    @abc.abstractmethod
+    def extarq_attach_handle(self, context, uuid, deployable_uuid):
+        """Claim a free attach handle of a deployable for an ExtARQ.
+
+        :param uuid: The uuid of the ExtARQ.
+        :param deployable_uuid: The uuid of the deployable.
+        :returns: The claimed attach handle.
+        :raises: DeployableNotFound if there is no such deployable.
+        :raises: AttachHandleNotAvailable if the device has no free handle.
+        """
+
+    @abc.abstractmethod
+    def extarq_detach_handle(self, context, uuid):
+        """Release the attach handle held by an ExtARQ, if any.
+
+        :param uuid: The uuid of the ExtARQ.
+        """
+
+    @abc.abstractmethod
+    def attribute_bulk_upsert(self, context, values_list, chunk_size=None):
+        """Create or update attributes in one transaction.
+
+        Rows are matched on uuid; a row without one is created.
+
+        :param values_list: A list of dicts of attribute column values.
+        :param chunk_size: Rows written per statement.
+        :returns: The uuids of the rows, in input order.
+        """
+
+    @abc.abstractmethod
+    def attribute_get(self, context, uuid, use_slave=False):
         """Get requested attribute."""
 
     @abc.abstractmethod
-    def attribute_get_by_deployable_id(self, context, deployable_id):
+    def attribute_get_by_deployable_id(self, context, deployable_id,
+                                       use_slave=False):
         """Get requested attribute by attribute id."""
 
     @abc.abstractmethod
-    def attribute_get_by_filter(self, context, filters):
+    def attribute_get_by_filter(self, context, filters, use_slave=False):
         """Get requested attribute by kv pair and attribute id."""
 
     @abc.abstractmethod
@@ -108,6 +175,47 @@ class Connection(object):
                       is_allocated_reserve=False):
         """Check quotas and create appropriate reservations."""
 
+    @abc.abstractmethod
+    def quota_usage_count(self, context, project_id=None, resources=None,
+                          use_slave=False):
+        """Count accelerators in use, by project and resource."""
+
     @abc.abstractmethod
     def reservation_commit(self, context, reservations, project_id=None):
         """Check quotas and create appropriate reservations."""
+
+    @abc.abstractmethod
+    def reservation_rollback(self, context, reservations, project_id=None):
+        """Release quota reservations without using them."""
+
+    @abc.abstractmethod
+    def reservation_expire(self, context, batch_size=1000):
+        """Roll back expired reservations, in batches."""
+
+    @abc.abstractmethod
+    def quota_usage_refresh(self, context):
+        """Resync quota usages from the resources actually in use."""
+
+    @abc.abstractmethod
+    def conductor_heartbeat(self, context, hostname):
+        """Register a conductor or refresh its heartbeat."""
+
+    @abc.abstractmethod
+    def conductor_unregister(self, context, hostname):
+        """Remove a conductor from the active set."""
+
+    @abc.abstractmethod
+    def conductor_get_active(self, context, timeout, use_slave=False):
+        """Get the hostnames of conductors seen in the last timeout secs."""
+
+    @abc.abstractmethod
+    def device_hostnames(self, context, use_slave=False):
+        """Get the sorted hostnames that have devices."""
+
+    @abc.abstractmethod
+    def attach_handle_reconcile(self, context, hostname):
+        """Release a host's in-use attach handles that no ExtARQ holds.
+
+        :param hostname: The host whose devices' handles are checked.
+        :returns: the number of handles released.
+        """
@@ -0,0 +1,44 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add-table-versions
+
+Revision ID: 3b8f1d6e2a97
+Revises: 7d2e9a4c1b63
+Create Date: 2026-10-19 18:02:44.519370
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b8f1d6e2a97'
+down_revision = '7d2e9a4c1b63'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name', name='uniq_table_versions0name'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8'
+    )
+    # Create the rows up front so that writers only ever update them.
+    op.bulk_insert(table_versions, [{'name': 'device_profiles', 'version': 0},
+                                    {'name': 'extarqs', 'version': 0}])
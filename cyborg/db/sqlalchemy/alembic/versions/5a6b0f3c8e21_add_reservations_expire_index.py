@@ -0,0 +1,30 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add-reservations-expire-index
+
+Revision ID: 5a6b0f3c8e21
+Revises: e4b7c1a2d9f0
+Create Date: 2026-10-19 13:02:51.730214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a6b0f3c8e21'
+down_revision = 'e4b7c1a2d9f0'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('reservations_expire_idx', 'reservations', ['expire'],
+                    unique=False)
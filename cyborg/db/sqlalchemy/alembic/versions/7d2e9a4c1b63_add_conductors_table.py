@@ -0,0 +1,42 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add-conductors-table
+
+Revision ID: 7d2e9a4c1b63
+Revises: 5a6b0f3c8e21
+Create Date: 2026-10-19 15:21:07.348912
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d2e9a4c1b63'
+down_revision = '5a6b0f3c8e21'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'conductors',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hostname', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hostname', name='uniq_conductors0hostname'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8'
+    )
+    op.create_index('conductors_updated_at_idx', 'conductors',
+                    ['updated_at'], unique=False)
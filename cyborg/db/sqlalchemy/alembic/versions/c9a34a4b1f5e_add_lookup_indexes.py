@@ -0,0 +1,41 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add-lookup-indexes
+
+Revision ID: c9a34a4b1f5e
+Revises: 40ec6cd9e20a
+Create Date: 2026-10-19 09:12:40.118304
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c9a34a4b1f5e'
+down_revision = '40ec6cd9e20a'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('extarqs_instance_uuid_idx', 'extarqs',
+                    ['instance_uuid'], unique=False)
+    op.create_index('extarqs_state_idx', 'extarqs', ['state'], unique=False)
+    op.create_index('extarqs_device_profile_id_idx', 'extarqs',
+                    ['device_profile_id'], unique=False)
+    op.create_index('extarqs_host_name_idx', 'extarqs', ['host_name'],
+                    unique=False)
+    op.create_index('attach_handles_device_id_in_use_idx', 'attach_handles',
+                    ['device_id', 'in_use'], unique=False)
+    op.create_index('devices_hostname_idx', 'devices', ['hostname'],
+                    unique=False)
+    op.create_index('deployables_device_id_idx', 'deployables',
+                    ['device_id'], unique=False)
@@ -0,0 +1,34 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add-extarq-project-id
+
+Revision ID: e4b7c1a2d9f0
+Revises: c9a34a4b1f5e
+Create Date: 2026-10-19 11:40:05.526131
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c1a2d9f0'
+down_revision = 'c9a34a4b1f5e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('extarqs',
+                  sa.Column('project_id', sa.String(length=255),
+                            nullable=True))
+    op.create_index('extarqs_project_id_idx', 'extarqs', ['project_id'],
+                    unique=False)
@@ -15,10 +15,16 @@
 
 """SQLAlchemy storage backend."""
 
-import threading
+import collections
 import copy
+import datetime
+import functools
+import importlib
+import random
+import threading
 import uuid
 
+from oslo_context import context as oslo_context
 from oslo_db import api as oslo_db_api
 from oslo_db import exception as db_exc
 from oslo_db.sqlalchemy import enginefacade
@@ -27,11 +33,14 @@ from oslo_log import log
 from oslo_utils import strutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
+from sqlalchemy import event
 from sqlalchemy.orm import load_only
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import pool
 from sqlalchemy.sql import func
 
 
+from cyborg import context as cyborg_context
 from cyborg.common import exception
 from cyborg.common.i18n import _
 from cyborg.db import api
@@ -39,24 +48,79 @@ from cyborg.db.sqlalchemy import models
 from sqlalchemy import or_
 from sqlalchemy import and_
 
-_CONTEXT = threading.local()
 LOG = log.getLogger(__name__)
 MYLOG = LOG
 
 main_context_manager = enginefacade.transaction_context()
 
 
+@enginefacade.transaction_context_provider
+class _ThreadContext(threading.local):
+    """Transaction holder for DB API calls made without a RequestContext."""
+
+
+_CONTEXT = _ThreadContext()
+
+
 def get_backend():
     """The backend is this module itself."""
     return Connection()
 
 
-def _session_for_read():
-    return enginefacade.reader.using(_CONTEXT)
+def _txn_context(context):
+    """Return the object that enginefacade transactions are attached to.
 
+    A cyborg RequestContext carries its own transaction, so every DB API call
+    made with the same request context while that transaction is open shares
+    its session and its connection checkout.  Any other context falls back to
+    the thread-local _CONTEXT.
+    """
+    if isinstance(context, cyborg_context.RequestContext):
+        return context
+    return _CONTEXT
+
+
+def _session_for_read(context, use_slave=False):
+    """Start (or join) a read transaction.
+
+    :param context: The request context the transaction is attached to.
+    :param use_slave: If True, read from [database]slave_connection when one
+                      is configured.  A replica may lag behind the primary, so
+                      only use this where reading slightly stale data is fine;
+                      not, for example, right after a write.  Inside a write
+                      transaction, the read always joins that transaction.
+    """
+    if use_slave:
+        return enginefacade.reader.async_.using(_txn_context(context))
+    return enginefacade.reader.using(_txn_context(context))
 
-def _session_for_write():
-    return enginefacade.writer.using(_CONTEXT)
+
+def _session_for_write(context):
+    return enginefacade.writer.using(_txn_context(context))
+
+
+def _reader(f):
+    """Run a Connection read method inside a read transaction.
+
+    The transaction honours the method's use_slave keyword argument, and joins
+    any transaction already open on the same context.
+    """
+    @functools.wraps(f)
+    def wrapper(self, context, *args, **kwargs):
+        with _session_for_read(context,
+                               use_slave=kwargs.get('use_slave', False)):
+            return f(self, context, *args, **kwargs)
+    return wrapper
+
+
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    """Count a pool checkout against the current request context."""
+    ctx = oslo_context.get_current()
+    if isinstance(ctx, cyborg_context.RequestContext):
+        ctx.db_checkouts += 1
+
+
+event.listen(pool.Pool, 'checkout', _count_checkout)
 
 
 def get_session(use_slave=False, **kwargs):
@@ -67,6 +131,11 @@ def get_session(use_slave=False, **kwargs):
 def model_query(context, model, *args, **kwargs):
     """Query helper for simpler session usage.
 
+    The query is bound to the session of the transaction currently open on
+    context (see _session_for_read and _session_for_write), so it must be
+    built and run inside that transaction.  Raises NoEngineContextEstablished
+    if there is none.
+
     :param context: Context of the query
     :param model: Model to query. Must be a subclass of ModelBase.
     :param args: Arguments to query. If None - model is used.
@@ -83,10 +152,8 @@ def model_query(context, model, *args, **kwargs):
     if kwargs.pop("project_only", False):
         kwargs["project_id"] = context.tenant
 
-    with _session_for_read() as session:
-        query = sqlalchemyutils.model_query(
-            model, session, args, **kwargs)
-        return query
+    session = _txn_context(context).session
+    return sqlalchemyutils.model_query(model, session, args, **kwargs)
 
 
 def add_identity_filter(query, value):
@@ -107,6 +174,100 @@ def add_identity_filter(query, value):
         raise exception.InvalidIdentity(identity=value)
 
 
+# Rows per statement for the bulk upsert DB APIs.  Large enough to amortise
+# round trips, small enough to stay under bind-parameter and packet limits.
+_BULK_UPSERT_CHUNK_SIZE = 500
+
+# Free attach handles read per claim attempt, and attempts before giving up
+# when every candidate is taken by concurrent allocators.
+_ATTACH_HANDLE_CANDIDATES = 8
+_ATTACH_HANDLE_CLAIM_ATTEMPTS = 5
+
+# Dialects with a native upsert, mapped to the module providing its insert().
+_UPSERT_DIALECTS = {'mysql': 'mysql',
+                    'mariadb': 'mysql',
+                    'postgresql': 'postgresql',
+                    'sqlite': 'sqlite'}
+
+
+def _upsert_statement(dialect_name, model, update_columns):
+    """Return a native upsert of one row keyed on uuid, or None.
+
+    None means the dialect (or the installed SQLAlchemy) has no native upsert,
+    and the caller must fall back to select-then-insert/update.
+    """
+    module_name = _UPSERT_DIALECTS.get(dialect_name)
+    if module_name is None:
+        return None
+    try:
+        module = importlib.import_module('sqlalchemy.dialects.' + module_name)
+    except ImportError:
+        return None
+    insert = getattr(module, 'insert', None)
+    if insert is None:
+        return None
+
+    stmt = insert(model.__table__)
+    if module_name == 'mysql':
+        if not hasattr(stmt, 'on_duplicate_key_update'):
+            return None
+        updates = {c: stmt.inserted[c] for c in update_columns}
+        updates['updated_at'] = timeutils.utcnow()
+        return stmt.on_duplicate_key_update(**updates)
+    if not hasattr(stmt, 'on_conflict_do_update'):
+        return None
+    updates = {c: stmt.excluded[c] for c in update_columns}
+    updates['updated_at'] = timeutils.utcnow()
+    return stmt.on_conflict_do_update(index_elements=['uuid'], set_=updates)
+
+
+def _bulk_upsert(context, model, values_list, chunk_size=None):
+    """Insert or update rows of model, matched on uuid, in one transaction.
+
+    Rows are written chunk_size at a time; rows in a chunk that set the same
+    columns go in a single executemany.  A row without a uuid gets a new one.
+    Returns the uuids in input order.
+    """
+    chunk_size = chunk_size or _BULK_UPSERT_CHUNK_SIZE
+    rows = []
+    for values in values_list:
+        row = dict(values)
+        row.pop('id', None)
+        if not row.get('uuid'):
+            row['uuid'] = uuidutils.generate_uuid()
+        rows.append(row)
+
+    with _session_for_write(context) as session:
+        dialect_name = session.bind.dialect.name
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            by_columns = collections.OrderedDict()
+            for row in chunk:
+                by_columns.setdefault(tuple(sorted(row)), []).append(row)
+            for columns, group in by_columns.items():
+                update_columns = [c for c in columns if c != 'uuid']
+                stmt = _upsert_statement(dialect_name, model, update_columns)
+                if stmt is not None:
+                    session.execute(stmt, group)
+                else:
+                    _generic_upsert(session, model, group)
+    return [row['uuid'] for row in rows]
+
+
+def _generic_upsert(session, model, rows):
+    """Upsert rows on a dialect without a native upsert."""
+    existing = dict(session.query(model.uuid, model.id).filter(
+        model.uuid.in_([row['uuid'] for row in rows])))
+    now = timeutils.utcnow()
+    inserts = [row for row in rows if row['uuid'] not in existing]
+    updates = [dict(row, id=existing[row['uuid']], updated_at=now)
+               for row in rows if row['uuid'] in existing]
+    if inserts:
+        session.bulk_insert_mappings(model, inserts)
+    if updates:
+        session.bulk_update_mappings(model, updates)
+
+
 def _paginate_query(context, model, limit, marker, sort_key, sort_dir, query):
     sort_keys = ['id']
     if sort_key and sort_key not in sort_keys:
@@ -128,6 +289,9 @@ class Connection(api.Connection):
     def __init__(self):
         pass
 
+    def read_transaction(self, context, use_slave=False):
+        return _session_for_read(context, use_slave=use_slave)
+
     def deployable_create(self, context, values):
         raise NotImplementedError() # TODO
         if not values.get('uuid'):
@@ -137,7 +301,7 @@ class Connection(api.Connection):
         deployable = models.Deployable()
         deployable.update(values)
 
-        with _session_for_write() as session:
+        with _session_for_write(context) as session:
             try:
                 session.add(deployable)
                 session.flush()
@@ -145,8 +309,13 @@ class Connection(api.Connection):
                 raise exception.DeployableAlreadyExists(uuid=values['uuid'])
             return deployable
 
-    def deployable_get(self, context, uuid):
-        raise NotImplementedError() # TODO
+    def deployable_bulk_upsert(self, context, values_list, chunk_size=None):
+        """Create or update many deployables, matched on uuid."""
+        return _bulk_upsert(context, models.Deployable, values_list,
+                            chunk_size=chunk_size)
+
+    @_reader
+    def deployable_get(self, context, uuid, use_slave=False):
         query = model_query(
             context,
             models.Deployable).filter_by(uuid=uuid)
@@ -155,6 +324,7 @@ class Connection(api.Connection):
         except NoResultFound:
             raise exception.DeployableNotFound(uuid=uuid)
 
+    @_reader
     def deployable_get_by_host(self, context, host):
         raise NotImplementedError() # TODO
         query = model_query(
@@ -162,7 +332,8 @@ class Connection(api.Connection):
             models.Deployable).filter_by(host=host)
         return query.all()
 
-    def deployable_list(self, context):
+    @_reader
+    def deployable_list(self, context, use_slave=False):
         raise NotImplementedError() # TODO
         query = model_query(context, models.Deployable)
         return query.all()
@@ -181,7 +352,7 @@ class Connection(api.Connection):
 
     @oslo_db_api.retry_on_deadlock
     def _do_update_deployable(self, context, uuid, values):
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.Deployable)
             # query = add_identity_filter(query, uuid)
             query = query.filter_by(uuid=uuid)
@@ -196,7 +367,7 @@ class Connection(api.Connection):
     @oslo_db_api.retry_on_deadlock
     def deployable_delete(self, context, uuid):
         raise NotImplementedError() # TODO
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.Deployable)
             query = add_identity_filter(query, uuid)
             query.update({'root_uuid': None})
@@ -204,8 +375,9 @@ class Connection(api.Connection):
             if count != 1:
                 raise exception.DeployableNotFound(uuid=uuid)
 
+    @_reader
     def deployable_get_by_filters_with_attributes(self, context,
-                                                  filters):
+                                                  filters, use_slave=False):
         raise NotImplementedError() # TODO
 
         exact_match_filter_names = ['uuid', 'name',
@@ -238,10 +410,12 @@ class Connection(api.Connection):
         deployables = query_prefix.all()
         return deployables
 
+    @_reader
     def deployable_get_by_filters(self, context,
                                   filters, sort_key='created_at',
                                   sort_dir='desc', limit=None,
-                                  marker=None, join_columns=None):
+                                  marker=None, join_columns=None,
+                                  use_slave=False):
         """Return list of deployables matching all filters sorted by
         the sort_key. See deployable_get_by_filters_sort for
         more information.
@@ -251,7 +425,8 @@ class Connection(api.Connection):
                                                    limit=limit, marker=marker,
                                                    join_columns=join_columns,
                                                    sort_key=sort_key,
-                                                   sort_dir=sort_dir)
+                                                   sort_dir=sort_dir,
+                                                   use_slave=use_slave)
 
     def _exact_deployable_filter_with_attributes(self, query,
                                                  dpl_filters, legal_keys,
@@ -337,9 +512,11 @@ class Connection(api.Connection):
                                    for k, v in filter_dict.items()])
         return query
 
+    @_reader
     def deployable_get_by_filters_sort(self, context, filters, limit=None,
                                        marker=None, join_columns=None,
-                                       sort_key=None, sort_dir=None):
+                                       sort_key=None, sort_dir=None,
+                                       use_slave=False):
         """Return deployables that match all filters sorted by the given
         keys. Deleted deployables will be returned by default, unless
         there's a filter that says otherwise.
@@ -378,7 +555,7 @@ class Connection(api.Connection):
         attribute = models.Attribute()
         attribute.update(values)
 
-        with _session_for_write() as session:
+        with _session_for_write(context) as session:
             try:
                 session.add(attribute)
                 session.flush()
@@ -387,7 +564,8 @@ class Connection(api.Connection):
                     uuid=values['uuid'])
             return attribute
 
-    def attribute_get(self, context, uuid):
+    @_reader
+    def attribute_get(self, context, uuid, use_slave=False):
         raise NotImplementedError() # TODO
         query = model_query(
             context,
@@ -397,14 +575,17 @@ class Connection(api.Connection):
         except NoResultFound:
             raise exception.AttributeNotFound(uuid=uuid)
 
-    def attribute_get_by_deployable_id(self, context, deployable_id):
+    @_reader
+    def attribute_get_by_deployable_id(self, context, deployable_id,
+                                       use_slave=False):
         raise NotImplementedError() # TODO
         query = model_query(
             context,
             models.Attribute).filter_by(deployable_id=deployable_id)
         return query.all()
 
-    def attribute_get_by_filter(self, context, filters):
+    @_reader
+    def attribute_get_by_filter(self, context, filters, use_slave=False):
         raise NotImplementedError() # TODO
         """Return attributes that matches the filters
         """
@@ -439,7 +620,7 @@ class Connection(api.Connection):
     @oslo_db_api.retry_on_deadlock
     def _do_update_attribute(self, context, uuid, key, value):
         update_fields = {'key': key, 'value': value}
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.Attribute)
             query = add_identity_filter(query, uuid)
             try:
@@ -452,13 +633,108 @@ class Connection(api.Connection):
 
     def attribute_delete(self, context, uuid):
         raise NotImplementedError() # TODO
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.Attribute)
             query = add_identity_filter(query, uuid)
             count = query.delete()
             if count != 1:
                 raise exception.AttributeNotFound(uuid=uuid)
 
+    def attach_handle_allocate(self, context, device_id):
+        """Claim a free attach handle of a device and return it.
+
+        A few free handles are read through the (device_id, in_use) index,
+        then claimed with a compare-and-set UPDATE ... WHERE in_use = false,
+        so concurrent allocators never get the same handle and never take
+        more than row locks. Where supported, rows locked by another
+        allocator are skipped rather than waited for.
+        """
+        for attempt in range(_ATTACH_HANDLE_CLAIM_ATTEMPTS):
+            with _session_for_write(context):
+                free_ids = [row.id for row in model_query(
+                    context, models.AttachHandle,
+                    models.AttachHandle.id).filter_by(
+                    device_id=device_id, in_use=False).limit(
+                    _ATTACH_HANDLE_CANDIDATES).with_for_update(
+                    skip_locked=True)]
+                if not free_ids:
+                    raise exception.AttachHandleNotAvailable(
+                        device_id=device_id)
+                # Spread concurrent allocators over the candidates so they
+                # do not all race for the first free handle.
+                random.shuffle(free_ids)
+                for handle_id in free_ids:
+                    claimed = model_query(
+                        context, models.AttachHandle).filter_by(
+                        id=handle_id, in_use=False).update(
+                        {'in_use': True}, synchronize_session=False)
+                    if claimed:
+                        return model_query(
+                            context, models.AttachHandle).filter_by(
+                            id=handle_id).one()
+            LOG.debug("Lost the race for attach handles %(ids)s of device "
+                      "%(device)s, retrying", {'ids': free_ids,
+                                               'device': device_id})
+        raise exception.AttachHandleNotAvailable(device_id=device_id)
+
+    def attach_handle_release(self, context, handle_id):
+        """Mark an attach handle free. Releasing a free handle is a no-op."""
+        with _session_for_write(context):
+            count = model_query(context, models.AttachHandle).filter_by(
+                id=handle_id).update({'in_use': False},
+                                     synchronize_session=False)
+            if not count:
+                raise exception.AttachHandleNotFound(id=handle_id)
+
+    def extarq_attach_handle(self, context, uuid, deployable_uuid):
+        """Claim an attach handle of a deployable's device for an ExtARQ.
+
+        The claim and the ExtARQ's attach_handle_id and deployable_id are
+        written in one transaction, so no handle stays claimed without an
+        ExtARQ holding it, and quota_usage_count sees the ExtARQ as using
+        the deployable.  A handle the ExtARQ already held is released.
+        """
+        with _session_for_write(context):
+            extarq = self._extarq_for_update(context, uuid)
+            deployable = model_query(
+                context, models.Deployable, models.Deployable.id,
+                models.Deployable.device_id).filter_by(
+                uuid=deployable_uuid).first()
+            if deployable is None:
+                raise exception.DeployableNotFound(uuid=deployable_uuid)
+            if extarq.attach_handle_id is not None:
+                self.attach_handle_release(context, extarq.attach_handle_id)
+            handle = self.attach_handle_allocate(context,
+                                                 deployable.device_id)
+            extarq.attach_handle_id = handle.id
+            extarq.deployable_id = deployable.id
+            return handle
+
+    def extarq_detach_handle(self, context, uuid):
+        """Release the attach handle an ExtARQ holds, if any.
+
+        The ExtARQ stops counting against its project's quota too.
+        """
+        with _session_for_write(context):
+            extarq = self._extarq_for_update(context, uuid)
+            if extarq.attach_handle_id is not None:
+                self.attach_handle_release(context, extarq.attach_handle_id)
+                extarq.attach_handle_id = None
+            extarq.deployable_id = None
+
+    def _extarq_for_update(self, context, uuid):
+        query = model_query(context, models.ExtARQ).filter_by(uuid=uuid)
+        try:
+            return query.with_for_update().one()
+        except NoResultFound:
+            raise RuntimeError('No ExtARQ found with UUID %s' % uuid)
+
+    def attribute_bulk_upsert(self, context, values_list, chunk_size=None):
+        """Create or update many attributes, matched on uuid."""
+        return _bulk_upsert(context, models.Attribute, values_list,
+                            chunk_size=chunk_size)
+
+    @_reader
     def _get_quota_usages(self, context, project_id, resources=None):
         # Broken out for testability
         query = model_query(context, models.QuotaUsage,).filter_by(
@@ -470,32 +746,7 @@ class Connection(api.Connection):
             with_for_update().all()
         return {row.resource: row for row in rows}
 
-    def _quota_usage_create(self, project_id, resource, until_refresh,
-                            in_use, reserved, session=None):
-
-        quota_usage_ref = models.QuotaUsage()
-        quota_usage_ref.project_id = project_id
-        quota_usage_ref.resource = resource
-        quota_usage_ref.in_use = in_use
-        quota_usage_ref.reserved = reserved
-        quota_usage_ref.until_refresh = until_refresh
-        quota_usage_ref.save(session=session)
-
-        return quota_usage_ref
-
-    def _reservation_create(self, uuid, usage, project_id, resource, delta,
-                            expire, session=None):
-        usage_id = usage['id'] if usage else None
-        reservation_ref = models.Reservation()
-        reservation_ref.uuid = uuid
-        reservation_ref.usage_id = usage_id
-        reservation_ref.project_id = project_id
-        reservation_ref.resource = resource
-        reservation_ref.delta = delta
-        reservation_ref.expire = expire
-        reservation_ref.save(session=session)
-        return reservation_ref
-
+    @_reader
     def _get_reservation_resources(self, context, reservation_ids):
         """Return the relevant resources by reservations."""
 
@@ -511,128 +762,366 @@ class Connection(api.Connection):
         # Get the listed reservations
         return model_query(context, models.Reservation). \
             filter(models.Reservation.uuid.in_(reservations)). \
-            with_lockmode('update'). \
+            with_for_update(). \
             all()
 
     def quota_reserve(self, context, resources, deltas, expire,
                       until_refresh, max_age, project_id=None,
                       is_allocated_reserve=False):
-        """ Create reservation record in DB according to params"""
-        with _session_for_write() as session:
+        """ Create reservation record in DB according to params
+
+        The usages and reservations are worked out in memory and written
+        with at most one bulk INSERT of new usages, one bulk UPDATE of
+        existing usages and one bulk INSERT of reservations, however many
+        resources are reserved.
+        """
+        with _session_for_write(context) as session:
             if project_id is None:
                 project_id = context.project_id
             usages = self._get_quota_usages(context, project_id,
                                             resources=deltas.keys())
-            work = set(deltas.keys())
-            while work:
-                resource = work.pop()
-
-                # Do we need to refresh the usage?
-                refresh = False
-                # create quota usage in DB if there is no record of this type
-                # of resource
-                if resource not in usages:
-                    usages[resource] = self._quota_usage_create(
-                           project_id, resource, until_refresh or None,
-                           in_use=0, reserved=0, session=session)
-                    refresh = True
-                elif usages[resource].in_use < 0:
+            now = timeutils.utcnow()
+            values = {}
+            refresh = set()
+            for resource in deltas:
+                usage = usages.get(resource)
+                # create quota usage in DB if there is no record of this
+                # type of resource
+                if usage is None:
+                    values[resource] = {'in_use': 0, 'reserved': 0,
+                                        'until_refresh': None}
+                    refresh.add(resource)
+                    continue
+                values[resource] = {'in_use': usage.in_use,
+                                    'reserved': usage.reserved,
+                                    'until_refresh': usage.until_refresh}
+                if usage.in_use < 0:
                     # Negative in_use count indicates a desync, so try to
                     # heal from that...
-                    refresh = True
-                elif usages[resource].until_refresh is not None:
-                    usages[resource].until_refresh -= 1
-                    if usages[resource].until_refresh <= 0:
-                        refresh = True
-                elif max_age and usages[resource].updated_at is not None and (
-                    (timeutils.utcnow() -
-                        usages[resource].updated_at).total_seconds() >=
-                        max_age):
-                    refresh = True
-
-                # refresh the usage
-                if refresh:
-                    # Grab the sync routine
-                    updates= self._sync_acc_res(context, resource, project_id)
-                    for res, in_use in updates.items():
-                        # Make sure we have a destination for the usage!
-                        if res not in usages:
-                            usages[res] = self._quota_usage_create(
-                                project_id,
-                                res,
-                                until_refresh or None,
-                                in_use=0,
-                                reserved=0,
-                                session=session
-                            )
-
-                        # Update the usage
-                        usages[res].in_use = in_use
-                        usages[res].until_refresh = until_refresh or None
-
-                        # Because more than one resource may be refreshed
-                        # by the call to the sync routine, and we don't
-                        # want to double-sync, we make sure all refreshed
-                        # resources are dropped from the work set.
-                        work.discard(res)
-
-                        # NOTE(Vek): We make the assumption that the sync
-                        #            routine actually refreshes the
-                        #            resources that it is the sync routine
-                        #            for.  We don't check, because this is
-                        #            a best-effort mechanism.
+                    refresh.add(resource)
+                elif usage.until_refresh is not None:
+                    values[resource]['until_refresh'] -= 1
+                    if values[resource]['until_refresh'] <= 0:
+                        refresh.add(resource)
+                elif max_age and usage.updated_at is not None and (
+                    (now - usage.updated_at).total_seconds() >= max_age):
+                    refresh.add(resource)
+
+            # refresh the usages, all with one count query
+            if refresh:
+                counts = self.quota_usage_count(
+                    context, project_id=project_id,
+                    resources=refresh).get(project_id, {})
+                for resource in refresh:
+                    values[resource]['in_use'] = counts.get(resource, 0)
+                    values[resource]['until_refresh'] = until_refresh or None
 
             unders = [r for r, delta in deltas.items()
-                      if delta < 0 and delta + usages[r].in_use < 0]
-            reservations = []
+                      if delta < 0 and delta + values[r]['in_use'] < 0]
             for resource, delta in deltas.items():
-                usage = usages[resource]
-                reservation = self._reservation_create(
-                    str(uuid.uuid4()), usage, project_id, resource,
-                    delta, expire, session=session)
-                reservations.append(reservation.uuid)
-                usages[resource].reserved += delta
-            session.flush()
+                values[resource]['reserved'] += delta
+
+            usage_ids = {r: usage.id for r, usage in usages.items()}
+            new_usages = [dict(v, project_id=project_id, resource=r)
+                          for r, v in values.items() if r not in usages]
+            if new_usages:
+                session.bulk_insert_mappings(models.QuotaUsage, new_usages)
+                usage_ids.update(model_query(
+                    context, models.QuotaUsage, models.QuotaUsage.resource,
+                    models.QuotaUsage.id).filter(
+                    models.QuotaUsage.project_id == project_id,
+                    models.QuotaUsage.resource.in_(
+                        [u['resource'] for u in new_usages])))
+            if usages:
+                session.bulk_update_mappings(
+                    models.QuotaUsage,
+                    [dict(values[r], id=usage.id)
+                     for r, usage in usages.items()])
+
+            reservations = [{'uuid': str(uuid.uuid4()),
+                             'usage_id': usage_ids[resource],
+                             'project_id': project_id,
+                             'resource': resource,
+                             'delta': delta,
+                             'expire': expire}
+                            for resource, delta in deltas.items()]
+            session.bulk_insert_mappings(models.Reservation, reservations)
         if unders:
             LOG.warning("Change will make usage less than 0 for the "
                         "following resources: %s", unders)
-        return reservations
-
-    def _sync_acc_res(self, context, resource, project_id):
-        """Quota sync funciton"""
-        res_in_use = self._accelerator_data_get_for_project(context, resource,
-                                                            project_id)
-        return {resource: res_in_use}
+        return [r['uuid'] for r in reservations]
 
     def _accelerator_data_get_for_project(self, context, resource,project_id):
         """Return the number of resource which is being used by a project"""
-        raise NotImplementedError()
-        query = model_query(context, models.Accelerator).\
-            filter_by(project_id=project_id).filter_by(device_type=resource)
-
-        return query.count()
-
-    def _dict_with_usage_id(self, usages):
-        return {row.id: row for row in usages.values()}
+        counts = self.quota_usage_count(context, project_id=project_id,
+                                        resources=[resource])
+        return counts.get(project_id, {}).get(resource, 0)
+
+    @_reader
+    def quota_usage_count(self, context, project_id=None, resources=None,
+                          use_slave=False):
+        """Count accelerators in use, by project and resource.
+
+        An accelerator is in use while an ExtARQ of the project is bound to
+        a deployable; the resource is the lower-cased type of the
+        deployable's device, e.g. 'fpga'.  All counts come from one grouped
+        query.
+
+        :param project_id: Only count this project; all projects if None.
+        :param resources: Only count these resources; all if None.
+        :returns: dict of project_id to a dict of resource to count.
+        """
+        resource = func.lower(models.Device.type)
+        query = model_query(context, models.ExtARQ,
+                            models.ExtARQ.project_id, resource,
+                            func.count(models.ExtARQ.id)).join(
+            models.Deployable,
+            models.ExtARQ.deployable_id == models.Deployable.id).join(
+            models.Device, models.Deployable.device_id == models.Device.id)
+        if project_id is not None:
+            query = query.filter(models.ExtARQ.project_id == project_id)
+        if resources is not None:
+            query = query.filter(resource.in_(list(resources)))
+        counts = collections.defaultdict(dict)
+        for row_project_id, row_resource, count in query.group_by(
+                models.ExtARQ.project_id, resource):
+            counts[row_project_id][row_resource] = count
+        return dict(counts)
+
+    def _finish_reservations(self, context, session, reservation_rows,
+                             commit):
+        """Apply reservations to their usages and delete them.
+
+        Committing moves each delta from reserved to in_use; rolling back
+        only takes it off reserved.  Either way the usages get one bulk
+        UPDATE and the reservations one DELETE.
+        """
+        usages = {}
+        for usage in model_query(context, models.QuotaUsage).filter(
+                models.QuotaUsage.id.in_(
+                    {r.usage_id for r in reservation_rows})).with_for_update():
+            usages[usage.id] = {'id': usage.id, 'in_use': usage.in_use,
+                                'reserved': usage.reserved}
+        for reservation in reservation_rows:
+            usage = usages.get(reservation.usage_id)
+            if usage is None:
+                continue
+            if not commit:
+                # quota_reserve added every delta, negative ones included.
+                usage['reserved'] -= reservation.delta
+                continue
+            if reservation.delta >= 0:
+                usage['reserved'] -= reservation.delta
+            usage['in_use'] += reservation.delta
+        if usages:
+            session.bulk_update_mappings(models.QuotaUsage,
+                                         list(usages.values()))
+        model_query(context, models.Reservation).filter(
+            models.Reservation.id.in_([r.id for r in reservation_rows])
+        ).delete(synchronize_session=False)
 
     def reservation_commit(self, context, reservations, project_id=None):
         """Commit quota reservation to quota usage table"""
-        with _session_for_write() as session:
-            quota_usage = self._get_quota_usages(
-                context, project_id,
-                resources=self._get_reservation_resources(context,
-                                                          reservations))
-            usages = self._dict_with_usage_id(quota_usage)
-
-            for reservation in self._quota_reservations(session, context,
-                                                        reservations):
-
-                usage = usages[reservation.usage_id]
-                if reservation.delta >= 0:
-                    usage.reserved -= reservation.delta
-                usage.in_use += reservation.delta
-                session.flush()
-                reservation.delete(session=session)
+        with _session_for_write(context) as session:
+            rows = self._quota_reservations(session, context, reservations)
+            if rows:
+                self._finish_reservations(context, session, rows, commit=True)
+
+    def reservation_rollback(self, context, reservations, project_id=None):
+        """Release quota reservations without using them"""
+        with _session_for_write(context) as session:
+            rows = self._quota_reservations(session, context, reservations)
+            if rows:
+                self._finish_reservations(context, session, rows,
+                                          commit=False)
+
+    def reservation_expire(self, context, batch_size=1000):
+        """Roll back and delete reservations past their expiry time.
+
+        Works through the expired reservations batch_size at a time, one
+        write transaction per batch, so the sweep never holds locks for
+        long.  Returns the number of reservations deleted.
+        """
+        now = timeutils.utcnow()
+        total = 0
+        while True:
+            with _session_for_write(context) as session:
+                rows = model_query(context, models.Reservation).filter(
+                    models.Reservation.expire < now).order_by(
+                    models.Reservation.id).limit(batch_size).with_for_update(
+                    ).all()
+                if rows:
+                    self._finish_reservations(context, session, rows,
+                                              commit=False)
+            total += len(rows)
+            if len(rows) < batch_size:
+                return total
+
+    def quota_usage_refresh(self, context):
+        """Set in_use of every quota usage from the bound ExtARQs.
+
+        The counts for all projects come from one grouped query, read with
+        the usages and without locks to find the projects that drifted.
+        Each of those is then fixed in its own short write transaction,
+        which locks only that project's usages, so the sweep never holds
+        up quota_reserve for the other projects.  Returns the number of
+        usage rows created or changed.
+        """
+        with _session_for_read(context):
+            counts = self.quota_usage_count(context)
+            drifted = set()
+            for project_id, resource, in_use in model_query(
+                    context, models.QuotaUsage, models.QuotaUsage.project_id,
+                    models.QuotaUsage.resource, models.QuotaUsage.in_use):
+                if counts.get(project_id, {}).pop(resource, 0) != in_use:
+                    drifted.add(project_id)
+        # Whatever is left counted has no usage row yet.
+        drifted.update(project_id for project_id, resources in counts.items()
+                       if resources)
+        return sum(self._quota_usage_refresh_project(context, project_id)
+                   for project_id in sorted(drifted))
+
+    def _quota_usage_refresh_project(self, context, project_id):
+        """Set in_use of one project's quota usages from its ExtARQs."""
+        with _session_for_write(context) as session:
+            usages = model_query(context, models.QuotaUsage).filter_by(
+                project_id=project_id).with_for_update().all()
+            counts = self.quota_usage_count(
+                context, project_id=project_id).get(project_id, {})
+            updates = []
+            for usage in usages:
+                in_use = counts.pop(usage.resource, 0)
+                if usage.in_use != in_use:
+                    updates.append({'id': usage.id, 'in_use': in_use})
+            inserts = [{'project_id': project_id, 'resource': resource,
+                        'in_use': in_use, 'reserved': 0}
+                       for resource, in_use in counts.items()]
+            if updates:
+                session.bulk_update_mappings(models.QuotaUsage, updates)
+            if inserts:
+                session.bulk_insert_mappings(models.QuotaUsage, inserts)
+        return len(updates) + len(inserts)
+
+    def conductor_heartbeat(self, context, hostname):
+        """Record that a conductor is alive, registering it if needed."""
+        now = timeutils.utcnow()
+        with _session_for_write(context) as session:
+            count = model_query(context, models.Conductor).filter_by(
+                hostname=hostname).update({'updated_at': now},
+                                          synchronize_session=False)
+            if not count:
+                conductor = models.Conductor(hostname=hostname,
+                                             updated_at=now)
+                conductor.save(session)
+
+    def conductor_unregister(self, context, hostname):
+        with _session_for_write(context):
+            model_query(context, models.Conductor).filter_by(
+                hostname=hostname).delete(synchronize_session=False)
+
+    @_reader
+    def conductor_get_active(self, context, timeout, use_slave=False):
+        """Return the sorted hostnames of conductors with a fresh heartbeat.
+
+        :param timeout: seconds after its last heartbeat that a conductor
+                        is considered dead.
+        """
+        since = timeutils.utcnow() - datetime.timedelta(seconds=timeout)
+        query = model_query(context, models.Conductor,
+                            models.Conductor.hostname).filter(
+            models.Conductor.updated_at >= since).order_by(
+            models.Conductor.hostname)
+        return [row.hostname for row in query]
+
+    @_reader
+    def device_hostnames(self, context, use_slave=False):
+        query = model_query(context, models.Device,
+                            models.Device.hostname).distinct().order_by(
+            models.Device.hostname)
+        return [row.hostname for row in query]
+
+    def attach_handle_reconcile(self, context, hostname):
+        """Release the in-use attach handles of a host no ExtARQ holds.
+
+        Such handles are left behind when a claim is not followed by the
+        ExtARQ update recording it, and would otherwise never be free
+        again.
+        """
+        with _session_for_write(context):
+            devices = model_query(context, models.Device,
+                                  models.Device.id).filter_by(
+                hostname=hostname)
+            held = model_query(context, models.ExtARQ,
+                               models.ExtARQ.attach_handle_id).filter(
+                models.ExtARQ.attach_handle_id.isnot(None))
+            return model_query(context, models.AttachHandle).filter_by(
+                in_use=True).filter(
+                models.AttachHandle.device_id.in_(devices),
+                ~models.AttachHandle.id.in_(held)).update(
+                {'in_use': False}, synchronize_session=False)
+
+    def _bump_table_version(self, context, table):
+        """Count a change to table once the change commits.
+
+        Must be called inside the write transaction making the change.  The
+        counter in table_versions is bumped in its own short transaction
+        after that one commits, so writers never hold the table's shared
+        counter row locked while their transaction is open; nothing is
+        counted if the change rolls back.
+        """
+        session = _txn_context(context).session
+        tables = session.info.setdefault('changed_tables', set())
+        if not tables:
+            event.listen(session, 'after_commit', self._commit_table_versions,
+                         once=True)
+        tables.add(table)
+
+    def _commit_table_versions(self, session):
+        for table in sorted(session.info.pop('changed_tables', ())):
+            try:
+                with enginefacade.writer.independent.using(
+                        _ThreadContext()) as bump_session:
+                    count = bump_session.query(models.TableVersion).filter_by(
+                        name=table).update(
+                        {'version': models.TableVersion.version + 1},
+                        synchronize_session=False)
+                    if not count:
+                        models.TableVersion(name=table, version=1).save(
+                            bump_session)
+            except db_exc.DBError:
+                # The change is committed; until the next change to the
+                # table, list responses keep their old ETag.
+                LOG.exception("Failed to bump the version of table %s",
+                              table)
+
+    @_reader
+    def table_versions_get(self, context, tables, use_slave=False):
+        """Return the version of each of tables, by name.
+
+        A table's version changes with every create, update or delete of
+        its rows made through this API, so together they identify the
+        contents of the collections read from them.  Tables never changed
+        have version 0.
+        """
+        query = model_query(context, models.TableVersion,
+                            models.TableVersion.name,
+                            models.TableVersion.version).filter(
+            models.TableVersion.name.in_(tables))
+        versions = dict.fromkeys(tables, 0)
+        versions.update((row.name, row.version) for row in query)
+        return versions
+
+    def _stream(self, context, build_query, batch_size, use_slave):
+        """Yield the rows of build_query() batch_size at a time.
+
+        The query is built and run inside a read transaction that stays
+        open while the generator is suspended, and is closed when the
+        generator is exhausted or closed.
+        """
+        with _session_for_read(context, use_slave=use_slave):
+            query = build_query().execution_options(stream_results=True)
+            for row in query.yield_per(batch_size):
+                yield row
 
     def process_sort_params(self, sort_keys, sort_dirs,
                             default_keys=['created_at', 'id'],
@@ -686,15 +1175,17 @@ class Connection(api.Connection):
         devprof = models.DeviceProfile()
         devprof.update(values)
 
-        with _session_for_write() as session:
+        with _session_for_write(context) as session:
             try:
                 session.add(devprof)
                 session.flush()
             except db_exc.DBDuplicateEntry:
                 raise RuntimeError() # TODO use specific exception
+            self._bump_table_version(context, 'device_profiles')
             return devprof
 
-    def device_profile_get(self, context, name):
+    @_reader
+    def device_profile_get(self, context, name, use_slave=False):
         query = model_query(context,
                    models.DeviceProfile).filter_by(name=name)
         try:
@@ -702,7 +1193,8 @@ class Connection(api.Connection):
         except NoResultFound:
             raise RuntimeError() # TODO use specific exception
 
-    def device_profile_get_by_id(self, context, id):
+    @_reader
+    def device_profile_get_by_id(self, context, id, use_slave=False):
         query = model_query(context,
                    models.DeviceProfile).filter_by(id=id)
         try:
@@ -710,9 +1202,29 @@ class Connection(api.Connection):
         except NoResultFound:
             raise RuntimeError('No device profile with id (%s)' % id)
 
-    def device_profile_list(self, context):
-        query = model_query(context, models.DeviceProfile)
-        return query.all()
+    @_reader
+    def device_profile_list(self, context, use_slave=False, columns=None):
+        """Return all device profiles.
+
+        :param columns: if given, return a tuple of just these columns per
+                        device profile instead of models.
+        """
+        return self._device_profile_query(context, columns).all()
+
+    def device_profile_stream(self, context, columns, batch_size=1000,
+                              use_slave=False):
+        """Iterate over the rows device_profile_list would return.
+
+        See extarq_stream.
+        """
+        return self._stream(
+            context, lambda: self._device_profile_query(context, columns),
+            batch_size, use_slave)
+
+    def _device_profile_query(self, context, columns):
+        return model_query(context, models.DeviceProfile,
+                           *[getattr(models.DeviceProfile, name)
+                             for name in columns or ()])
 
     def device_profile_update(self, context, name, values):
         try:
@@ -722,7 +1234,7 @@ class Connection(api.Connection):
 
     @oslo_db_api.retry_on_deadlock
     def _do_update_device_profile(self, context, name, values):
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.DeviceProfile)
             query = add_identity_filter(query, name)
             try:
@@ -731,15 +1243,17 @@ class Connection(api.Connection):
                 raise RuntimeError() # TODO use specific exception
 
             ref.update(values)
+            self._bump_table_version(context, 'device_profiles')
         return ref
 
     def device_profile_delete(self, context, name):
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.DeviceProfile)
             query = add_identity_filter(query, name)
             count = query.delete()
             if count != 1:
                 raise RuntimeError() # TODO use specific exception
+            self._bump_table_version(context, 'device_profiles')
 
     def extarq_create(self, context, values):
         if not values.get('uuid'):
@@ -755,18 +1269,23 @@ class Connection(api.Connection):
         else:
             raise RuntimeError('Device profile name/id required')
 
+        if not values.get('project_id'):
+            values['project_id'] = context.project_id
+
         extarq = models.ExtARQ()
         extarq.update(values)
 
-        with _session_for_write() as session:
+        with _session_for_write(context) as session:
             try:
                 session.add(extarq)
                 session.flush()
             except db_exc.DBDuplicateEntry:
                 raise RuntimeError('Duplicate ExtARQ')
+            self._bump_table_version(context, 'extarqs')
             return extarq
 
-    def extarq_get(self, context, uuid):
+    @_reader
+    def extarq_get(self, context, uuid, use_slave=False):
         query = model_query(context,
                    models.ExtARQ).filter_by(uuid=uuid)
         try:
@@ -774,9 +1293,75 @@ class Connection(api.Connection):
         except NoResultFound:
             raise RuntimeError('No ExtARQ found with UUID %s' % uuid)
 
-    def extarq_list(self, context):
-        query = model_query(context, models.ExtARQ)
-        return query.all()
+    @_reader
+    def extarq_list(self, context, use_slave=False, filters=None,
+                    columns=None):
+        """Return ExtARQs, optionally matching all of the given filters.
+
+        :param filters: dict of column to value; each of the keys must be
+                        one of the indexed columns 'uuid', 'instance_uuid',
+                        'state', 'host_name' or 'device_profile_id'. A list,
+                        tuple, set or frozenset value matches any of its
+                        elements.
+        :param columns: if given, return a tuple of just these values per
+                        ExtARQ instead of models.  Besides the extarqs
+                        columns, 'device_profile_name' and
+                        'attach_handle_id_pci' are read from the joined
+                        device profile and attach handle.
+        """
+        self._check_extarq_filters(filters)
+        return self._extarq_query(context, filters, columns).all()
+
+    def extarq_stream(self, context, columns, filters=None,
+                      batch_size=1000, use_slave=False):
+        """Iterate over the rows extarq_list would return, in batches.
+
+        The rows are read through a server-side cursor batch_size at a
+        time, in a read transaction that lasts until the iterator is
+        exhausted or closed, so memory use does not grow with the number
+        of ExtARQs.
+        """
+        self._check_extarq_filters(filters)
+        return self._stream(
+            context, lambda: self._extarq_query(context, filters, columns),
+            batch_size, use_slave)
+
+    def _check_extarq_filters(self, filters):
+        for key in filters or {}:
+            if key not in ('uuid', 'instance_uuid', 'state', 'host_name',
+                           'device_profile_id'):
+                raise exception.InvalidParameterValue(
+                    _('Cannot filter ExtARQs by %s') % key)
+
+    def _extarq_query(self, context, filters, columns):
+        if columns is None:
+            query = model_query(context, models.ExtARQ)
+        else:
+            query = self._extarq_columns_query(context, columns)
+        for key, value in (filters or {}).items():
+            column = getattr(models.ExtARQ, key)
+            if isinstance(value, (list, tuple, set, frozenset)):
+                query = query.filter(column.in_(value))
+            else:
+                query = query.filter(column == value)
+        return query
+
+    def _extarq_columns_query(self, context, columns):
+        joined = {'device_profile_name': models.DeviceProfile.name,
+                  'attach_handle_id_pci': models.AttachHandle.info}
+        query = model_query(
+            context, models.ExtARQ,
+            *[joined.get(name) or getattr(models.ExtARQ, name)
+              for name in columns]).select_from(models.ExtARQ)
+        if 'device_profile_name' in columns:
+            query = query.join(
+                models.DeviceProfile,
+                models.ExtARQ.device_profile_id == models.DeviceProfile.id)
+        if 'attach_handle_id_pci' in columns:
+            query = query.outerjoin(
+                models.AttachHandle,
+                models.ExtARQ.attach_handle_id == models.AttachHandle.id)
+        return query
 
     def extarq_update(self, context, uuid, values):
         try:
@@ -786,7 +1371,7 @@ class Connection(api.Connection):
 
     @oslo_db_api.retry_on_deadlock
     def _do_update_extarq(self, context, uuid, values):
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.ExtARQ)
             query = add_identity_filter(query, uuid)
             try:
@@ -795,12 +1380,18 @@ class Connection(api.Connection):
                 raise RuntimeError() # TODO use specific exception
 
             ref.update(values)
+            self._bump_table_version(context, 'extarqs')
         return ref
 
     def extarq_delete(self, context, uuid):
-        with _session_for_write():
+        with _session_for_write(context):
             query = model_query(context, models.ExtARQ)
             query = add_identity_filter(query, uuid)
+            handle_ids = [row.attach_handle_id for row in query.with_entities(
+                models.ExtARQ.attach_handle_id) if row.attach_handle_id]
             count = query.delete()
             if count != 1:
                 raise RuntimeError() # TODO use specific exception
+            for handle_id in handle_ids:
+                self.attach_handle_release(context, handle_id)
+            self._bump_table_version(context, 'extarqs')
@@ -72,6 +72,10 @@ class Device(Base):
        Control Path interfaces, and one or more attach handles.
     """
     __tablename__ = 'devices'
+    __table_args__ = (
+        Index('devices_hostname_idx', 'hostname'),
+        table_args()
+    )
 
     id = Column(Integer, primary_key=True, unique=True)
     # TODO: type should be an enum.
@@ -87,6 +91,7 @@ class Deployable(Base):
     __tablename__ = 'deployables'
     __table_args__ = (
         schema.UniqueConstraint('uuid', name='uniq_deployables0uuid'),
+        Index('deployables_device_id_idx', 'device_id'),
         table_args()
     )
 
@@ -124,6 +129,10 @@ class AttachHandle(Base):
         attached to an instance (VM). E.g. PCI PF.
     """
     __tablename__ = 'attach_handles'
+    __table_args__ = (
+        Index('attach_handles_device_id_in_use_idx', 'device_id', 'in_use'),
+        table_args()
+    )
 
     id = Column(Integer, primary_key=True, unique=True)
     type_name = Column(String(255), nullable=False)
@@ -184,6 +193,7 @@ class Reservation(Base):
         Index('ix_reservations_project_id', 'project_id'),
         Index('reservations_uuid_idx', 'uuid'),
         Index('ix_reservations_user_id', 'user_id'),
+        Index('reservations_expire_idx', 'expire'),
     )
     id = Column(Integer, primary_key=True, nullable=False)
     uuid = Column(String(36), nullable=False)
@@ -202,6 +212,35 @@ class Reservation(Base):
         foreign_keys=usage_id,
         primaryjoin=usage_id == QuotaUsage.id)
 
+
+class Conductor(Base):
+    """A running conductor, kept alive by its heartbeat."""
+
+    __tablename__ = 'conductors'
+    __table_args__ = (
+        schema.UniqueConstraint('hostname',
+                                name='uniq_conductors0hostname'),
+        Index('conductors_updated_at_idx', 'updated_at'),
+        table_args()
+    )
+
+    id = Column(Integer, primary_key=True)
+    hostname = Column(String(255), nullable=False)
+
+
+class TableVersion(Base):
+    """A counter of the changes made to a table, for collection ETags."""
+
+    __tablename__ = 'table_versions'
+    __table_args__ = (
+        schema.UniqueConstraint('name', name='uniq_table_versions0name'),
+        table_args()
+    )
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+
 class DeviceProfile(Base):
     """ A device profile is a set of requirements for accelerators.
         See https://review.openstack.org/#/c/602978/
@@ -232,6 +271,14 @@ class ExtARQ(Base):
     """
 
     __tablename__ = 'extarqs'
+    __table_args__ = (
+        Index('extarqs_instance_uuid_idx', 'instance_uuid'),
+        Index('extarqs_state_idx', 'state'),
+        Index('extarqs_device_profile_id_idx', 'device_profile_id'),
+        Index('extarqs_host_name_idx', 'host_name'),
+        Index('extarqs_project_id_idx', 'project_id'),
+        table_args()
+    )
     id = Column(Integer, primary_key=True, unique=True, nullable=False)
     # ARQ fields begin here
     uuid = Column(String(36), unique=True, nullable=False)
@@ -249,3 +296,5 @@ class ExtARQ(Base):
     deployable_id = Column(Integer,
         ForeignKey('deployables.id', ondelete="RESTRICT"), nullable=True)
     substate = Column(String(255), default='Initial') # TODO shd be enum
+    # Owner of the ARQ, for counting quota usage.
+    project_id = Column(String(255), nullable=True)
@@ -52,26 +52,27 @@ class Attribute(base.CyborgObject, object_base.VersionedObjectDictCompat):
         self._from_db_object(self, db_attr)
 
     @classmethod
-    def get(cls, context, uuid):
+    def get(cls, context, uuid, use_slave=False):
         """Find a DB attribute and return an Obj Deployable."""
         raise NotImplementedError() # HACK
-        db_attr = cls.dbapi.attribute_get(context, uuid)
+        db_attr = cls.dbapi.attribute_get(context, uuid, use_slave=use_slave)
         obj_attr = cls._from_db_object(cls(context), db_attr)
         return obj_attr
 
     @classmethod
-    def get_by_deployable_id(cls, context, deployable_id):
+    def get_by_deployable_id(cls, context, deployable_id, use_slave=False):
         """Get a attribute by deployable_id"""
         raise NotImplementedError() # HACK
-        db_attr = cls.dbapi.attribute_get_by_deployable_id(context,
-                                                           deployable_id)
+        db_attr = cls.dbapi.attribute_get_by_deployable_id(
+            context, deployable_id, use_slave=use_slave)
         return cls._from_db_object_list(db_attr, context)
 
     @classmethod
-    def get_by_filter(cls, context, filters):
+    def get_by_filter(cls, context, filters, use_slave=False):
         """Get a attribute by specified filters"""
         raise NotImplementedError() # HACK
-        db_attr = cls.dbapi.attribute_get_by_filter(context, filters)
+        db_attr = cls.dbapi.attribute_get_by_filter(context, filters,
+                                                    use_slave=use_slave)
         return cls._from_db_object_list(db_attr, context)
 
     def save(self, context):
@@ -23,6 +23,13 @@ from cyborg import objects
 from cyborg.objects import fields as object_fields
 
 
+# Field types a DB column value needs no coercion for.
+_DB_TRUSTED_FIELDS = (object_fields.StringField, object_fields.IntegerField,
+                      object_fields.UUIDField, object_fields.BooleanField)
+_DB_ROW_PLANS = {}
+_NO_DEFAULT = object()
+
+
 class CyborgObjectRegistry(object_base.VersionedObjectRegistry):
     def registration_hook(self, cls, index):
         # NOTE(jroll): blatantly stolen from nova
@@ -85,11 +92,133 @@ class CyborgObject(object_base.VersionedObject):
             objs.append(cls._from_db_object(cls(context), db_obj))
         return objs
 
+    # Values to store instead of a NULL read from the DB, by field name.
+    _db_null_defaults = {}
+
+    @classmethod
+    def _db_row_plan(cls, names):
+        """Return the per-field steps for hydrating rows of names.
+
+        Each step is (attribute name, field name, field, whether to coerce,
+        NULL default).  Fields whose type a DB column already produces,
+        like strings and integers, need no coercion.  The plan is built
+        once per class and column list, then cached.
+        """
+        key = (cls, tuple(names))
+        plan = _DB_ROW_PLANS.get(key)
+        if plan is None:
+            plan = tuple(
+                ('_obj_' + name, name, cls.fields[name],
+                 not isinstance(cls.fields[name], _DB_TRUSTED_FIELDS),
+                 cls._db_null_defaults.get(name, _NO_DEFAULT))
+                for name in names)
+            _DB_ROW_PLANS[key] = plan
+        return plan
+
+    @classmethod
+    def _from_db_rows(cls, context, rows, names):
+        """Build objects from DB rows holding the values of names, in order.
+
+        Unlike _from_db_object, values from trusted columns are stored
+        directly rather than through the field setters, and the objects
+        come out with no changes recorded.
+        """
+        plan = cls._db_row_plan(names)
+        objs = []
+        for row in rows:
+            obj = cls(context)
+            attrs = obj.__dict__
+            for (attr, name, field, coerce, null_default), value in zip(
+                    plan, row):
+                if value is None:
+                    if null_default is not _NO_DEFAULT:
+                        value = null_default
+                    elif not field.nullable:
+                        # Raises the usual ValueError.
+                        value = field.coerce(obj, name, value)
+                elif coerce:
+                    value = field.coerce(obj, name, value)
+                attrs[attr] = value
+            objs.append(obj)
+        return objs
+
+
+COMPACT_KEY = 'cyborg_object.compact'
+
+
+class CompactObjectList(list):
+    """A list of objects that may go over RPC in columnar form.
+
+    RPC endpoints return one when the caller negotiated the compact format
+    (see ConductorAPI version 1.2).  CyborgObjectSerializer then sends the
+    field names once plus one row of values per object, instead of a full
+    primitive with name, namespace, version and changes for every object.
+    """
+
+
+def obj_list_to_compact(objs):
+    """Return the columnar primitive for objs, or None if they don't fit.
+
+    Only a non-empty list of objects of one class and version, with the
+    same fields set and no unsaved changes, can be compacted.
+    """
+    if not objs or not isinstance(objs[0], CyborgObject):
+        return None
+    first = objs[0]
+    cls = type(first)
+    names = [name for name in sorted(cls.fields)
+             if first.obj_attr_is_set(name)]
+    for obj in objs:
+        if (type(obj) is not cls or obj.VERSION != first.VERSION or
+                obj.obj_what_changed() or
+                [name for name in sorted(cls.fields)
+                 if obj.obj_attr_is_set(name)] != names):
+            return None
+    fields = [(name, cls.fields[name]) for name in names]
+    rows = [[field.to_primitive(obj, name, getattr(obj, name))
+             for name, field in fields]
+            for obj in objs]
+    return {COMPACT_KEY: {'name': cls.obj_name(),
+                          'version': first.VERSION,
+                          'fields': names,
+                          'rows': rows}}
+
+
+def obj_list_from_compact(context, primitive):
+    """Rebuild the list of objects sent by obj_list_to_compact()."""
+    data = primitive[COMPACT_KEY]
+    cls = CyborgObject.obj_class_from_name(data['name'], data['version'])
+    fields = [(name, cls.fields[name]) for name in data['fields']]
+    objs = []
+    for row in data['rows']:
+        obj = cls(context)
+        obj.VERSION = data['version']
+        for (name, field), value in zip(fields, row):
+            setattr(obj, name, field.from_primitive(obj, name, value))
+        obj.obj_reset_changes()
+        objs.append(obj)
+    return objs
+
 
 class CyborgObjectSerializer(object_base.VersionedObjectSerializer):
     # Base class to use for object hydration
     OBJ_BASE_CLASS = CyborgObject
 
+    def serialize_entity(self, context, entity):
+        if isinstance(entity, CompactObjectList):
+            primitive = obj_list_to_compact(entity)
+            if primitive is not None:
+                return primitive
+            entity = list(entity)
+        return super(CyborgObjectSerializer, self).serialize_entity(
+            context, entity)
+
+    def deserialize_entity(self, context, entity):
+        if isinstance(entity, dict) and COMPACT_KEY in entity:
+            return obj_list_from_compact(context, entity)
+        return super(CyborgObjectSerializer, self).deserialize_entity(
+            context, entity)
+
 
 CyborgObjectDictCompat = object_base.VersionedObjectDictCompat
 
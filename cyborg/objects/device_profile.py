@@ -51,16 +51,18 @@ class DeviceProfile(base.CyborgObject, object_base.VersionedObjectDictCompat):
         self._from_db_object(self, db_devprof)
 
     @classmethod
-    def get(cls, context, name):
+    def get(cls, context, name, use_slave=False):
         """Find a DB Device Profile and return an Obj Device Profile."""
-        db_devprof = cls.dbapi.device_profile_get(context, name)
+        db_devprof = cls.dbapi.device_profile_get(context, name,
+                                                  use_slave=use_slave)
         obj_devprof = cls._from_db_object(cls(context), db_devprof)
         return obj_devprof
 
     @classmethod
-    def list(cls, context):
+    def list(cls, context, use_slave=False):
         """Return a list of Device Profile objects."""
-        db_devprofs = cls.dbapi.device_profile_list(context)
+        db_devprofs = cls.dbapi.device_profile_list(context,
+                                                    use_slave=use_slave)
         obj_dp_list = cls._from_db_object_list(db_devprofs, context)
         return obj_dp_list
 
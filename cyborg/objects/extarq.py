@@ -32,6 +32,10 @@ class ExtARQ(base.CyborgObject, object_base.VersionedObjectDictCompat):
 
     dbapi = dbapi.get_instance()
 
+    # HACK: force these fields to be not None
+    _db_null_defaults = {'host_name': '', 'device_rp_uuid': '',
+                         'instance_uuid': '', 'attach_handle_id_pci': ''}
+
     fields = {
         'id': object_fields.IntegerField(nullable=False),
         'uuid': object_fields.UUIDField(nullable=False),
@@ -69,36 +73,25 @@ class ExtARQ(base.CyborgObject, object_base.VersionedObjectDictCompat):
         self._from_db_object(self, db_extarq)
 
     @classmethod
-    def get(cls, context, uuid):
+    def get(cls, context, uuid, use_slave=False):
         """Find a DB ExtARQ and return an Obj ExtARQ."""
-        db_extarq = cls.dbapi.extarq_get(context, uuid)
-        db_devprof = cls.dbapi.device_profile_get_by_id(context,
-                         db_extarq.device_profile_id)
-        db_extarq['device_profile_name'] = db_devprof['name']
-        for n in ['host_name', 'device_rp_uuid', 'instance_uuid']:
-            # HACK: force these fields to be not None
-            #    This should probably be in db layer
-            if db_extarq[n] is None:
-                db_extarq[n] = ''
-        MYLOG.warning('obj extarq get: db_extarq: (%s), dpname: (%s)',
-                      db_extarq, db_extarq['device_profile_name'])
-        obj_extarq = cls._from_db_object(cls(context), db_extarq)
-        return obj_extarq
+        names = sorted(cls.fields)
+        with cls.dbapi.read_transaction(context, use_slave=use_slave):
+            rows = cls.dbapi.extarq_list(context, use_slave=use_slave,
+                                         filters={'uuid': uuid},
+                                         columns=names)
+        if not rows:
+            raise RuntimeError('No ExtARQ found with UUID %s' % uuid)
+        return cls._from_db_rows(context, rows, names)[0]
 
     @classmethod
-    def list(cls, context):
-        """Return a list of ExtARQ objects."""
-        db_extarqs = cls.dbapi.extarq_list(context)
-        for db_extarq in db_extarqs:
-           db_devprof = cls.dbapi.device_profile_get_by_id(context,
-                            db_extarq.device_profile_id)
-           db_extarq['device_profile_name'] = db_devprof['name']
-           # HACK: force these fields to be not None
-           for n in ['host_name', 'device_rp_uuid', 'instance_uuid']:
-               if db_extarq[n] is None:
-                   db_extarq[n] = ''
-        obj_dp_list = cls._from_db_object_list(db_extarqs, context)
-        return obj_dp_list
+    def list(cls, context, use_slave=False, filters=None):
+        """Return a list of ExtARQ objects, filtered as in extarq_list."""
+        names = sorted(cls.fields)
+        with cls.dbapi.read_transaction(context, use_slave=use_slave):
+            rows = cls.dbapi.extarq_list(context, use_slave=use_slave,
+                                         filters=filters, columns=names)
+        return cls._from_db_rows(context, rows, names)
 
     def save(self, context):
         """Update an ExtARQ record in the DB."""
@@ -117,10 +110,16 @@ class ExtARQ(base.CyborgObject, object_base.VersionedObjectDictCompat):
     # HACK: all binding logic should be in the conductor
     def bind(self, context, device_rp_uuid):
         """ Given a device rp UUID, get the deployable UUID and
-            an attach handle.
+            claim an attach handle of its device.
         """
-        # HACK: hardcode values for now.
-        attach_handle_id_pci = "0000:00.5e.0"
+        db_handle = self.dbapi.extarq_attach_handle(
+            context, self.uuid, device_rp_uuid)
+        self.attach_handle_id_pci = db_handle.info
+
+    def unbind(self, context):
+        """Release the attach handle claimed by bind, if any."""
+        self.dbapi.extarq_detach_handle(context, self.uuid)
+        self.attach_handle_id_pci = ''
 
     @classmethod
     def _from_db_object(cls, extarq, db_extarq):
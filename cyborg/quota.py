@@ -15,6 +15,7 @@
 import datetime
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import importutils
 from oslo_utils import timeutils
 import six
 
@@ -32,7 +33,13 @@ quota_opts = [
                help='Count of reservations until usage is refreshed'),
     cfg.StrOpt('quota_driver',
                default="cyborg.quota.DbQuotaDriver",
-               help='Default driver to use for quota checks'),
+               help='Default driver to use for quota checks. '
+                    'cyborg.quota.DbQuotaDriver tracks usage and '
+                    'reservations in the quota tables; '
+                    'cyborg.quota.CountingQuotaDriver counts the bound '
+                    'ARQs instead and writes nothing, so concurrent '
+                    'requests of a project do not serialize on its usage '
+                    'rows'),
     cfg.IntOpt('quota_fpgas',
                default=10,
                help='Total amount of fpga allowed per project'),
@@ -41,7 +48,16 @@ quota_opts = [
                help='Total amount of storage allowed per project'),
     cfg.IntOpt('max_age',
                default=0,
-               help='Number of seconds between subsequent usage refreshes')
+               help='Number of seconds between subsequent usage refreshes'),
+    cfg.IntOpt('reservation_sweep_interval',
+               default=300,
+               help='Number of seconds between conductor runs that roll '
+                    'back expired reservations and resync quota usages '
+                    'from the bound ARQs'),
+    cfg.IntOpt('reservation_sweep_batch_size',
+               default=1000,
+               help='Number of expired reservations deleted per '
+                    'transaction by the reservation sweep'),
     ]
 
 CONF = cfg.CONF
@@ -55,7 +71,19 @@ class QuotaEngine(object):
         """Initialize a Quota object."""
 
         self._resources = {}
-        self._driver = DbQuotaDriver()
+        self._driver_cls = quota_driver_class
+        self.__driver = None
+
+    @property
+    def _driver(self):
+        if self.__driver:
+            return self.__driver
+        if not self._driver_cls:
+            self._driver_cls = CONF.quota_driver
+        if isinstance(self._driver_cls, six.string_types):
+            self._driver_cls = importutils.import_object(self._driver_cls)
+        self.__driver = self._driver_cls
+        return self.__driver
 
     def register_resource(self, resource):
         """Register a resource."""
@@ -131,7 +159,34 @@ class QuotaEngine(object):
             LOG.exception("Failed to commit reservations %s", reservations)
 
     def rollback(self, context, reservations, project_id=None):
-        pass
+        """Roll back reservations.
+
+        :param context: The request context, for access checks.
+        :param reservations: A list of the reservation UUIDs, as
+                             returned by the reserve() method.
+        :param project_id: Specify the project_id if current context
+                           is admin and admin wants to impact on
+                           common user's tenant.
+        """
+        if not reservations:
+            return
+        try:
+            self._driver.rollback(context, reservations,
+                                  project_id=project_id)
+        except Exception:
+            # NOTE(Vek): Ignoring exceptions here is safe, because the
+            # usage resynchronization and the reservation expiration
+            # mechanisms will resolve the issue.  The exception is
+            # logged, however, because this is less than optimal.
+            LOG.exception("Failed to roll back reservations %s",
+                          reservations)
+
+    def expire(self, context):
+        """Roll back expired reservations and resync usages.
+
+        :param context: The request context, for access checks.
+        """
+        self._driver.expire(context)
 
 
 class DbQuotaDriver(object):
@@ -187,4 +242,63 @@ class DbQuotaDriver(object):
             # logged, however, because this is less than optimal.
             LOG.exception("Failed to commit reservations %s", reservations)
 
+    def rollback(self, context, reservations, project_id=None):
+        """Roll back reservations."""
+        self.dbapi.reservation_rollback(context, reservations,
+                                        project_id=project_id)
+
+    def expire(self, context):
+        """Roll back expired reservations, then resync usages.
+
+        The resync heals any drift between quota_usages and the ARQs
+        actually bound, instead of waiting for until_refresh or max_age to
+        trip in quota_reserve.
+        """
+        expired = self.dbapi.reservation_expire(
+            context, batch_size=CONF.reservation_sweep_batch_size)
+        changed = self.dbapi.quota_usage_refresh(context)
+        LOG.debug("Expired %(expired)d reservations and resynced "
+                  "%(changed)d quota usages",
+                  {'expired': expired, 'changed': changed})
+
+
+class CountingQuotaDriver(object):
+    """Driver that enforces quotas by counting usage on every reserve.
+
+    Usage is the number of ARQs of the project bound to accelerators of
+    each resource, counted with one grouped query.  No usage or
+    reservation rows are read for update or written, so concurrent
+    reservations for a project take no locks.  The price is that
+    requests racing each other can together exceed a limit by their
+    deltas.
+    """
+    dbapi = db_api.get_instance()
+
+    def reserve(self, context, resources, deltas, expire=None,
+                project_id=None):
+        if project_id is None:
+            project_id = context.project_id
+        usages = self.dbapi.quota_usage_count(
+            context, project_id=project_id,
+            resources=list(deltas)).get(project_id, {})
+        overs = []
+        for resource, delta in deltas.items():
+            limit = getattr(CONF, 'quota_%ss' % resource, -1)
+            if delta > 0 and 0 <= limit < usages.get(resource, 0) + delta:
+                overs.append(resource)
+        if overs:
+            raise exception.OverQuota(overs=sorted(overs))
+        # Nothing was reserved, so there is nothing to commit or roll back.
+        return []
+
+    def commit(self, context, reservations, project_id=None):
+        pass
+
+    def rollback(self, context, reservations, project_id=None):
+        pass
+
+    def expire(self, context):
+        pass
+
+
 QUOTAS = QuotaEngine()
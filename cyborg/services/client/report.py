@@ -14,11 +14,13 @@
 #    under the License.
 """Placement Client to Handle Resource Provider Operation."""
 
+import collections
 import contextlib
 import copy
 import functools
 import random
 import re
+import threading
 import time
 
 from keystoneauth1 import exceptions as ks_exc
@@ -26,6 +28,7 @@ import os_traits
 from oslo_log import log as logging
 from oslo_middleware import request_id
 from oslo_utils import versionutils
+from six.moves.urllib import parse
 
 from cyborg.agent import provider_tree
 from cyborg.agent import rc_fields as fields
@@ -47,6 +50,8 @@ GRANULAR_AC_VERSION = '1.25'
 POST_RPS_RETURNS_PAYLOAD_API_VERSION = '1.20'
 NESTED_PROVIDER_API_VERSION = '1.14'
 POST_ALLOCATIONS_API_VERSION = '1.13'
+# Aggregate updates only bump the provider generation from this version on.
+AGGREGATE_GENERATION_API_VERSION = '1.19'
 
 
 def warn_limit(self, msg):
@@ -254,6 +259,57 @@ def get_placement_request_id(response):
         return response.headers.get(request_id.HTTP_RESP_HEADER_REQUEST_ID)
 
 
+class _AssociationCache(object):
+    """LRU cache of provider aggregates and traits keyed by generation.
+
+    Any change to a provider's aggregates or traits bumps its generation, so
+    an entry is good for as long as placement reports the same generation
+    for the provider.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, rp_uuid, generation):
+        """Return (aggregates, traits) for the provider at the given
+        generation, or None if there is no such entry.
+        """
+        entry = self._entries.pop(rp_uuid, None)
+        if entry is None or entry[0] != generation:
+            self.misses += 1
+            return None
+        self._entries[rp_uuid] = entry
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def put(self, rp_uuid, generation, aggregates, traits):
+        if not self.size or generation is None:
+            return
+        self._entries.pop(rp_uuid, None)
+        self._entries[rp_uuid] = (
+            generation, frozenset(aggregates), frozenset(traits))
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def pop(self, rp_uuid):
+        self._entries.pop(rp_uuid, None)
+
+
+class _InFlight(object):
+    """A placement query being run on behalf of one or more callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 class SchedulerReportClient(object):
     """Client class for updating the scheduler."""
 
@@ -273,6 +329,12 @@ class SchedulerReportClient(object):
         self._client = self._create_client()
         # NOTE(danms): Keep track of how naggy we've been
         self._warn_count = 0
+        # Identical GET /allocation_candidates queries which are in flight or
+        # were answered within [placement]allocation_candidates_cache_ttl.
+        self._ac_lock = threading.Lock()
+        self._ac_in_flight = {}
+        self._ac_cache = {}
+        self._ac_stats = collections.Counter()
 
     @utils.synchronized(PLACEMENT_CLIENT_SEMAPHORE)
     def _create_client(self):
@@ -280,6 +342,13 @@ class SchedulerReportClient(object):
         # Flush provider tree and associations so we start from a clean slate.
         self._provider_tree = provider_tree.ProviderTree()
         self._association_refresh_time = {}
+        self._association_cache = _AssociationCache(
+            CONF.placement.association_cache_size)
+        # Forget what we learned about the placement service; the new session
+        # may be talking to a different (e.g. upgraded) server.
+        self._max_microversion = None
+        self._known_traits = set()
+        self._known_resource_classes = set()
         client = self._adapter or utils.get_ksa_adapter('placement')
         # Set accept header on every request to ensure we notify placement
         # service of our response body media type preferences.
@@ -319,6 +388,52 @@ class SchedulerReportClient(object):
         return self._client.delete(url, microversion=version, headers=headers)
 
     @safe_connect
+    def _get_root_document(self):
+        """Queries the placement API root for its supported versions."""
+        resp = self.get('/')
+        if resp.status_code == 200:
+            return resp.json()
+        LOG.warning('Failed to retrieve the placement API version document. '
+                    'Got %(status_code)d: %(err_text)s.',
+                    {'status_code': resp.status_code, 'err_text': resp.text})
+        return None
+
+    def _get_max_microversion(self):
+        """Returns the highest microversion supported by the placement API,
+        as a (major, minor) tuple.
+
+        The value is negotiated from the placement root document the first
+        time it is needed and cached until the client session is recreated.
+        If the root document can't be retrieved, (1, 0) is returned and
+        negotiation is retried on the next call, so callers fall back to the
+        request-per-provider code paths in the meantime.
+        """
+        if self._max_microversion is not None:
+            return self._max_microversion
+
+        doc = self._get_root_document()
+        if not doc:
+            return (1, 0)
+        versions = [v['max_version'] for v in doc.get('versions', [])
+                    if v.get('max_version')]
+        if not versions:
+            # A server that predates microversions.
+            self._max_microversion = (1, 0)
+        else:
+            self._max_microversion = max(
+                versionutils.convert_version_to_tuple(v) for v in versions)
+        LOG.debug('Negotiated placement API microversion %d.%d',
+                  *self._max_microversion)
+        return self._max_microversion
+
+    def _microversion_supported(self, version):
+        """Returns whether the placement API supports the given microversion.
+
+        :param version: Microversion string, e.g. '1.30'
+        """
+        return (self._get_max_microversion() >=
+                versionutils.convert_version_to_tuple(version))
+
     def get_allocation_candidates(self, context, resources):
         """Returns a tuple of (allocation_requests, provider_summaries,
         allocation_request_version).
@@ -350,9 +465,90 @@ class SchedulerReportClient(object):
 
             "Candidates are in either 'foo' or 'bar', but definitely in 'baz'"
 
+        Concurrent callers asking the same question share one placement
+        query, and answers may be reused for a very short time; see
+        [placement]allocation_candidates_coalesce and
+        [placement]allocation_candidates_cache_ttl.  Each caller gets its own
+        copy of the result.
         """
-        version = GRANULAR_AC_VERSION
         qparams = resources.to_querystring()
+        # Parameter order doesn't change the answer, so don't let it change
+        # the key.
+        key = parse.urlencode(sorted(parse.parse_qsl(qparams)))
+        ttl = CONF.placement.allocation_candidates_cache_ttl
+        coalesce = CONF.placement.allocation_candidates_coalesce
+
+        with self._ac_lock:
+            self._ac_stats['requests'] += 1
+            if ttl > 0:
+                cached = self._ac_cache.get(key)
+                if cached is not None and cached[0] > time.time():
+                    self._ac_stats['cache_hits'] += 1
+                    return copy.deepcopy(cached[1])
+                self._ac_cache.pop(key, None)
+            flight = self._ac_in_flight.get(key) if coalesce else None
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                if coalesce:
+                    self._ac_in_flight[key] = flight
+            else:
+                self._ac_stats['coalesced'] += 1
+
+        if not leader:
+            LOG.debug("Waiting for in-flight allocation candidates query %s",
+                      key)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        with self._ac_lock:
+            self._ac_stats['placement_queries'] += 1
+        try:
+            flight.result = self._get_allocation_candidates(
+                context, qparams, resources)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._ac_lock:
+                if coalesce:
+                    self._ac_in_flight.pop(key, None)
+                if (ttl > 0 and flight.error is None and
+                        flight.result is not None and
+                        flight.result[0] is not None):
+                    self._ac_cache[key] = (time.time() + ttl,
+                                           copy.deepcopy(flight.result))
+                    self._expire_allocation_candidates()
+            flight.done.set()
+        return copy.deepcopy(flight.result) if coalesce else flight.result
+
+    def _expire_allocation_candidates(self):
+        """Drop expired cached allocation candidates. Call with _ac_lock."""
+        now = time.time()
+        for key, (expires, _result) in list(self._ac_cache.items()):
+            if expires <= now:
+                del self._ac_cache[key]
+
+    def allocation_candidates_stats(self):
+        """Return a dict of get_allocation_candidates counters.
+
+        requests: calls to get_allocation_candidates
+        placement_queries: calls which actually went to placement
+        coalesced: calls which waited for an identical in-flight query
+        cache_hits: calls answered from the short-lived cache
+        """
+        with self._ac_lock:
+            stats = dict.fromkeys(
+                ('requests', 'placement_queries', 'coalesced', 'cache_hits'),
+                0)
+            stats.update(self._ac_stats)
+            return stats
+
+    @safe_connect
+    def _get_allocation_candidates(self, context, qparams, resources):
+        version = GRANULAR_AC_VERSION
         url = "/allocation_candidates?%s" % qparams
         resp = self.get(url, version=version,
                         global_request_id=context.global_id)
@@ -707,6 +903,7 @@ class SchedulerReportClient(object):
             except ValueError:
                 pass
             self._association_refresh_time.pop(rp_uuid, None)
+            self._association_cache.pop(rp_uuid)
             return
 
         msg = ("[%(placement_req_id)s] Failed to delete resource provider "
@@ -764,8 +961,10 @@ class SchedulerReportClient(object):
         sharing providers for the specified resource provider uuid.
 
         Only refresh if there has been no refresh during the lifetime of
-        this process, CONF.compute.resource_provider_association_refresh
-        seconds have passed, or the force arg has been set to True.
+        this process, CONF.placement.resource_provider_association_refresh
+        seconds have passed, or the force arg has been set to True.  Unless
+        forced, aggregates and traits are only re-fetched if the provider's
+        generation has moved on since they were last cached.
 
         Note that we do *not* refresh inventories.  The reason is largely
         historical: all code paths that get us here are doing inventory refresh
@@ -787,26 +986,34 @@ class SchedulerReportClient(object):
                 - ResourceProviderRetrievalFailed
         """
         if force or self._associations_stale(rp_uuid):
-            # Refresh aggregates
-            aggs = self._get_provider_aggregates(context, rp_uuid)
-            msg = ("Refreshing aggregate associations for resource provider "
-                   "%s, aggregates: %s")
-            LOG.debug(msg, rp_uuid, ','.join(aggs or ['None']))
-
-            # NOTE(efried): This will blow up if called for a RP that doesn't
-            # exist in our _provider_tree.
-            self._provider_tree.update_aggregates(
-                rp_uuid, aggs, generation=generation)
-
-            # Refresh traits
-            traits = self._get_provider_traits(context, rp_uuid)
-            msg = ("Refreshing trait associations for resource provider %s, "
-                   "traits: %s")
-            LOG.debug(msg, rp_uuid, ','.join(traits or ['None']))
-            # NOTE(efried): This will blow up if called for a RP that doesn't
-            # exist in our _provider_tree.
-            self._provider_tree.update_traits(
-                rp_uuid, traits, generation=generation)
+            cached = None
+            cache_generation = generation
+            if not force and self._association_cache_enabled():
+                # One cheap GET tells us whether anything can have changed.
+                rp = self._get_resource_provider(context, rp_uuid)
+                if rp is None:
+                    raise exception.ResourceProviderRetrievalFailed(
+                        uuid=rp_uuid)
+                cache_generation = rp['generation']
+                if generation is None:
+                    generation = cache_generation
+                cached = self._association_cache.get(
+                    rp_uuid, cache_generation)
+            if cached is not None:
+                aggs, traits = cached
+                LOG.debug("Resource provider %s generation %s unchanged; "
+                          "using cached aggregates and traits",
+                          rp_uuid, generation)
+                self._provider_tree.update_aggregates(
+                    rp_uuid, aggs, generation=generation)
+                self._provider_tree.update_traits(
+                    rp_uuid, traits, generation=generation)
+            else:
+                aggs, traits = self._fetch_associations(
+                    context, rp_uuid, generation)
+                if self._association_cache_enabled():
+                    self._association_cache.put(
+                        rp_uuid, cache_generation, aggs, traits)
 
             if refresh_sharing:
                 # Refresh providers associated by aggregate
@@ -829,17 +1036,56 @@ class SchedulerReportClient(object):
                                                refresh_sharing=False)
             self._association_refresh_time[rp_uuid] = time.time()
 
+    def _association_cache_enabled(self):
+        return (CONF.placement.association_cache_size > 0 and
+                self._microversion_supported(
+                    AGGREGATE_GENERATION_API_VERSION))
+
+    def association_cache_stats(self):
+        """Return a dict of the association cache hit and miss counters."""
+        return {'hits': self._association_cache.hits,
+                'misses': self._association_cache.misses,
+                'size': len(self._association_cache)}
+
+    def _fetch_associations(self, context, rp_uuid, generation):
+        """Fetch a provider's aggregates and traits from placement and store
+        them in the provider tree.
+
+        :return: A tuple of (aggregates, traits) sets.
+        """
+        # Refresh aggregates
+        aggs = self._get_provider_aggregates(context, rp_uuid)
+        msg = ("Refreshing aggregate associations for resource provider "
+               "%s, aggregates: %s")
+        LOG.debug(msg, rp_uuid, ','.join(aggs or ['None']))
+
+        # NOTE(efried): This will blow up if called for a RP that doesn't
+        # exist in our _provider_tree.
+        self._provider_tree.update_aggregates(
+            rp_uuid, aggs, generation=generation)
+
+        # Refresh traits
+        traits = self._get_provider_traits(context, rp_uuid)
+        msg = ("Refreshing trait associations for resource provider %s, "
+               "traits: %s")
+        LOG.debug(msg, rp_uuid, ','.join(traits or ['None']))
+        # NOTE(efried): This will blow up if called for a RP that doesn't
+        # exist in our _provider_tree.
+        self._provider_tree.update_traits(
+            rp_uuid, traits, generation=generation)
+        return aggs, traits
+
     def _associations_stale(self, uuid):
         """Respond True if aggregates and traits have not been refreshed
         "recently".
 
         Associations are stale if association_refresh_time for this uuid is not
-        set or is more than CONF.compute.resource_provider_association_refresh
-        seconds ago.
+        set or is more than
+        CONF.placement.resource_provider_association_refresh seconds ago.
         """
         refresh_time = self._association_refresh_time.get(uuid, 0)
         return ((time.time() - refresh_time) >
-                CONF.compute.resource_provider_association_refresh)
+                CONF.placement.resource_provider_association_refresh)
 
     def _update_inventory_attempt(self, context, rp_uuid, inv_data):
         """Update the inventory for this resource provider if needed.
@@ -1158,28 +1404,33 @@ class SchedulerReportClient(object):
                  was unsuccessful.  In this scenario, it is guaranteed that
                  no traits were created.
         """
+        # Traits we have already seen in placement don't need to be checked
+        # again; traits are never deleted out from under us while in use.
+        traits = set(traits or []) - self._known_traits
         if not traits:
             return
 
-        # Query for all the requested traits.  Whichever ones we *don't* get
-        # back, we need to create.
+        # Query for all the requested traits in one request.  Whichever ones
+        # we *don't* get back, we need to create.
         # NOTE(efried): We don't attempt to filter based on our local idea of
         # standard traits, which may not be in sync with what the placement
         # service knows.  If the caller tries to ensure a nonexistent
         # "standard" trait, they deserve the TraitCreationFailed exception
         # they'll get.
-        resp = self.get('/traits?name=in:' + ','.join(traits), version='1.6',
-                        global_request_id=context.global_id)
+        resp = self.get('/traits?name=in:' + ','.join(sorted(traits)),
+                        version='1.6', global_request_id=context.global_id)
         if resp.status_code == 200:
-            traits_to_create = set(traits) - set(resp.json()['traits'])
-            # Might be neat to have a batch create.  But creating multiple
-            # traits will generally happen once, at initial startup, if at all.
-            for trait in traits_to_create:
+            existing = set(resp.json()['traits'])
+            self._known_traits |= existing
+            # Placement has no batch create.  But creating multiple traits
+            # will generally happen once, at initial startup, if at all.
+            for trait in traits - existing:
                 resp = self.put('/traits/' + trait, None, version='1.6',
                                 global_request_id=context.global_id)
                 if not resp:
                     raise exception.TraitCreationFailed(name=trait,
                                                         error=resp.text)
+                self._known_traits.add(trait)
             return
 
         # The initial GET failed
@@ -1318,6 +1569,19 @@ class SchedulerReportClient(object):
         version = '1.7'
         to_ensure = set(n for n in names
                         if n.startswith(fields.ResourceClass.CUSTOM_NAMESPACE))
+        to_ensure -= self._known_resource_classes
+        if not to_ensure:
+            return
+
+        # A single listing tells us which custom resource classes already
+        # exist, so we only need to issue a PUT for the missing ones.
+        if len(to_ensure) > 1:
+            resp = self.get('/resource_classes', version=version,
+                            global_request_id=context.global_id)
+            if resp.status_code == 200:
+                self._known_resource_classes |= set(
+                    rc['name'] for rc in resp.json()['resource_classes'])
+                to_ensure -= self._known_resource_classes
 
         for name in to_ensure:
             # no payload on the put request
@@ -1335,6 +1599,7 @@ class SchedulerReportClient(object):
                 }
                 LOG.error(msg, args)
                 raise exception.InvalidResourceClass(resource_class=name)
+            self._known_resource_classes.add(name)
 
     def update_compute_node(self, context, compute_node):
         """Creates or updates stats for the supplied compute node.
@@ -1380,7 +1645,7 @@ class SchedulerReportClient(object):
         # this is by deleting the provider and recreating it with the new name.
 
         @contextlib.contextmanager
-        def catch_all(rp_uuid):
+        def catch_all(*rp_uuids):
             """Convert all "expected" exceptions from placement API helpers to
             True or False.  Saves having to do try/except for every helper call
             below.
@@ -1408,50 +1673,49 @@ class SchedulerReportClient(object):
             except helper_exceptions:
                 s.success = False
                 # Invalidate the caches
-                try:
-                    self._provider_tree.remove(rp_uuid)
-                except ValueError:
-                    pass
-                self._association_refresh_time.pop(rp_uuid, None)
+                for rp_uuid in rp_uuids:
+                    try:
+                        self._provider_tree.remove(rp_uuid)
+                    except ValueError:
+                        pass
+                    self._association_refresh_time.pop(rp_uuid, None)
+                    self._association_cache.pop(rp_uuid)
 
         # Overall indicator of success.  Will be set to False on any exception.
         success = True
 
         # Helper methods herein will be updating the local cache (this is
         # intentional) so we need to grab up front any data we need to operate
-        # on in its "original" form.
-        old_tree = self._provider_tree
-        old_uuids = old_tree.get_provider_uuids()
-        new_uuids = new_tree.get_provider_uuids()
+        # on in its "original" form.  The diff skips over unchanged subtrees,
+        # so a resync of a mostly unchanged tree only visits what changed.
+        # NOTE(efried): Reparented providers show up in changes.reparented;
+        # like renames, placement won't let us move them, so they are
+        # flushed as if their parent were unchanged.
+        changes = self._provider_tree.diff(new_tree)
+        if changes.is_empty():
+            return
 
         # Do provider deletion first, since it has the best chance of failing
-        # for non-generation-conflict reasons (i.e. allocations).
-        uuids_to_remove = set(old_uuids) - set(new_uuids)
-        # We have to do deletions in bottom-up order, so we don't error
-        # attempting to delete a parent who still has children.
-        for uuid in reversed(old_uuids):
-            if uuid not in uuids_to_remove:
-                continue
-            with catch_all(uuid) as status:
-                self._delete_provider(uuid)
+        # for non-generation-conflict reasons (i.e. allocations).  The diff
+        # lists them in bottom-up order, so we don't error attempting to
+        # delete a parent who still has children.
+        for pd in changes.removed:
+            with catch_all(pd.uuid) as status:
+                self._delete_provider(pd.uuid)
             success = success and status.success
 
-        # Now create (or load) any "new" providers
-        uuids_to_add = set(new_uuids) - set(old_uuids)
-        # We have to do additions in top-down order, so we don't error
-        # attempting to create a child before its parent exists.
-        for uuid in new_uuids:
-            if uuid not in uuids_to_add:
-                continue
-            provider = new_tree.data(uuid)
-            with catch_all(uuid) as status:
+        # Now create (or load) any "new" providers.  These come in top-down
+        # order, so we don't error attempting to create a child before its
+        # parent exists.
+        for provider in changes.added:
+            with catch_all(provider.uuid) as status:
                 self._ensure_resource_provider(
-                    context, uuid, name=provider.name,
+                    context, provider.uuid, name=provider.name,
                     parent_provider_uuid=provider.parent_uuid)
             success = success and status.success
 
         # At this point the local cache should have all the same providers as
-        # new_tree.  Whether we added them or not, walk through and diff/flush
+        # new_tree.  Walk through the added and changed ones and flush
         # inventories, traits, and aggregates as necessary (the helper methods
         # are set up to check and short out when the relevant property does not
         # differ from what's in the cache).
@@ -1459,8 +1723,8 @@ class SchedulerReportClient(object):
         # its descendants are also removed, and set_*_for_provider methods on
         # it wouldn't be able to get started. Walking the tree in bottom-up
         # order ensures we at least try to process all of the providers.
-        for uuid in reversed(new_uuids):
-            pd = new_tree.data(uuid)
+        to_flush = [change.new for change in reversed(changes.changed)]
+        for pd in to_flush:
             with catch_all(pd.uuid) as status:
                 self._set_inventory_for_provider(
                     context, pd.uuid, pd.inventory)
@@ -1706,8 +1970,6 @@ class SchedulerReportClient(object):
                         consumer_uuid, r.status_code, r.text)
         return r.status_code == 204
 
-    @safe_connect
-    @retries
     def set_and_clear_allocations(self, context, rp_uuid, consumer_uuid,
                                   alloc_data, project_id, user_id,
                                   consumer_to_clear=None):
@@ -1717,6 +1979,9 @@ class SchedulerReportClient(object):
         instance to another host. This is for atomically managing so-called
         "doubled" migration records.
 
+        Both consumers are written by set_allocations_for_consumers, so this
+        is only atomic when placement supports POST /allocations.
+
         :note Currently we only allocate against a single resource provider.
               Once shared storage and things like NUMA allocations are a
               reality, this will change to allocate against multiple providers.
@@ -1732,47 +1997,83 @@ class SchedulerReportClient(object):
         :param consumer_to_clear: A UUID identifying allocations for a
                                   consumer that should be cleared.
         :returns: True if the allocations were created, False otherwise.
+        """
+        allocations = {consumer_uuid: {rp_uuid: alloc_data}}
+        if consumer_to_clear:
+            allocations[consumer_to_clear] = {}
+        return self.set_allocations_for_consumers(
+            context, allocations, project_id, user_id)
+
+    @safe_connect
+    @retries
+    def set_allocations_for_consumers(self, context, allocations, project_id,
+                                      user_id):
+        """Replace the allocations of several consumers at once.
+
+        If placement supports POST /allocations, all the consumers are
+        written in a single atomic request.  Otherwise we fall back to one
+        PUT /allocations/{consumer_uuid} per consumer, in which case a
+        failure part way through may leave some consumers updated.
+
+        :param context: The security context
+        :param allocations: Dict, keyed by consumer UUID, of dicts, keyed by
+                            resource provider UUID, of dicts, keyed by
+                            resource class, of amounts to consume.  An empty
+                            dict for a consumer clears its allocations.
+        :param project_id: The project_id associated with the allocations.
+        :param user_id: The user_id associated with the allocations.
+        :returns: True if all the allocations were written, False otherwise.
         :raises: Retry if the operation should be retried due to a concurrent
                  update.
         """
-        # FIXME(cdent): Fair amount of duplicate with put in here, but now
-        # just working things through.
-        payload = {
-            consumer_uuid: {
-                'allocations': {
-                    rp_uuid: {
-                        'resources': alloc_data
-                    }
-                },
-                'project_id': project_id,
-                'user_id': user_id,
-            }
-        }
-        if consumer_to_clear:
-            payload[consumer_to_clear] = {
-                'allocations': {},
+        def _consumer_payload(allocs):
+            return {
+                'allocations': dict(
+                    (rp_uuid, {'resources': resources})
+                    for rp_uuid, resources in allocs.items()),
                 'project_id': project_id,
                 'user_id': user_id,
             }
-        r = self.post('/allocations', payload,
-                      version=POST_ALLOCATIONS_API_VERSION,
-                      global_request_id=context.global_id)
-        if r.status_code != 204:
+
+        if self._microversion_supported(POST_ALLOCATIONS_API_VERSION):
+            payload = dict(
+                (consumer_uuid, _consumer_payload(allocs))
+                for consumer_uuid, allocs in allocations.items())
+            responses = [(','.join(allocations), self.post(
+                '/allocations', payload,
+                version=POST_ALLOCATIONS_API_VERSION,
+                global_request_id=context.global_id))]
+        else:
+            responses = []
+            for consumer_uuid, allocs in allocations.items():
+                if allocs:
+                    r = self.put('/allocations/%s' % consumer_uuid,
+                                 _consumer_payload(allocs), version='1.12',
+                                 global_request_id=context.global_id)
+                else:
+                    r = self.delete('/allocations/%s' % consumer_uuid,
+                                    global_request_id=context.global_id)
+                responses.append((consumer_uuid, r))
+
+        for consumer_uuids, r in responses:
+            # A 404 can only come from clearing a consumer which had no
+            # allocations to begin with, which is what we wanted anyway.
+            if r or r.status_code == 404:
+                continue
             # NOTE(jaypipes): Yes, it sucks doing string comparison like this
             # but we have no error codes, only error messages.
             if 'concurrently updated' in r.text:
                 reason = ('another process changed the resource providers '
-                          'involved in our attempt to post allocations for '
-                          'consumer %s' % consumer_uuid)
-                raise Retry('set_and_clear_allocations', reason)
-            else:
-                LOG.warning(
-                    'Unable to post allocations for instance '
-                    '%(uuid)s (%(code)i %(text)s)',
-                    {'uuid': consumer_uuid,
-                     'code': r.status_code,
-                     'text': r.text})
-        return r.status_code == 204
+                          'involved in our attempt to set allocations for '
+                          'consumers %s' % consumer_uuids)
+                raise Retry('set_allocations_for_consumers', reason)
+            LOG.warning('Unable to set allocations for consumers '
+                        '%(uuids)s (%(code)i %(text)s)',
+                        {'uuids': consumer_uuids,
+                         'code': r.status_code,
+                         'text': r.text})
+            return False
+        return True
 
     @safe_connect
     @retries
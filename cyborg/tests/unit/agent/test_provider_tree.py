@@ -0,0 +1,321 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cyborg agent provider_tree test cases."""
+
+import copy
+import gc
+import threading
+import time
+
+import mock
+from oslo_utils import uuidutils
+
+from cyborg.agent import provider_tree
+from cyborg.tests import base
+
+
+def _provider_dicts(n_roots, children_per_root):
+    """Return dicts for n_roots roots, each with children_per_root children,
+    in top-down order.
+    """
+    ret = []
+    for r in range(n_roots):
+        root_uuid = uuidutils.generate_uuid()
+        ret.append({'uuid': root_uuid, 'name': 'root%d' % r,
+                    'generation': 0, 'parent_provider_uuid': None})
+        for c in range(children_per_root):
+            ret.append({'uuid': uuidutils.generate_uuid(),
+                        'name': 'root%d_child%d' % (r, c),
+                        'generation': 0, 'parent_provider_uuid': root_uuid})
+    return ret
+
+
+class TestProviderTree(base.DietTestCase):
+
+    def setUp(self):
+        super(TestProviderTree, self).setUp()
+        self.pt = provider_tree.ProviderTree()
+
+    def test_lookup_by_name_and_uuid(self):
+        root = self.pt.new_root('root', uuidutils.generate_uuid())
+        child = self.pt.new_child('child', 'root')
+        grandchild = self.pt.new_child('grandchild', child)
+
+        self.assertEqual(grandchild, self.pt.data('grandchild').uuid)
+        self.assertEqual('child', self.pt.data(child).name)
+        self.assertEqual(root, self.pt.data(child).parent_uuid)
+        self.assertRaises(ValueError, self.pt.new_child, 'child', root)
+
+    def test_remove_drops_descendants(self):
+        root = self.pt.new_root('root', uuidutils.generate_uuid())
+        child = self.pt.new_child('child', root)
+        self.pt.new_child('grandchild', child)
+
+        self.pt.remove('child')
+        self.assertFalse(self.pt.exists(child))
+        self.assertFalse(self.pt.exists('grandchild'))
+        self.assertEqual([root], self.pt.get_provider_uuids())
+        # The name is free for reuse.
+        self.pt.new_child('grandchild', root)
+
+    def test_duplicate_name_survives_removal(self):
+        root = self.pt.new_root('root', uuidutils.generate_uuid())
+        first = self.pt.new_child('dup', root)
+        second = self.pt.new_child('dup', first,
+                                   uuid=uuidutils.generate_uuid())
+        other_root = self.pt.new_root('other', uuidutils.generate_uuid())
+        third = self.pt.new_child('dup', other_root,
+                                  uuid=uuidutils.generate_uuid())
+
+        self.assertEqual(first, self.pt.data('dup').uuid)
+        self.pt.remove(first)
+        self.assertFalse(self.pt.exists(second))
+        self.assertEqual(third, self.pt.data('dup').uuid)
+        self.pt.remove(third)
+        self.assertFalse(self.pt.exists('dup'))
+
+    def test_populate_replaces_subtree(self):
+        dicts = _provider_dicts(1, 2)
+        self.pt.populate_from_iterable(dicts)
+        self.pt.new_child('extra', dicts[1]['uuid'])
+
+        self.pt.populate_from_iterable(dicts[1:2])
+        self.assertFalse(self.pt.exists('extra'))
+        self.assertEqual(3, len(self.pt.get_provider_uuids()))
+
+    def test_populate_10k_providers_never_walks_tree(self):
+        # Structural check: loading 10k providers and looking them up by
+        # name or UUID never falls back to walking the tree.
+        dicts = _provider_dicts(100, 99)
+        with mock.patch.object(provider_tree._Provider, 'find',
+                               side_effect=AssertionError('tree walk')):
+            self.pt.populate_from_iterable(dicts)
+            for pd in dicts[::997]:
+                self.assertEqual(pd['name'], self.pt.data(pd['uuid']).name)
+                self.assertEqual(pd['uuid'], self.pt.data(pd['name']).uuid)
+        self.assertEqual(10000, len(self.pt.get_provider_uuids()))
+
+    def test_populate_10k_providers_linear(self):
+        # Benchmark: four times the providers must take well under the
+        # sixteen times as long a quadratic load and lookup would.  As in
+        # timeit, the garbage collector is paused so it cannot skew a run.
+        def best_time(n_roots):
+            dicts = _provider_dicts(n_roots, 99)
+            best = None
+            for _ in range(5):
+                pt = provider_tree.ProviderTree()
+                gc.collect()
+                gc.disable()
+                try:
+                    start = time.time()
+                    pt.populate_from_iterable(dicts)
+                    for pd in dicts:
+                        pt.data(pd['name'])
+                    elapsed = time.time() - start
+                finally:
+                    gc.enable()
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        small = best_time(25)
+        large = best_time(100)
+        self.assertLess(large, small * 8)
+
+    def test_populate_bottom_up_nested(self):
+        # Benchmark: a large three level FPGA -> function -> VF tree handed
+        # over children-first still injects every provider exactly once.
+        dicts = []
+        for pd in _provider_dicts(10, 30):
+            dicts.append(pd)
+            if pd['parent_provider_uuid'] is not None:
+                dicts.extend(
+                    {'uuid': uuidutils.generate_uuid(),
+                     'name': '%s_vf%d' % (pd['name'], v),
+                     'parent_provider_uuid': pd['uuid']}
+                    for v in range(32))
+        dicts.reverse()
+
+        with mock.patch.object(self.pt, '_remove_with_lock',
+                               side_effect=ValueError) as m_remove:
+            self.pt.populate_from_iterable(dicts)
+        self.assertEqual(len(dicts), m_remove.call_count)
+        self.assertEqual(len(dicts), len(self.pt.get_provider_uuids()))
+        vf = dicts[0]
+        self.assertEqual(vf['parent_provider_uuid'],
+                         self.pt.data(vf['uuid']).parent_uuid)
+
+    def test_populate_orphan(self):
+        dicts = _provider_dicts(1, 1)
+        dicts[1]['parent_provider_uuid'] = uuidutils.generate_uuid()
+        self.assertRaises(ValueError, self.pt.populate_from_iterable, dicts)
+        self.assertEqual([], self.pt.get_provider_uuids())
+
+    def test_populate_cycle(self):
+        dicts = _provider_dicts(1, 2)
+        dicts[1]['parent_provider_uuid'] = dicts[2]['uuid']
+        dicts[2]['parent_provider_uuid'] = dicts[1]['uuid']
+        ex = self.assertRaises(ValueError, self.pt.populate_from_iterable,
+                               dicts)
+        self.assertIn('cycle', str(ex))
+        self.assertIn(dicts[1]['uuid'], str(ex))
+        self.assertNotIn(dicts[0]['uuid'], str(ex))
+        # Nothing was injected, not even the valid root.
+        self.assertEqual([], self.pt.get_provider_uuids())
+
+    def test_data_is_immutable_and_shared(self):
+        root = self.pt.new_root('root', uuidutils.generate_uuid())
+        inv = {'FPGA': {'total': 4}}
+        self.pt.update_inventory(root, inv)
+        self.pt.update_traits(root, ['CUSTOM_A'])
+        inv['FPGA']['total'] = 8
+
+        data = self.pt.data(root)
+        self.assertEqual({'FPGA': {'total': 4}}, data.inventory)
+        self.assertRaises(TypeError, data.inventory.pop, 'FPGA')
+        self.assertRaises(TypeError, data.inventory['FPGA'].update, {})
+        self.assertIsInstance(data.traits, frozenset)
+        # No copy is made until something changes.
+        self.assertIs(data, self.pt.data(root))
+        self.assertIs(data.inventory, copy.deepcopy(data.inventory))
+
+        self.pt.update_inventory(root, {'FPGA': {'total': 2}}, generation=1)
+        self.assertEqual(4, data.inventory['FPGA']['total'])
+        self.assertIsNone(data.generation)
+        self.assertEqual(1, self.pt.data(root).generation)
+
+    def test_snapshot(self):
+        dicts = _provider_dicts(2, 2)
+        self.pt.populate_from_iterable(dicts)
+        before = self.pt.snapshot()
+        self.assertEqual(set(pd['uuid'] for pd in dicts), set(before))
+        uuids = list(before)
+        self.assertEqual(None, before[uuids[0]].parent_uuid)
+
+        changed = dicts[1]['uuid']
+        self.pt.add_traits(changed, 'CUSTOM_A')
+        after = self.pt.snapshot()
+        self.assertEqual(frozenset(), before[changed].traits)
+        self.assertEqual(frozenset(['CUSTOM_A']), after[changed].traits)
+        self.assertEqual(
+            [changed],
+            [u for u in after if after[u] is not before[u]])
+
+    def _copy_tree(self, dicts):
+        pt = provider_tree.ProviderTree()
+        pt.populate_from_iterable(dicts)
+        return pt
+
+    def test_diff_identical(self):
+        dicts = _provider_dicts(3, 3)
+        self.pt.populate_from_iterable(dicts)
+        other = self._copy_tree(dicts)
+        for pt in (self.pt, other):
+            pt.update_traits(dicts[1]['uuid'], ['CUSTOM_A'])
+            pt.update_inventory(dicts[2]['uuid'], {'FPGA': {'total': 1}})
+
+        self.assertTrue(self.pt.diff(other).is_empty())
+
+    def test_diff_skips_unchanged_subtrees(self):
+        dicts = _provider_dicts(100, 9)
+        self.pt.populate_from_iterable(dicts)
+        other = self._copy_tree(dicts)
+        self.pt.diff(other)
+        changed = dicts[11]['uuid']
+        other.update_traits(changed, ['CUSTOM_A'])
+
+        with mock.patch.object(provider_tree._Provider, 'data',
+                               autospec=True,
+                               side_effect=provider_tree._Provider.data
+                               ) as m_data:
+            diff = self.pt.diff(other)
+        # Only the changed provider's records are looked at.
+        self.assertEqual(2, m_data.call_count)
+        self.assertEqual([changed], [c.uuid for c in diff.changed])
+        self.assertEqual(frozenset(['CUSTOM_A']), diff.changed[0].traits_added)
+        self.assertFalse(diff.changed[0].inventory_changed)
+
+    def test_diff_add_remove_reparent(self):
+        dicts = _provider_dicts(2, 2)
+        self.pt.populate_from_iterable(dicts)
+        root0, child0a, child0b, root1, child1a, child1b = [
+            pd['uuid'] for pd in dicts]
+        gone = self.pt.new_child('gone', child1b)
+        self.pt.update_aggregates(child0a, ['agg1'])
+
+        other = self._copy_tree(dicts)
+        other.remove(child1b)
+        other.new_child('moved', root1, uuid=child1b)
+        other.remove(child0a)
+        other.new_child('new', child1a)
+        moved = dict(dicts[2], parent_provider_uuid=root1)
+        other.remove(child0b)
+        other.populate_from_iterable([moved])
+
+        diff = self.pt.diff(other)
+        self.assertEqual([gone, child0a],
+                         [pd.uuid for pd in diff.removed])
+        self.assertEqual(['new'], [pd.name for pd in diff.added])
+        self.assertEqual([child0b],
+                         [c.uuid for c in diff.reparented])
+        by_uuid = dict((c.uuid, c) for c in diff.changed)
+        self.assertEqual('moved', by_uuid[child1b].new.name)
+        self.assertNotIn(root0, by_uuid)
+
+    def test_readers_share_lock_writer_excluded(self):
+        # Contention benchmark: many readers are inside the tree at the
+        # same time, and the one writer waits until they are all done.
+        # Every wait is bounded, so readers blocking one another fails the
+        # test instead of hanging it.
+        root = self.pt.new_root('root', uuidutils.generate_uuid())
+        n_readers = 20
+        inside = []
+        all_inside = threading.Event()
+        release = threading.Event()
+        orig_has_traits = provider_tree._Provider.has_traits
+
+        def blocking_has_traits(provider, traits):
+            inside.append(provider)
+            if len(inside) == n_readers:
+                all_inside.set()
+            release.wait(10)
+            return orig_has_traits(provider, traits)
+
+        results = []
+        with mock.patch.object(provider_tree._Provider, 'has_traits',
+                               autospec=True,
+                               side_effect=blocking_has_traits):
+            readers = [threading.Thread(
+                target=lambda: results.append(
+                    self.pt.has_traits(root, ['CUSTOM_A'])))
+                for _ in range(n_readers)]
+            for t in readers:
+                t.start()
+            try:
+                self.assertTrue(all_inside.wait(10),
+                                '%d of %d readers got in' %
+                                (len(inside), n_readers))
+
+                writer = threading.Thread(
+                    target=self.pt.add_traits, args=(root, 'CUSTOM_A'))
+                writer.start()
+                writer.join(0.1)
+                self.assertTrue(writer.is_alive())
+                self.assertEqual(frozenset(), inside[0].traits)
+            finally:
+                release.set()
+            for t in readers + [writer]:
+                t.join(10)
+                self.assertFalse(t.is_alive())
+
+        self.assertEqual([False] * n_readers, results)
+        self.assertTrue(self.pt.has_traits(root, ['CUSTOM_A']))
@@ -16,15 +16,18 @@
 
 """Cyborg agent resource_tracker test cases."""
 
+import datetime
 import os
 
 import fixtures
 
 from cyborg.accelerator.drivers.fpga import utils
 from cyborg.accelerator.drivers.fpga.intel import sysinfo
+from cyborg.agent import resource_tracker
 from cyborg.agent.resource_tracker import ResourceTracker
 from cyborg.conductor import rpcapi as cond_api
 from cyborg.conf import CONF
+from cyborg import objects
 from cyborg.tests import base
 from cyborg.tests.unit.accelerator.drivers.fpga.intel import prepare_test_data
 
@@ -105,3 +108,33 @@ class TestResourceTracker(base.TestCase):
 
         fpgas = self.rt._get_fpga_devices()
         self.assertDictEqual(expect, fpgas)
+
+
+class TestIdempotencyKey(base.TestCase):
+
+    def _changed(self, updated_at, state):
+        obj = objects.ExtARQ(uuid='5f0c2a4e-8d3b-4c1f-9a6e-2b7d1e0f3a41',
+                             state='Initial', updated_at=updated_at)
+        obj.obj_reset_changes()
+        obj.state = state
+        return obj
+
+    def test_same_change_same_key(self):
+        when = datetime.datetime(2026, 10, 19, 12, 0)
+        key = resource_tracker._idempotency_key(
+            'update', self._changed(when, 'Bound'))
+        self.assertEqual(key, resource_tracker._idempotency_key(
+            'update', self._changed(when, 'Bound')))
+        self.assertNotEqual(key, resource_tracker._idempotency_key(
+            'update', self._changed(when, 'Unbound')))
+        self.assertNotEqual(key, resource_tracker._idempotency_key(
+            'delete', self._changed(when, 'Bound')))
+
+    def test_newer_row_new_key(self):
+        when = datetime.datetime(2026, 10, 19, 12, 0)
+        self.assertNotEqual(
+            resource_tracker._idempotency_key(
+                'update', self._changed(when, 'Bound')),
+            resource_tracker._idempotency_key(
+                'update', self._changed(
+                    when + datetime.timedelta(seconds=1), 'Bound')))
@@ -0,0 +1,180 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for the read-only list projections."""
+
+import fixtures
+import mock
+from oslo_db.sqlalchemy import enginefacade
+from oslo_serialization import jsonutils
+from webob import etag as webob_etag
+from webob import exc as webob_exc
+from wsme.rest import json as wsme_json
+
+from cyborg.api.controllers import base as controllers_base
+from cyborg.api.controllers.v2 import arqs
+from cyborg.api.controllers.v2 import device_profiles
+from cyborg.db.sqlalchemy import models
+from cyborg import objects
+from cyborg.objects import base as objects_base
+from cyborg.tests.unit.db import base
+
+
+class _ListTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(_ListTestCase, self).setUp()
+        with enginefacade.writer.using(self.context) as session:
+            for i in range(3):
+                devprof = models.DeviceProfile(
+                    uuid='0b8d3a1e-6a4f-4a43-9d1c-3f0b5c4c2d7%d' % i,
+                    name='dp%d' % i, json='{"groups": []}')
+                session.add(devprof)
+                session.flush()
+                session.add(models.ExtARQ(
+                    uuid='1c9e4b2f-7b50-4b54-8e2d-4a1c6d5d3e8%d' % i,
+                    state='Bound', device_profile_id=devprof.id,
+                    instance_uuid='vm%d' % i))
+        self.request = mock.Mock(public_url='http://cyborg:6666',
+                                 context=self.context, GET={},
+                                 if_none_match=webob_etag.NoETag)
+        self.useFixture(fixtures.MockPatch('pecan.request', self.request))
+        self.response = self.useFixture(
+            fixtures.MockPatch('pecan.response')).mock
+
+
+class TestProjections(_ListTestCase):
+
+    def _check_same_json(self, expected_type, expected, body):
+        self.assertEqual(wsme_json.tojson(expected_type, expected),
+                         jsonutils.loads(body))
+
+    def test_device_profiles_match_wsme(self):
+        with mock.patch.object(objects_base.CyborgObject,
+                               '__init__') as mock_init:
+            body = device_profiles.DeviceProfilesController().get_all()
+        # No versioned object is built on the fast path.
+        self.assertFalse(mock_init.called)
+        expected = device_profiles.DeviceProfileCollection.convert_with_links(
+            objects.DeviceProfile.list(self.context))
+        self._check_same_json(device_profiles.DeviceProfileCollection,
+                              expected, body)
+
+    def test_arqs_match_wsme(self):
+        body = arqs.ARQsController().get_all(state='resolved')
+        # objects.ARQ is what the ARQ type is written against.
+        with mock.patch.object(objects, 'ARQ', objects.ExtARQ, create=True):
+            expected = arqs.ARQCollection.convert_with_links(
+                objects.ExtARQ.list(self.context))
+        self._check_same_json(arqs.ARQCollection, expected, body)
+
+    def test_arqs_bad_state(self):
+        exc = self.assertRaises(webob_exc.HTTPBadRequest,
+                                arqs.ARQsController().get_all,
+                                state='Bound')
+        self.assertIn('Only state "resolved" is supported', exc.detail)
+
+    def test_arqs_stream_matches_render(self):
+        body = arqs.ARQsController().get_all()
+        self.config(list_stream_batch_size=2, group='api')
+        response = arqs.ARQsController().get_all()
+        self.assertEqual(body, b''.join(response.app_iter).decode('utf-8'))
+        self.assertIsNone(response.content_length)
+
+    def test_device_profiles_stream_filters_by_name(self):
+        self.config(list_stream_batch_size=1, group='api')
+        self.request.GET = {'name': 'dp1'}
+        response = device_profiles.DeviceProfilesController().get_all()
+        body = jsonutils.loads(b''.join(response.app_iter))
+        self.assertEqual(['dp1'],
+                         [dp['name'] for dp in body['device_profiles']])
+
+    def test_stream_reads_rows_lazily(self):
+        projection = controllers_base.Projection('things', ('uuid', 'n'))
+        pulled = []
+
+        def rows():
+            for n in range(10):
+                pulled.append(n)
+                yield ('uuid-%d' % n, n)
+
+        response = projection.stream(rows(), 3)
+        chunks = iter(response.app_iter)
+        body = [next(chunks)]
+        self.assertEqual([], pulled)
+        body.append(next(chunks))
+        self.assertEqual([0, 1, 2], pulled)
+        body.extend(chunks)
+        self.assertEqual(list(range(10)), pulled)
+        self.assertEqual(
+            projection.render(('uuid-%d' % n, n) for n in range(10)),
+            b''.join(body).decode('utf-8'))
+
+
+class TestConditionalGet(_ListTestCase):
+
+    def _get_arqs(self, etag=None, **kwargs):
+        self.request.if_none_match = webob_etag.ETagMatcher(
+            [etag] if etag else [])
+        self.response.status = 200
+        body = arqs.ARQsController().get_all(**kwargs)
+        return body, self.response.etag
+
+    def test_unchanged_arqs_not_modified(self):
+        body, etag = self._get_arqs()
+        self.assertEqual(3, len(jsonutils.loads(body)['arqs']))
+        extarq_list = self.useFixture(fixtures.MockPatchObject(
+            objects.ExtARQ.dbapi, 'extarq_list')).mock
+        body, new_etag = self._get_arqs(etag)
+        self.assertEqual('', body)
+        self.assertEqual(304, self.response.status)
+        self.assertEqual(etag, new_etag)
+        self.assertFalse(extarq_list.called)
+
+    def test_arq_change_changes_etag(self):
+        _body, etag = self._get_arqs()
+        self.dbapi.extarq_delete(self.context,
+                                 '1c9e4b2f-7b50-4b54-8e2d-4a1c6d5d3e80')
+        body, new_etag = self._get_arqs(etag)
+        self.assertNotEqual(etag, new_etag)
+        self.assertEqual(200, self.response.status)
+        self.assertEqual(2, len(jsonutils.loads(body)['arqs']))
+
+    def test_device_profile_change_changes_arqs_etag(self):
+        # ARQs render the name of their device profile.
+        _body, etag = self._get_arqs()
+        self.dbapi.device_profile_create(self.context, {'name': 'dp3',
+                                                        'json': '{}'})
+        _body, new_etag = self._get_arqs(etag)
+        self.assertNotEqual(etag, new_etag)
+        self.assertEqual(200, self.response.status)
+
+    def test_filters_change_etag(self):
+        _body, etag = self._get_arqs()
+        body, new_etag = self._get_arqs(etag, state='resolved')
+        self.assertNotEqual(etag, new_etag)
+        self.assertEqual(200, self.response.status)
+
+    def test_device_profiles_not_modified_until_deleted(self):
+        controller = device_profiles.DeviceProfilesController()
+        controller.get_all()
+        etag = self.response.etag
+        self.request.if_none_match = webob_etag.ETagMatcher([etag])
+        self.assertEqual('', controller.get_all())
+        self.assertEqual(304, self.response.status)
+
+        self.response.status = 200
+        self.dbapi.device_profile_delete(
+            self.context, '0b8d3a1e-6a4f-4a43-9d1c-3f0b5c4c2d72')
+        body = controller.get_all()
+        self.assertNotEqual(etag, self.response.etag)
+        self.assertEqual(2, len(jsonutils.loads(body)['device_profiles']))
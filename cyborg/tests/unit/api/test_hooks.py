@@ -0,0 +1,57 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for the API hooks."""
+
+import fixtures
+import mock
+
+from cyborg.api import hooks
+from cyborg import context
+from cyborg.tests.unit.db import base
+
+
+class TestContextHookCheckouts(base.DbTestCase):
+
+    def setUp(self):
+        super(TestContextHookCheckouts, self).setUp()
+        self.hook = hooks.ContextHook([], report_every=3)
+        self.m_log = self.useFixture(
+            fixtures.MockPatchObject(hooks, 'LOG')).mock
+
+    def _request(self, n_reads):
+        ctx = context.RequestContext(user_id='user', project_id='project')
+        for _ in range(n_reads):
+            self.dbapi.device_profile_list(ctx)
+        state = mock.Mock()
+        state.request.context = ctx
+        self.hook.after(state)
+
+    def test_checkout_histogram(self):
+        self._request(1)
+        self._request(2)
+        self._request(2)
+
+        stats = self.hook.checkout_stats()
+        self.assertEqual({1: 1, 2: 2}, stats['histogram'])
+        self.assertEqual(3, stats['requests'])
+        self.assertEqual(5, stats['checkouts'])
+        self.assertAlmostEqual(5.0 / 3, stats['mean'])
+        self.m_log.info.assert_called_once_with(
+            mock.ANY, stats)
+
+    def test_no_context(self):
+        state = mock.Mock()
+        state.request.context = None
+        self.hook.after(state)
+        self.assertEqual(0, self.hook.checkout_stats()['requests'])
+        self.assertFalse(self.m_log.info.called)
@@ -0,0 +1,152 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for the conductor apply queue and cast RPC variants."""
+
+import eventlet
+import mock
+
+from cyborg.conductor import apply_queue
+from cyborg.conductor import rpcapi
+from cyborg import objects
+from cyborg.tests import base
+
+ARQ = '5f0c2a4e-8d3b-4c1f-9a6e-2b7d1e0f3a41'
+
+
+class TestApplyQueue(base.TestCase):
+
+    def setUp(self):
+        super(TestApplyQueue, self).setUp()
+        self.queue = apply_queue.ApplyQueue(seen_size=4)
+        # Keep the background worker out of the way; tests drain by hand.
+        self.queue._start_worker_locked = mock.Mock()
+        self.applied = []
+
+    def _apply(self, value):
+        self.applied.append(value)
+
+    def test_duplicate_key_dropped(self):
+        self.assertTrue(self.queue.submit('k1', 'dep1', self._apply, 1))
+        self.assertEqual(1, self.queue.drain())
+        self.assertFalse(self.queue.submit('k1', 'dep1', self._apply, 1))
+        self.assertEqual(0, self.queue.drain())
+        self.assertEqual([1], self.applied)
+        stats = self.queue.stats()
+        self.assertEqual(2, stats['submitted'])
+        self.assertEqual(1, stats['duplicates'])
+
+    def _save(self, obj):
+        self.applied.append(('update', obj.obj_get_changes()))
+
+    def _delete(self, obj):
+        self.applied.append(('delete', obj.uuid))
+
+    def test_pending_updates_coalesced(self):
+        self.queue.submit('k1', 'dep1', self._apply, 1)
+        self.queue.submit('k2', 'dep2', self._apply, 2)
+        self.queue.submit('k3', 'dep1', self._apply, 3)
+        self.assertEqual(3, self.queue.stats()['depth'])
+        self.assertEqual(3, self.queue.drain())
+        # Calls for one object stay together and in order.
+        self.assertEqual([1, 3, 2], self.applied)
+        self.assertEqual(0, self.queue.stats().get('coalesced', 0))
+
+    def test_partial_updates_merged(self):
+        self.queue.submit('k1', 'arq1', self._save,
+                          objects.ExtARQ(uuid=ARQ, state='Bound'),
+                          coalesce=True)
+        self.queue.submit('k2', 'arq1', self._save,
+                          objects.ExtARQ(uuid=ARQ, host_name='host1'),
+                          coalesce=True)
+        self.queue.submit('k3', 'arq1', self._save,
+                          objects.ExtARQ(uuid=ARQ, state='Unbound'),
+                          coalesce=True)
+        self.assertEqual(1, self.queue.drain())
+        self.assertEqual([('update', {'uuid': ARQ, 'state': 'Unbound',
+                                      'host_name': 'host1'})], self.applied)
+        self.assertEqual(2, self.queue.stats()['coalesced'])
+
+    def test_update_does_not_replace_delete(self):
+        self.queue.submit('k1', 'arq1', self._delete,
+                          objects.ExtARQ(uuid=ARQ))
+        self.queue.submit('k2', 'arq1', self._save,
+                          objects.ExtARQ(uuid=ARQ, state='Bound'),
+                          coalesce=True)
+        self.assertEqual(2, self.queue.drain())
+        self.assertEqual(['delete', 'update'],
+                         [kind for kind, _arg in self.applied])
+
+    def test_failed_merged_update_can_be_retried(self):
+        failing = mock.Mock(side_effect=ValueError)
+        for key in ('k1', 'k2'):
+            self.queue.submit(key, 'arq1', failing,
+                              objects.ExtARQ(uuid=ARQ), coalesce=True)
+        self.queue.drain()
+        for key in ('k1', 'k2'):
+            self.assertTrue(self.queue.submit(key, 'arq1', self._apply, 1))
+
+    def test_failed_update_can_be_retried(self):
+        failing = mock.Mock(side_effect=ValueError)
+        self.queue.submit('k1', 'dep1', failing)
+        self.assertEqual(0, self.queue.drain())
+        self.assertEqual(1, self.queue.stats()['failed'])
+        self.assertTrue(self.queue.submit('k1', 'dep1', self._apply, 1))
+        self.queue.drain()
+        self.assertEqual([1], self.applied)
+
+    def test_seen_keys_bounded(self):
+        for i in range(6):
+            self.queue.submit('k%d' % i, 'dep%d' % i, self._apply, i)
+        self.queue.drain()
+        self.assertEqual(4, len(self.queue._seen))
+        self.assertTrue(self.queue.submit('k0', 'dep0', self._apply, 0))
+
+    def test_worker_applies_in_background(self):
+        queue = apply_queue.ApplyQueue()
+        queue.submit('k1', 'dep1', self._apply, 1)
+        for _ in range(100):
+            if self.applied:
+                break
+            eventlet.sleep(0.01)
+        self.assertEqual([1], self.applied)
+        self.assertEqual(0, queue.stats()['depth'])
+
+
+class TestConductorAPICasts(base.TestCase):
+
+    def setUp(self):
+        super(TestConductorAPICasts, self).setUp()
+        self.api = rpcapi.ConductorAPI.__new__(rpcapi.ConductorAPI)
+        self.api.topic = 'cyborg-conductor'
+        self.api.client = mock.Mock()
+        self.cctxt = self.api.client.prepare.return_value
+
+    def test_update_async_casts_with_key(self):
+        self.api.client.can_send_version.return_value = True
+        obj = mock.Mock()
+        self.api.deployable_update_async(mock.sentinel.ctx, obj,
+                                         idempotency_key='key')
+        self.api.client.prepare.assert_called_once_with(
+            topic='cyborg-conductor', version='1.1')
+        self.cctxt.cast.assert_called_once_with(
+            mock.sentinel.ctx, 'deployable_update_async', obj_dep=obj,
+            idempotency_key='key')
+        self.assertFalse(self.cctxt.call.called)
+
+    def test_update_async_falls_back_to_call(self):
+        self.api.client.can_send_version.return_value = False
+        obj = mock.Mock()
+        self.api.deployable_delete_async(mock.sentinel.ctx, obj, 'key')
+        self.cctxt.call.assert_called_once_with(
+            mock.sentinel.ctx, 'deployable_delete', obj_dep=obj)
+        self.assertFalse(self.cctxt.cast.called)
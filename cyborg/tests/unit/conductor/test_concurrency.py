@@ -0,0 +1,131 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for the conductor per-method concurrency limits."""
+
+import eventlet
+import mock
+
+from cyborg.common import exception
+from cyborg.conductor import concurrency
+from cyborg.conductor import manager
+from cyborg.tests import base
+
+
+class TestConcurrencyLimiter(base.TestCase):
+
+    def _hold(self, limiter, event, started):
+        with limiter.slot():
+            started.append(True)
+            event.wait()
+
+    def test_unlimited(self):
+        limiter = concurrency.ConcurrencyLimiter('m')
+        with limiter.slot():
+            with limiter.slot():
+                self.assertEqual(2, limiter.stats()['active'])
+        stats = limiter.stats()
+        self.assertEqual(2, stats['calls'])
+        self.assertEqual(0, stats['active'])
+
+    def test_waits_for_slot(self):
+        limiter = concurrency.ConcurrencyLimiter('m', limit=1, timeout=5)
+        event = eventlet.event.Event()
+        started = []
+        holder = eventlet.spawn(self._hold, limiter, event, started)
+        eventlet.sleep(0)
+        waiter = eventlet.spawn(self._hold, limiter, event, started)
+        eventlet.sleep(0)
+        self.assertEqual(1, len(started))
+        self.assertEqual(1, limiter.stats()['depth'])
+        event.send()
+        holder.wait()
+        waiter.wait()
+        stats = limiter.stats()
+        self.assertEqual(2, stats['calls'])
+        self.assertEqual(0, stats['depth'])
+        self.assertGreaterEqual(stats['wait_max'], 0.0)
+
+    def test_rejects_when_queue_full(self):
+        limiter = concurrency.ConcurrencyLimiter('m', limit=1, max_queued=1,
+                                                 timeout=5)
+        event = eventlet.event.Event()
+        started = []
+        holder = eventlet.spawn(self._hold, limiter, event, started)
+        eventlet.sleep(0)
+        waiter = eventlet.spawn(self._hold, limiter, event, started)
+        eventlet.sleep(0)
+        self.assertRaises(exception.ConductorBusy,
+                          self._hold, limiter, event, started)
+        self.assertEqual(1, limiter.stats()['rejected'])
+        event.send()
+        holder.wait()
+        waiter.wait()
+
+    def test_rejects_after_timeout(self):
+        limiter = concurrency.ConcurrencyLimiter('m', limit=1,
+                                                 timeout=0.01)
+        with limiter.slot():
+            self.assertRaises(exception.ConductorBusy,
+                              self._hold, limiter, None, [])
+        self.assertEqual(1, limiter.stats()['rejected'])
+        with limiter.slot():
+            pass
+
+    def test_method_limits(self):
+        limiters = concurrency.MethodLimiters(limits={'arq_create': '2'},
+                                              default_limit=5)
+        self.assertEqual(2, limiters.get('arq_create').limit)
+        self.assertEqual(5, limiters.get('deployable_update').limit)
+        self.assertIs(limiters.get('arq_create'),
+                      limiters.get('arq_create'))
+
+
+class TestConductorManagerLimits(base.TestCase):
+
+    def test_arq_create_does_not_starve_deployables(self):
+        self.config(max_concurrent_requests={'arq_create': '1'},
+                    queue_timeout=0, max_queued_requests=0,
+                    group='conductor')
+        mgr = manager.ConductorManager('cyborg-conductor', 'host')
+        event = eventlet.event.Event()
+        arq = mock.Mock()
+        arq.create.side_effect = lambda *args: event.wait()
+        creates = [eventlet.spawn(mgr.arq_create, None, arq)
+                   for _ in range(3)]
+        eventlet.sleep(0)
+        dep = mock.Mock()
+        self.assertIs(dep, mgr.deployable_update(None, dep))
+        stats = mgr.concurrency_stats()
+        self.assertEqual(1, stats['arq_create']['active'])
+        self.assertEqual(2, stats['arq_create']['depth'])
+        self.assertEqual(1, stats['deployable_update']['calls'])
+        self.assertIn('apply_queue', stats)
+        event.send()
+        for create in creates:
+            create.wait()
+        self.assertEqual(3, mgr.concurrency_stats()['arq_create']['calls'])
+
+    def test_queued_updates_bypass_limits(self):
+        # A cast has no caller to retry it, so the apply queue must not
+        # hit ConductorBusy however busy the synchronous endpoint is.
+        self.config(max_concurrent_requests={'arq_update': '1'},
+                    queue_timeout=1, group='conductor')
+        mgr = manager.ConductorManager('cyborg-conductor', 'host')
+        mgr._apply_queue._start_worker_locked = mock.Mock()
+        arq = mock.Mock(uuid='arq1')
+        with mgr._limiters.get('arq_update').slot():
+            self.assertRaises(exception.ConductorBusy, mgr.arq_update,
+                              None, arq)
+            mgr.arq_update_async(None, arq, 'key1')
+            self.assertEqual(1, mgr._apply_queue.drain())
+        arq.save.assert_called_once_with(None)
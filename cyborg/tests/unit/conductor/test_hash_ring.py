@@ -0,0 +1,229 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for host sharding across several conductors."""
+
+import collections
+import datetime
+
+import mock
+from oslo_db import exception as db_exc
+from oslo_db.sqlalchemy import enginefacade
+import oslo_messaging as messaging
+from oslo_utils import timeutils
+
+from cyborg.common import hash_ring
+from cyborg.common import rpc
+from cyborg.conductor import manager
+from cyborg.conductor import rpcapi
+from cyborg import context
+from cyborg.db.sqlalchemy import models
+from cyborg.objects import base as objects_base
+from cyborg.tests import base as test_base
+from cyborg.tests.unit.db import base
+
+
+HOSTS = ['compute-%d' % i for i in range(60)]
+
+
+class TestHashRing(test_base.TestCase):
+
+    def test_empty_ring(self):
+        self.assertIsNone(hash_ring.HashRing([]).get_node('compute-0'))
+
+    def test_hosts_spread_over_nodes(self):
+        ring = hash_ring.HashRing(['c1', 'c2', 'c3'])
+        owners = collections.Counter(ring.get_node(h) for h in HOSTS)
+        self.assertEqual({'c1', 'c2', 'c3'}, set(owners))
+        self.assertEqual(len(HOSTS), sum(owners.values()))
+
+    def test_removing_node_only_moves_its_hosts(self):
+        before = hash_ring.HashRing(['c1', 'c2', 'c3'])
+        after = hash_ring.HashRing(['c1', 'c2'])
+        for host in HOSTS:
+            if before.get_node(host) != 'c3':
+                self.assertEqual(before.get_node(host), after.get_node(host))
+
+
+class TestConductorHeartbeat(base.DbTestCase):
+
+    def setUp(self):
+        super(TestConductorHeartbeat, self).setUp()
+        self.context = context.get_admin_context()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def test_heartbeat_and_timeout(self):
+        now = timeutils.utcnow()
+        timeutils.set_time_override(now)
+        self.dbapi.conductor_heartbeat(self.context, 'c1')
+        timeutils.set_time_override(now + datetime.timedelta(seconds=30))
+        self.dbapi.conductor_heartbeat(self.context, 'c2')
+        self.assertEqual(['c1', 'c2'],
+                         self.dbapi.conductor_get_active(self.context, 60))
+        timeutils.set_time_override(now + datetime.timedelta(seconds=70))
+        self.assertEqual(['c2'],
+                         self.dbapi.conductor_get_active(self.context, 60))
+        self.dbapi.conductor_heartbeat(self.context, 'c1')
+        self.assertEqual(['c1', 'c2'],
+                         self.dbapi.conductor_get_active(self.context, 60))
+
+    def test_unregister(self):
+        self.dbapi.conductor_heartbeat(self.context, 'c1')
+        self.dbapi.conductor_unregister(self.context, 'c1')
+        self.assertEqual([],
+                         self.dbapi.conductor_get_active(self.context, 60))
+
+
+class RecordingConductor(manager.ConductorManager):
+    """Conductor whose deployable_get_by_host records the hosts it serves."""
+
+    def __init__(self, topic, host, calls):
+        super(RecordingConductor, self).__init__(topic, host)
+        self.calls = calls
+
+    @manager.routed()
+    def deployable_get_by_host(self, context, host, compact=False):
+        self.calls[self.host].append(host)
+        return self.host
+
+
+class TestShardedConductors(base.DbTestCase):
+    """Run several conductors in-process on the fake messaging driver."""
+
+    def setUp(self):
+        super(TestShardedConductors, self).setUp()
+        self.config(transport_url='fake:/')
+        rpc.init(self.cfg_fixture.conf)
+        self.addCleanup(rpc.cleanup)
+        self.context = context.get_admin_context()
+        self.calls = collections.defaultdict(list)
+        self.managers = {}
+        for name in ('c1', 'c2', 'c3'):
+            self._start_conductor(name)
+
+    def _start_conductor(self, name):
+        mgr = RecordingConductor('cyborg-conductor', name, self.calls)
+        mgr.init_host(self.context)
+        target = messaging.Target(topic='cyborg-conductor', server=name)
+        server = rpc.get_server(target, [mgr],
+                                objects_base.CyborgObjectSerializer())
+        server.start()
+        self.addCleanup(server.wait)
+        self.addCleanup(server.stop)
+        self.managers[name] = mgr
+
+    def test_calls_handled_by_owner(self):
+        api = rpcapi.ConductorAPI(topic='cyborg-conductor')
+        for host in HOSTS:
+            served_by = api.deployable_get_by_host(self.context, host)
+            self.assertTrue(self.managers[served_by].owns_host(host))
+        # Every conductor takes a share of the hosts, and each host is
+        # only ever handled by one of them.
+        self.assertEqual({'c1', 'c2', 'c3'}, set(self.calls))
+        self.assertEqual(sorted(HOSTS),
+                         sorted(h for hosts in self.calls.values()
+                                for h in hosts))
+
+    def test_client_does_not_read_ring(self):
+        api = rpcapi.ConductorAPI(topic='cyborg-conductor')
+        with mock.patch.object(hash_ring.HashRingManager,
+                               'get_owner') as m_owner:
+            m_owner.side_effect = AssertionError
+            api.client = mock.Mock()
+            api.client.can_send_version.return_value = True
+            api.deployable_get_by_host(self.context, HOSTS[0])
+        api.client.prepare.assert_called_once_with(
+            topic='cyborg-conductor', version='1.3')
+
+    def test_unknown_owner_handled_locally(self):
+        mgr = self.managers['c1']
+        with mock.patch.object(mgr.ring_manager, 'get_owner',
+                               side_effect=db_exc.DBError):
+            for host in HOSTS:
+                self.assertEqual(
+                    'c1', mgr.deployable_get_by_host(self.context,
+                                                     host=host))
+        self.assertEqual({'c1': HOSTS}, dict(self.calls))
+
+    def test_dead_conductor_hosts_move(self):
+        api = rpcapi.ConductorAPI(topic='cyborg-conductor')
+        api.deployable_get_by_host(self.context, HOSTS[0])
+        self.managers['c3'].del_host(self.context)
+        for mgr in self.managers.values():
+            mgr.ring_manager.reset()
+        self.calls.clear()
+        for host in HOSTS:
+            self.assertNotEqual(
+                'c3', api.deployable_get_by_host(self.context, host))
+        self.assertNotIn('c3', self.calls)
+
+
+class TestReconcileHosts(base.DbTestCase):
+
+    def setUp(self):
+        super(TestReconcileHosts, self).setUp()
+        self.context = context.get_admin_context()
+        self.managers = [manager.ConductorManager('cyborg-conductor', name)
+                         for name in ('c1', 'c2')]
+        for mgr in self.managers:
+            mgr.init_host(self.context)
+        with enginefacade.writer.using(self.context) as session:
+            devprof = models.DeviceProfile(uuid='dp1-uuid', name='dp1',
+                                           json='{}')
+            devices = [models.Device(type='FPGA', vendor='v', model='m',
+                                     hostname=host) for host in HOSTS]
+            session.add_all(devices + [devprof])
+            session.flush()
+            # Every host has one leaked handle and one an ExtARQ holds.
+            handles = {}
+            for device in devices:
+                handles[device.hostname] = [
+                    models.AttachHandle(device_id=device.id,
+                                        type_name='PCI', in_use=True,
+                                        info='0000:af:00.%d' % i)
+                    for i in range(2)]
+                session.add_all(handles[device.hostname])
+            session.flush()
+            session.add_all([
+                models.ExtARQ(uuid='arq-%s' % host, state='Bound',
+                              device_profile_id=devprof.id,
+                              attach_handle_id=handles[host][0].id)
+                for host in HOSTS])
+
+    def _handles_in_use(self):
+        with enginefacade.reader.using(self.context) as session:
+            return session.query(models.AttachHandle).filter_by(
+                in_use=True).count()
+
+    def test_hosts_split_between_conductors(self):
+        reconciled = collections.defaultdict(list)
+        orig = self.managers[0].dbapi.attach_handle_reconcile
+
+        def attach_handle_reconcile(context, hostname):
+            reconciled[hostname].append(mgr.host)
+            return orig(context, hostname)
+
+        for mgr in self.managers:
+            with mock.patch.object(mgr.dbapi, 'attach_handle_reconcile',
+                                   side_effect=attach_handle_reconcile):
+                mgr._reconcile_hosts(self.context)
+
+        # Each host was reconciled exactly once, and both conductors took
+        # a share of the hosts.
+        self.assertEqual(sorted(HOSTS), sorted(reconciled))
+        owners = collections.Counter(hosts[0]
+                                     for hosts in reconciled.values())
+        self.assertEqual({'c1', 'c2'}, set(owners))
+        self.assertTrue(all(len(hosts) == 1
+                            for hosts in reconciled.values()))
+        # Only the leaked handles were released.
+        self.assertEqual(len(HOSTS), self._handles_in_use())
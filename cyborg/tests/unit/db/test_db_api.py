@@ -15,9 +15,19 @@
 """Unit tests for the DB api."""
 
 import datetime
+
+import eventlet
+import mock
+from oslo_db import exception as db_exc
+from oslo_db.sqlalchemy import enginefacade
+from sqlalchemy import event
+
+from cyborg import context
+from cyborg.common import exception
 from cyborg.tests.unit.db import base
 from cyborg.db import api as dbapi
 from cyborg.db.sqlalchemy import api as sqlalchemyapi
+from cyborg.db.sqlalchemy import models
 
 
 def _quota_reserve(context, project_id):
@@ -127,3 +137,303 @@ class DBAPIReservationTestCase(base.DbTestCase):
             result[v.resource] = dict(in_use=v.in_use,
                                       reserved=v.reserved)
         self.assertEqual(expected, result)
+
+
+class DBAPIReadReplicaTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(DBAPIReadReplicaTestCase, self).setUp()
+        self.dbapi.device_profile_create(
+            self.context, {'name': 'dp1', 'json': '{}'})
+
+    def test_use_slave_falls_back_to_primary(self):
+        # No slave_connection is configured, so replica reads still see
+        # everything on the primary.
+        devprofs = self.dbapi.device_profile_list(self.context,
+                                                  use_slave=True)
+        self.assertEqual(['dp1'], [dp.name for dp in devprofs])
+        self.assertEqual(
+            'dp1',
+            self.dbapi.device_profile_get(self.context, 'dp1',
+                                          use_slave=True).name)
+
+    @mock.patch.object(sqlalchemyapi.enginefacade, 'reader')
+    def test_use_slave_routing(self, mock_reader):
+        self.dbapi.read_transaction(self.context, use_slave=True)
+        mock_reader.async_.using.assert_called_once_with(
+            sqlalchemyapi._CONTEXT)
+        self.assertFalse(mock_reader.using.called)
+
+        mock_reader.reset_mock()
+        self.dbapi.read_transaction(self.context)
+        mock_reader.using.assert_called_once_with(sqlalchemyapi._CONTEXT)
+        self.assertFalse(mock_reader.async_.using.called)
+
+
+class DBAPIRequestTransactionTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(DBAPIRequestTransactionTestCase, self).setUp()
+        self.dbapi.device_profile_create(
+            self.context, {'name': 'dp1', 'json': '{}'})
+        self.req_ctx = context.RequestContext(user_id='user',
+                                              project_id='project')
+
+    def test_model_query_needs_transaction(self):
+        self.assertRaises(db_exc.NoEngineContextEstablished,
+                          sqlalchemyapi.model_query, self.req_ctx,
+                          models.DeviceProfile)
+
+    def test_reads_share_request_transaction(self):
+        with self.dbapi.read_transaction(self.req_ctx):
+            session = self.req_ctx.session
+            devprof = self.dbapi.device_profile_get(self.req_ctx, 'dp1')
+            self.assertIs(devprof,
+                          self.dbapi.device_profile_get_by_id(self.req_ctx,
+                                                              devprof.id))
+            self.assertEqual(['dp1'], [dp.name for dp in
+                             self.dbapi.device_profile_list(self.req_ctx)])
+            self.assertIs(session, self.req_ctx.session)
+        self.assertEqual(1, self.req_ctx.db_checkouts)
+
+    def test_reads_without_request_transaction(self):
+        devprof = self.dbapi.device_profile_get(self.req_ctx, 'dp1')
+        self.dbapi.device_profile_get_by_id(self.req_ctx, devprof.id)
+        self.assertEqual(2, self.req_ctx.db_checkouts)
+
+
+class DBAPIBulkUpsertTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(DBAPIBulkUpsertTestCase, self).setUp()
+        self.statements = []
+        engine = enginefacade.writer.get_engine()
+
+        def count(conn, cursor, statement, parameters, context, many):
+            if statement.lstrip().upper().startswith(('INSERT', 'UPDATE')):
+                self.statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', count)
+        self.addCleanup(event.remove, engine,
+                        'before_cursor_execute', count)
+
+    def _attributes(self, n, value='v'):
+        return [{'uuid': 'attr-%04d' % i, 'deployable_id': 1,
+                 'key': 'k%d' % i, 'value': value} for i in range(n)]
+
+    def _rows(self, model):
+        with self.dbapi.read_transaction(self.context):
+            return sqlalchemyapi.model_query(
+                self.context, model).order_by(model.uuid).all()
+
+    def test_attribute_bulk_upsert(self):
+        uuids = self.dbapi.attribute_bulk_upsert(self.context,
+                                                 self._attributes(3))
+        self.assertEqual(['attr-0000', 'attr-0001', 'attr-0002'], uuids)
+
+        values = self._attributes(4, value='new')
+        values[0]['value'] = 'changed'
+        self.dbapi.attribute_bulk_upsert(self.context, values)
+        rows = self._rows(models.Attribute)
+        self.assertEqual(['changed', 'new', 'new', 'new'],
+                         [row.value for row in rows])
+        self.assertIsNotNone(rows[0].updated_at)
+        self.assertIsNone(rows[3].updated_at)
+
+    def test_deployable_bulk_upsert_generates_uuids(self):
+        uuids = self.dbapi.deployable_bulk_upsert(
+            self.context, [{'device_id': 1, 'num_accelerators': 2},
+                           {'device_id': 1, 'num_accelerators': 4}])
+        self.assertEqual(sorted(uuids),
+                         [row.uuid for row in self._rows(models.Deployable)])
+
+    @mock.patch.object(sqlalchemyapi, '_upsert_statement', return_value=None)
+    def test_generic_fallback(self, mock_stmt):
+        self.dbapi.attribute_bulk_upsert(self.context, self._attributes(2))
+        self.dbapi.attribute_bulk_upsert(self.context,
+                                         self._attributes(3, value='new'))
+        self.assertEqual(['new', 'new', 'new'],
+                         [row.value for row in self._rows(models.Attribute)])
+
+    def test_throughput(self):
+        # Not a timing benchmark: it counts the write statements sent to the
+        # database, which is what bounds throughput of a resync.
+        self.dbapi.attribute_bulk_upsert(self.context,
+                                         self._attributes(1200))
+        self.assertEqual(3, len(self.statements))
+
+        del self.statements[:]
+        self.dbapi.attribute_bulk_upsert(self.context,
+                                         self._attributes(1200, value='x'),
+                                         chunk_size=1000)
+        self.assertEqual(2, len(self.statements))
+        self.assertEqual(1200, len(self._rows(models.Attribute)))
+
+
+class DBAPIQueryPlanTestCase(base.DbTestCase):
+
+    """Check that hot lookups are index searches, not table scans."""
+
+    def setUp(self):
+        super(DBAPIQueryPlanTestCase, self).setUp()
+        self.engine = enginefacade.writer.get_engine()
+        self.selects = []
+
+        def capture(conn, cursor, statement, parameters, context, many):
+            if statement.lstrip().upper().startswith('SELECT'):
+                self.selects.append((statement, parameters))
+
+        event.listen(self.engine, 'before_cursor_execute', capture)
+        self.addCleanup(event.remove, self.engine, 'before_cursor_execute',
+                        capture)
+
+    def _plan(self):
+        statement, parameters = self.selects[-1]
+        conn = self.engine.raw_connection()
+        try:
+            rows = conn.cursor().execute('EXPLAIN QUERY PLAN ' + statement,
+                                         parameters)
+            return ' '.join(row[-1] for row in rows)
+        finally:
+            conn.close()
+
+    def _assert_index_used(self, index_name):
+        plan = self._plan()
+        self.assertIn('USING INDEX %s' % index_name, plan)
+        self.assertNotIn('SCAN', plan)
+
+    def _lookup(self, model, *criteria):
+        with self.dbapi.read_transaction(self.context):
+            sqlalchemyapi.model_query(self.context, model).filter(
+                *criteria).all()
+
+    def test_extarq_list_by_instance(self):
+        self.dbapi.extarq_list(self.context,
+                               filters={'instance_uuid': 'fake-instance'})
+        self._assert_index_used('extarqs_instance_uuid_idx')
+
+    def test_extarq_list_by_state(self):
+        self.dbapi.extarq_list(self.context,
+                               filters={'state': ['Bound', 'BindFailed']})
+        self._assert_index_used('extarqs_state_idx')
+
+    def test_extarq_list_by_host(self):
+        self.dbapi.extarq_list(self.context,
+                               filters={'host_name': 'fake-host'})
+        self._assert_index_used('extarqs_host_name_idx')
+
+    def test_extarq_list_by_device_profile(self):
+        self.dbapi.extarq_list(self.context,
+                               filters={'device_profile_id': 1})
+        self._assert_index_used('extarqs_device_profile_id_idx')
+
+    def test_extarq_list_bad_filter(self):
+        self.assertRaises(exception.InvalidParameterValue,
+                          self.dbapi.extarq_list, self.context,
+                          filters={'substate': 'Initial'})
+
+    def test_devices_by_hostname(self):
+        self._lookup(models.Device, models.Device.hostname == 'fake-host')
+        self._assert_index_used('devices_hostname_idx')
+
+    def test_deployables_by_device(self):
+        self._lookup(models.Deployable, models.Deployable.device_id == 1)
+        self._assert_index_used('deployables_device_id_idx')
+
+    def test_free_attach_handles_by_device(self):
+        self._lookup(models.AttachHandle,
+                     models.AttachHandle.device_id == 1,
+                     models.AttachHandle.in_use == False)  # noqa
+        self._assert_index_used('attach_handles_device_id_in_use_idx')
+
+
+class DBAPIAttachHandleTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(DBAPIAttachHandleTestCase, self).setUp()
+        self.handle_ids = self._create_handles(device_id=1, count=30)
+        self._create_handles(device_id=2, count=1)
+
+    def _create_handles(self, device_id, count):
+        with enginefacade.writer.using(self.context) as session:
+            handles = [models.AttachHandle(type_name='PCI',
+                                           device_id=device_id,
+                                           info='{"bus": "%02x"}' % i)
+                       for i in range(count)]
+            session.add_all(handles)
+            session.flush()
+            return [handle.id for handle in handles]
+
+    def _in_use(self):
+        with self.dbapi.read_transaction(self.context):
+            return sorted(handle.id for handle in sqlalchemyapi.model_query(
+                self.context, models.AttachHandle).filter_by(in_use=True))
+
+    def test_allocate_and_release(self):
+        handle = self.dbapi.attach_handle_allocate(self.context, 2)
+        self.assertEqual(2, handle.device_id)
+        self.assertTrue(handle.in_use)
+        self.assertRaises(exception.AttachHandleNotAvailable,
+                          self.dbapi.attach_handle_allocate, self.context, 2)
+
+        self.dbapi.attach_handle_release(self.context, handle.id)
+        self.dbapi.attach_handle_release(self.context, handle.id)
+        self.assertEqual([], self._in_use())
+        self.assertEqual(handle.id,
+                         self.dbapi.attach_handle_allocate(self.context,
+                                                           2).id)
+
+    def test_release_unknown_handle(self):
+        self.assertRaises(exception.AttachHandleNotFound,
+                          self.dbapi.attach_handle_release, self.context,
+                          12345)
+
+    def test_allocate_retries_lost_race(self):
+        # Another allocator claims every candidate between our read and
+        # our compare-and-set; the claim must not hand out a taken handle.
+        orig_shuffle = sqlalchemyapi.random.shuffle
+        stolen = []
+
+        def steal(ids):
+            if not stolen:
+                with enginefacade.writer.using(context.get_context()) as s:
+                    s.query(models.AttachHandle).filter(
+                        models.AttachHandle.id.in_(ids)).update(
+                        {'in_use': True}, synchronize_session=False)
+                stolen.extend(ids)
+            orig_shuffle(ids)
+
+        with mock.patch.object(sqlalchemyapi.random, 'shuffle',
+                               side_effect=steal):
+            handle = self.dbapi.attach_handle_allocate(self.context, 1)
+        self.assertNotIn(handle.id, stolen)
+        self.assertEqual(sorted(stolen + [handle.id]), self._in_use())
+
+    def test_concurrent_allocations(self):
+        # Stress test: more green threads than handles allocate, hold the
+        # handle across a context switch, and release it again.
+        holders = {}
+        errors = []
+
+        def worker(n):
+            for _ in range(5):
+                try:
+                    handle = self.dbapi.attach_handle_allocate(
+                        context.get_context(), 1)
+                except exception.AttachHandleNotAvailable:
+                    eventlet.sleep(0)
+                    continue
+                if handle.id in holders:
+                    errors.append((n, holders[handle.id], handle.id))
+                holders[handle.id] = n
+                eventlet.sleep(0)
+                del holders[handle.id]
+                self.dbapi.attach_handle_release(context.get_context(),
+                                                 handle.id)
+
+        pool = eventlet.GreenPool(50)
+        for n in range(50):
+            pool.spawn(worker, n)
+        pool.waitall()
+        self.assertEqual([], errors)
+        self.assertEqual([], self._in_use())
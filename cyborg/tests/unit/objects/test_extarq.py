@@ -0,0 +1,263 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for ExtARQ listing, hydration and binding."""
+
+import datetime
+import random
+import threading
+
+import eventlet
+import fixtures
+import mock
+from oslo_db.sqlalchemy import enginefacade
+from oslo_utils import uuidutils
+from oslo_versionedobjects import fields as ovo_fields
+
+from cyborg.api.controllers.v2 import arq_bindings
+from cyborg.common import exception
+from cyborg import context
+from cyborg import objects
+from cyborg.db.sqlalchemy import api as sqlalchemyapi
+from cyborg.db.sqlalchemy import models
+from cyborg.tests import base as test_base
+from cyborg.tests.unit.db import base
+
+
+class TestExtARQList(base.DbTestCase):
+
+    def setUp(self):
+        super(TestExtARQList, self).setUp()
+        with enginefacade.writer.using(self.context) as session:
+            devprof = models.DeviceProfile(uuid='dp1-uuid', name='dp1',
+                                           json='{}')
+            device = models.Device(type='FPGA', vendor='v', model='m',
+                                   hostname='host1')
+            session.add_all([devprof, device])
+            session.flush()
+            handle = models.AttachHandle(device_id=device.id,
+                                         type_name='PCI',
+                                         info='0000:af:00.1', in_use=True)
+            session.add(handle)
+            session.flush()
+            session.add_all([
+                models.ExtARQ(uuid='arq-bound', state='Bound',
+                              device_profile_id=devprof.id,
+                              host_name='host1', device_rp_uuid='rp1',
+                              instance_uuid='vm1',
+                              attach_handle_id=handle.id),
+                models.ExtARQ(uuid='arq-initial', state='Initial',
+                              device_profile_id=devprof.id)])
+
+    def test_list(self):
+        arqs = dict((arq.uuid, arq) for arq in
+                    objects.ExtARQ.list(self.context))
+        bound = arqs['arq-bound']
+        self.assertEqual('dp1', bound.device_profile_name)
+        self.assertEqual('host1', bound.host_name)
+        self.assertEqual('0000:af:00.1', bound.attach_handle_id_pci)
+        self.assertIsInstance(bound.created_at, datetime.datetime)
+        self.assertIsNotNone(bound.created_at.tzinfo)
+        self.assertEqual(set(), bound.obj_what_changed())
+        initial = arqs['arq-initial']
+        self.assertEqual('', initial.host_name)
+        self.assertEqual('', initial.instance_uuid)
+        self.assertEqual('', initial.attach_handle_id_pci)
+
+    def test_list_filtered(self):
+        arqs = objects.ExtARQ.list(self.context, filters={'state': 'Bound'})
+        self.assertEqual(['arq-bound'], [arq.uuid for arq in arqs])
+
+
+ARQ1 = '5f0c2a4e-8d3b-4c1f-9a6e-2b7d1e0f3a41'
+ARQ2 = '5f0c2a4e-8d3b-4c1f-9a6e-2b7d1e0f3a42'
+
+
+class TestExtARQBind(base.DbTestCase):
+
+    def setUp(self):
+        super(TestExtARQBind, self).setUp()
+        with enginefacade.writer.using(self.context) as session:
+            devprof = models.DeviceProfile(uuid='dp1-uuid', name='dp1',
+                                           json='{}')
+            device = models.Device(type='FPGA', vendor='v', model='m',
+                                   hostname='host1')
+            session.add_all([devprof, device])
+            session.flush()
+            # A single handle, so a leaked claim blocks every later bind.
+            session.add_all([
+                models.AttachHandle(device_id=device.id, type_name='PCI',
+                                    info='0000:af:00.1'),
+                models.Deployable(uuid='rp1', device_id=device.id),
+                models.ExtARQ(uuid=ARQ1, state='Initial',
+                              device_profile_id=devprof.id),
+                models.ExtARQ(uuid=ARQ2, state='Initial',
+                              device_profile_id=devprof.id)])
+
+    def _handle_ids(self):
+        with self.dbapi.read_transaction(self.context):
+            return dict(sqlalchemyapi.model_query(
+                self.context, models.ExtARQ, models.ExtARQ.uuid,
+                models.ExtARQ.attach_handle_id))
+
+    def _handles_in_use(self):
+        with self.dbapi.read_transaction(self.context):
+            return sqlalchemyapi.model_query(
+                self.context, models.AttachHandle).filter_by(
+                in_use=True).count()
+
+    def test_bind_unbind_bind(self):
+        arq1 = objects.ExtARQ.get(self.context, ARQ1)
+        arq2 = objects.ExtARQ.get(self.context, ARQ2)
+        arq1.bind(self.context, 'rp1')
+        self.assertEqual('0000:af:00.1', arq1.attach_handle_id_pci)
+        self.assertIsNotNone(self._handle_ids()[ARQ1])
+        self.assertRaises(exception.AttachHandleNotAvailable,
+                          arq2.bind, self.context, 'rp1')
+
+        arq1.unbind(self.context)
+        self.assertEqual({ARQ1: None, ARQ2: None}, self._handle_ids())
+        self.assertEqual(0, self._handles_in_use())
+
+        arq2.bind(self.context, 'rp1')
+        self.assertEqual('0000:af:00.1', arq2.attach_handle_id_pci)
+        self.assertEqual(1, self._handles_in_use())
+
+    def test_rebind_releases_previous_handle(self):
+        arq1 = objects.ExtARQ.get(self.context, ARQ1)
+        arq1.bind(self.context, 'rp1')
+        arq1.bind(self.context, 'rp1')
+        self.assertEqual(1, self._handles_in_use())
+
+    def test_delete_releases_handle(self):
+        objects.ExtARQ.get(self.context, ARQ1).bind(self.context, 'rp1')
+        self.dbapi.extarq_delete(self.context, ARQ1)
+        self.assertEqual(0, self._handles_in_use())
+
+    def test_failed_bind_save_releases_handle(self):
+        self.useFixture(fixtures.MockPatch('pecan.request',
+                                           mock.Mock(context=self.context)))
+        self.useFixture(fixtures.MockPatchObject(
+            objects, 'ARQ', objects.ExtARQ, create=True))
+        self.useFixture(fixtures.MockPatchObject(
+            objects.ExtARQ, 'save', side_effect=RuntimeError('boom')))
+        post = arq_bindings.ARQBindingsController.post.__wrapped__
+        req = {'bindings': [{'arq_uuid': ARQ1, 'host_name': 'host1',
+                             'device_rp_uuid': 'rp1',
+                             'instance_uuid': 'vm1'}]}
+        self.assertRaises(RuntimeError, post,
+                          arq_bindings.ARQBindingsController(), req)
+        self.assertEqual(0, self._handles_in_use())
+        self.assertIsNone(self._handle_ids()[ARQ1])
+
+    def test_concurrent_binds(self):
+        # Stress test: more threads than handles bind ARQs at once.  The
+        # test database serializes transactions on its one connection, so
+        # the race is forced: between reading the free handles and claiming
+        # one, each thread lets a rival bind claim one of them first.
+        n_handles, n_threads, n_rivals = 10, 25, 5
+        with enginefacade.writer.using(self.context) as session:
+            device_id = session.query(models.Device.id).scalar()
+            devprof_id = session.query(models.DeviceProfile.id).scalar()
+            session.add_all([
+                models.AttachHandle(device_id=device_id, type_name='PCI',
+                                    info='0000:b0:00.%d' % i)
+                for i in range(n_handles - 1)])
+            arq_uuids = [uuidutils.generate_uuid()
+                         for _ in range(n_threads + n_rivals)]
+            session.add_all([
+                models.ExtARQ(uuid=arq_uuid, state='Initial',
+                              device_profile_id=devprof_id)
+                for arq_uuid in arq_uuids])
+        rivals = arq_uuids[n_threads:]
+
+        bound = []
+        unavailable = []
+        local = threading.local()
+
+        def bind(arq_uuid):
+            ctx = context.get_context()
+            try:
+                objects.ExtARQ.get(ctx, arq_uuid).bind(ctx, 'rp1')
+            except exception.AttachHandleNotAvailable:
+                unavailable.append(arq_uuid)
+            else:
+                bound.append(arq_uuid)
+
+        orig_shuffle = random.shuffle
+
+        def racing_shuffle(ids):
+            if rivals and not getattr(local, 'rival', False):
+                local.rival = True
+                try:
+                    bind(rivals.pop())
+                finally:
+                    local.rival = False
+            eventlet.sleep(0)
+            orig_shuffle(ids)
+
+        with mock.patch.object(sqlalchemyapi.random, 'shuffle',
+                               side_effect=racing_shuffle):
+            threads = [threading.Thread(target=bind, args=(arq_uuid,))
+                       for arq_uuid in arq_uuids[:n_threads]]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(30)
+                self.assertFalse(t.is_alive())
+
+        self.assertEqual([], rivals)
+        self.assertEqual(n_handles, len(bound))
+        self.assertEqual(n_threads + n_rivals - n_handles, len(unavailable))
+        handle_ids = self._handle_ids()
+        claimed = [handle_ids[arq_uuid] for arq_uuid in bound]
+        self.assertNotIn(None, claimed)
+        self.assertEqual(n_handles, len(set(claimed)))
+        self.assertEqual(n_handles, self._handles_in_use())
+
+
+class TestExtARQHydration(test_base.TestCase):
+
+    def test_hydrate_50k(self):
+        # Benchmark: hydrating 50k rows through _from_db_object coerces
+        # every field of every row; _from_db_rows only coerces the
+        # datetime fields, and skips them too when they are NULL.
+        names = sorted(objects.ExtARQ.fields)
+        now = datetime.datetime(2026, 10, 19, 12, 0)
+        values = {'id': 0,
+                  'uuid': '0b8d3a1e-6a4f-4a43-9d1c-3f0b5c4c2d7e',
+                  'state': 'Bound',
+                  'device_profile_name': 'dp1', 'host_name': 'host1',
+                  'device_rp_uuid': 'rp1', 'instance_uuid': None,
+                  'attach_handle_id_pci': '0000:af:00.1',
+                  'created_at': now, 'updated_at': None}
+        rows = [tuple(values[name] for name in names)] * 50000
+        dicts = [values] * 50000
+        coerce = ovo_fields.Field.coerce
+        calls = []
+
+        def counting_coerce(field, obj, attr, value):
+            calls.append(attr)
+            return coerce(field, obj, attr, value)
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'oslo_versionedobjects.fields.Field.coerce', counting_coerce))
+        arqs = objects.ExtARQ._from_db_rows(None, rows, names)
+        self.assertEqual(50000, len(calls))
+        del calls[:]
+        values['instance_uuid'] = 'vm1'
+        objects.ExtARQ._from_db_object_list(dicts, None)
+        self.assertEqual(50000 * len(names), len(calls))
+        self.assertEqual(50000, len(arqs))
+        self.assertEqual('', arqs[-1].instance_uuid)
+        self.assertEqual(now.replace(tzinfo=arqs[-1].created_at.tzinfo),
+                         arqs[-1].created_at)
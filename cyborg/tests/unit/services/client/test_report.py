@@ -0,0 +1,354 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import mock
+from oslo_config import cfg
+from oslo_utils import uuidutils
+
+from cyborg.agent import provider_tree
+from cyborg.common import exception
+from cyborg.services.client import report
+from cyborg.tests import base
+
+
+def fake_response(status_code, body=None, text=''):
+    resp = mock.MagicMock(status_code=status_code, text=text, headers={})
+    resp.__bool__.return_value = status_code < 400
+    resp.__nonzero__ = resp.__bool__
+    resp.json.return_value = body
+    return resp
+
+
+class SchedulerReportClientTestCase(base.DietTestCase):
+
+    def setUp(self):
+        super(SchedulerReportClientTestCase, self).setUp()
+        self.adapter = mock.Mock()
+        self.client = report.SchedulerReportClient(adapter=self.adapter)
+        self.context = mock.Mock(global_id='req-fake')
+
+    def _set_max_version(self, version):
+        self.adapter.get.return_value = fake_response(
+            200, {'versions': [{'id': 'v1.0', 'max_version': version}]})
+
+
+class TestMicroversionNegotiation(SchedulerReportClientTestCase):
+
+    def test_max_microversion_cached(self):
+        self._set_max_version('1.30')
+        self.assertTrue(self.client._microversion_supported('1.30'))
+        self.assertTrue(self.client._microversion_supported('1.13'))
+        self.assertFalse(self.client._microversion_supported('1.31'))
+        self.adapter.get.assert_called_once_with(
+            '/', microversion=None, headers={})
+
+    def test_max_microversion_unavailable(self):
+        self.adapter.get.return_value = fake_response(500)
+        self.assertFalse(self.client._microversion_supported('1.13'))
+        # Not cached, so the next call asks again.
+        self.client._microversion_supported('1.13')
+        self.assertEqual(2, self.adapter.get.call_count)
+
+
+class TestEnsureTraits(SchedulerReportClientTestCase):
+
+    def test_ensure_traits_bulk_and_cached(self):
+        self.adapter.get.return_value = fake_response(
+            200, {'traits': ['CUSTOM_A']})
+        self.adapter.put.return_value = fake_response(201)
+
+        self.client._ensure_traits(self.context, ['CUSTOM_B', 'CUSTOM_A'])
+        self.adapter.get.assert_called_once_with(
+            '/traits?name=in:CUSTOM_A,CUSTOM_B', microversion='1.6',
+            headers=mock.ANY)
+        self.adapter.put.assert_called_once_with(
+            '/traits/CUSTOM_B', microversion='1.6', headers=mock.ANY)
+
+        # Everything is known now; no further round trips.
+        self.client._ensure_traits(self.context, ['CUSTOM_A', 'CUSTOM_B'])
+        self.assertEqual(1, self.adapter.get.call_count)
+        self.assertEqual(1, self.adapter.put.call_count)
+
+
+class TestSetAllocationsForConsumers(SchedulerReportClientTestCase):
+
+    def setUp(self):
+        super(TestSetAllocationsForConsumers, self).setUp()
+        self.rp_uuid = uuidutils.generate_uuid()
+        self.consumers = [uuidutils.generate_uuid() for _ in range(3)]
+        self.allocs = dict((c, {self.rp_uuid: {'FPGA': 1}})
+                           for c in self.consumers)
+
+    def test_single_post(self):
+        self._set_max_version('1.13')
+        self.adapter.post.return_value = fake_response(204)
+
+        self.assertTrue(self.client.set_allocations_for_consumers(
+            self.context, self.allocs, 'proj', 'user'))
+        self.adapter.post.assert_called_once_with(
+            '/allocations', json=mock.ANY, microversion='1.13',
+            headers=mock.ANY)
+        payload = self.adapter.post.call_args[1]['json']
+        self.assertEqual(set(self.consumers), set(payload))
+        self.assertEqual(
+            {'allocations': {self.rp_uuid: {'resources': {'FPGA': 1}}},
+             'project_id': 'proj', 'user_id': 'user'},
+            payload[self.consumers[0]])
+        self.assertFalse(self.adapter.put.called)
+
+    def test_fallback_put_per_consumer(self):
+        self._set_max_version('1.12')
+        self.adapter.put.return_value = fake_response(204)
+
+        self.assertTrue(self.client.set_allocations_for_consumers(
+            self.context, self.allocs, 'proj', 'user'))
+        self.assertFalse(self.adapter.post.called)
+        self.assertEqual(3, self.adapter.put.call_count)
+
+    @mock.patch('time.sleep', new=mock.Mock())
+    def test_conflict_retries(self):
+        self._set_max_version('1.13')
+        self.adapter.post.return_value = fake_response(
+            409, text='resource provider was concurrently updated')
+
+        self.assertFalse(self.client.set_allocations_for_consumers(
+            self.context, self.allocs, 'proj', 'user'))
+        self.assertEqual(4, self.adapter.post.call_count)
+
+    def test_set_and_clear(self):
+        self._set_max_version('1.13')
+        self.adapter.post.return_value = fake_response(204)
+        consumer, to_clear = self.consumers[:2]
+
+        self.assertTrue(self.client.set_and_clear_allocations(
+            self.context, self.rp_uuid, consumer, {'FPGA': 1}, 'proj',
+            'user', consumer_to_clear=to_clear))
+        payload = self.adapter.post.call_args[1]['json']
+        self.assertEqual(
+            {self.rp_uuid: {'resources': {'FPGA': 1}}},
+            payload[consumer]['allocations'])
+        self.assertEqual({}, payload[to_clear]['allocations'])
+
+
+class TestAssociationCache(SchedulerReportClientTestCase):
+
+    def setUp(self):
+        super(TestAssociationCache, self).setUp()
+        self.rp_uuid = uuidutils.generate_uuid()
+        self.client._provider_tree.new_root('rp', self.rp_uuid, generation=1)
+        self.generation = 1
+        self.adapter.get.side_effect = self._fake_get
+
+    def _fake_get(self, url, **kwargs):
+        if url == '/':
+            return fake_response(
+                200, {'versions': [{'id': 'v1.0', 'max_version': '1.30'}]})
+        if url.endswith('/aggregates'):
+            return fake_response(200, {'aggregates': ['agg1']})
+        if url.endswith('/traits'):
+            return fake_response(200, {'traits': ['CUSTOM_T']})
+        if url.startswith('/resource_providers?'):
+            return fake_response(200, {'resource_providers': []})
+        return fake_response(200, {'uuid': self.rp_uuid,
+                                   'generation': self.generation})
+
+    def _assoc_gets(self):
+        return [c for c in self.adapter.get.call_args_list
+                if c[0][0].endswith(('/aggregates', '/traits'))]
+
+    def test_unchanged_generation_hits(self):
+        self.client._refresh_associations(self.context, self.rp_uuid)
+        self.assertEqual(2, len(self._assoc_gets()))
+
+        # Expire the refresh interval; same generation means no re-fetch.
+        self.client._association_refresh_time[self.rp_uuid] = 0
+        self.client._refresh_associations(self.context, self.rp_uuid)
+        self.assertEqual(2, len(self._assoc_gets()))
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1},
+                         self.client.association_cache_stats())
+        self.assertEqual(
+            set(['CUSTOM_T']),
+            self.client._provider_tree.data(self.rp_uuid).traits)
+
+    def test_changed_generation_misses(self):
+        self.client._refresh_associations(self.context, self.rp_uuid)
+        self.client._association_refresh_time[self.rp_uuid] = 0
+        self.generation = 2
+        self.client._refresh_associations(self.context, self.rp_uuid)
+        self.assertEqual(4, len(self._assoc_gets()))
+        self.assertEqual(0, self.client.association_cache_stats()['hits'])
+        self.assertEqual(
+            2, self.client._provider_tree.data(self.rp_uuid).generation)
+
+    def test_lru_eviction(self):
+        cache = report._AssociationCache(2)
+        for i in range(3):
+            cache.put('rp%d' % i, 1, [], [])
+        self.assertIsNone(cache.get('rp0', 1))
+        self.assertIsNotNone(cache.get('rp1', 1))
+        cache.put('rp3', 1, [], [])
+        # rp1 was used more recently than rp2.
+        self.assertIsNone(cache.get('rp2', 1))
+        self.assertIsNotNone(cache.get('rp1', 1))
+        self.assertEqual(2, len(cache))
+
+
+class TestGetAllocationCandidates(SchedulerReportClientTestCase):
+
+    def setUp(self):
+        super(TestGetAllocationCandidates, self).setUp()
+        self.resources = mock.Mock()
+        self.resources.to_querystring.return_value = (
+            'resources=FPGA%3A1&limit=10')
+        self.body = {'allocation_requests': [{'allocations': {}}],
+                     'provider_summaries': {}}
+        self.adapter.get.return_value = fake_response(200, self.body)
+
+    def _flags(self, **kw):
+        for k, v in kw.items():
+            cfg.CONF.set_override(k, v, group='placement')
+            self.addCleanup(cfg.CONF.clear_override, k, group='placement')
+
+    def test_coalesce_identical_queries(self):
+        release = threading.Event()
+
+        def slow_get(url, **kwargs):
+            release.wait()
+            return fake_response(200, self.body)
+        self.adapter.get.side_effect = slow_get
+
+        results = []
+
+        def call():
+            results.append(self.client.get_allocation_candidates(
+                self.context, self.resources))
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for t in threads:
+            t.start()
+        while self.client.allocation_candidates_stats()['coalesced'] < 4:
+            time.sleep(0)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, self.adapter.get.call_count)
+        self.assertEqual(5, len(results))
+        self.assertEqual(
+            (self.body['allocation_requests'], {}, '1.25'), results[0])
+        # Every caller gets its own copy.
+        self.assertIsNot(results[0][0], results[1][0])
+        self.assertEqual({'requests': 5, 'placement_queries': 1,
+                          'coalesced': 4, 'cache_hits': 0},
+                         self.client.allocation_candidates_stats())
+
+    def test_ttl_cache(self):
+        self._flags(allocation_candidates_cache_ttl=5)
+        self.client.get_allocation_candidates(self.context, self.resources)
+        # The same query with its parameters in another order is a hit.
+        self.resources.to_querystring.return_value = (
+            'limit=10&resources=FPGA%3A1')
+        self.client.get_allocation_candidates(self.context, self.resources)
+        self.assertEqual(1, self.adapter.get.call_count)
+        self.assertEqual(
+            1, self.client.allocation_candidates_stats()['cache_hits'])
+
+        with mock.patch.object(report.time, 'time',
+                               return_value=time.time() + 10):
+            self.client.get_allocation_candidates(
+                self.context, self.resources)
+        self.assertEqual(2, self.adapter.get.call_count)
+
+    def test_failures_not_cached(self):
+        self._flags(allocation_candidates_cache_ttl=5)
+        self.adapter.get.return_value = fake_response(500)
+        for _ in range(2):
+            self.assertEqual(
+                (None, None, None),
+                self.client.get_allocation_candidates(
+                    self.context, self.resources))
+        self.assertEqual(2, self.adapter.get.call_count)
+
+
+class TestUpdateFromProviderTree(SchedulerReportClientTestCase):
+
+    def setUp(self):
+        super(TestUpdateFromProviderTree, self).setUp()
+        self._set_max_version('1.14')
+        self.root = uuidutils.generate_uuid()
+        self.children = [uuidutils.generate_uuid() for _ in range(20)]
+
+    def _tree(self):
+        ptree = provider_tree.ProviderTree()
+        ptree.new_root('root', self.root, generation=1)
+        for i, uuid in enumerate(self.children):
+            ptree.new_child('child%d' % i, self.root, uuid=uuid,
+                            generation=1)
+            ptree.update_inventory(uuid, {'FPGA': {'total': 1}})
+        return ptree
+
+    def test_unchanged_tree_no_calls(self):
+        self.client._provider_tree = self._tree()
+        self.adapter.reset_mock()
+
+        self.client.update_from_provider_tree(self.context, self._tree())
+        self.assertEqual([], self.adapter.method_calls)
+
+    def test_only_changed_provider_flushed(self):
+        self.client._provider_tree = self._tree()
+        new_tree = self._tree()
+        new_tree.update_traits(self.children[3], ['CUSTOM_A'])
+        self.adapter.reset_mock()
+
+        with mock.patch.object(self.client, '_ensure_traits'), \
+                mock.patch.object(self.client, 'set_aggregates_for_provider'
+                                  ) as m_aggs:
+            self.adapter.put.return_value = fake_response(
+                200, {'traits': ['CUSTOM_A'],
+                      'resource_provider_generation': 2})
+            self.client.update_from_provider_tree(self.context, new_tree)
+
+        m_aggs.assert_called_once_with(
+            self.context, self.children[3], frozenset())
+        self.adapter.put.assert_called_once_with(
+            '/resource_providers/%s/traits' % self.children[3],
+            json={'resource_provider_generation': 1,
+                  'traits': ['CUSTOM_A']},
+            microversion='1.6', headers=mock.ANY)
+        self.assertTrue(self.client._provider_tree.diff(new_tree).is_empty())
+
+    def test_inventory_put_per_provider(self):
+        # Even where placement has the reshaper, inventory goes through the
+        # per-provider PUT, interleaved with the provider's other updates.
+        self._set_max_version('1.30')
+        self.client._provider_tree = self._tree()
+        new_tree = self._tree()
+        for uuid in self.children[:2]:
+            new_tree.update_inventory(uuid, {'FPGA': {'total': 2}})
+        self.adapter.reset_mock()
+
+        with mock.patch.object(self.client, '_ensure_resource_classes'), \
+                mock.patch.object(self.client, 'set_aggregates_for_provider'
+                                  ), \
+                mock.patch.object(self.client, 'set_traits_for_provider'):
+            self.adapter.put.return_value = fake_response(
+                200, {'inventories': {'FPGA': {'total': 2}},
+                      'resource_provider_generation': 2})
+            self.client.update_from_provider_tree(self.context, new_tree)
+
+        self.assertFalse(self.adapter.post.called)
+        self.assertEqual(
+            set('/resource_providers/%s/inventories' % uuid
+                for uuid in self.children[:2]),
+            set(c[0][0] for c in self.adapter.put.call_args_list))
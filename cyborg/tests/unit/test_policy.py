@@ -0,0 +1,120 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+
+from cyborg.common import exception
+from cyborg.common import policy
+from cyborg.tests import base
+
+
+ADMIN = {'user': 'u1', 'tenant': 'p1', 'roles': ['admin'],
+         'auth_token': 'token1'}
+MEMBER = {'user': 'u2', 'tenant': 'p1', 'roles': ['member'],
+          'auth_token': 'token2'}
+
+
+class TestPolicyDecisionCache(base.TestCase):
+
+    def setUp(self):
+        super(TestPolicyDecisionCache, self).setUp()
+        self.enforcer = policy.get_enforcer()
+        self.evaluations = []
+        authorize = self.enforcer.authorize
+
+        def counting_authorize(rule, target, creds, *args, **kwargs):
+            self.evaluations.append(rule)
+            return authorize(rule, target, creds, *args, **kwargs)
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'cyborg.common.policy._DECISIONS', None))
+        self.useFixture(fixtures.MockPatchObject(
+            self.enforcer, 'authorize', side_effect=counting_authorize))
+
+    def test_repeated_decision_is_cached(self):
+        for i in range(5):
+            creds = dict(ADMIN, auth_token='token%d' % i)
+            self.assertTrue(policy.authorize('is_admin', creds, creds))
+        self.assertEqual(['is_admin'], self.evaluations)
+        stats = policy.get_decision_cache().stats()
+        self.assertEqual(4, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(0.8, stats['hit_ratio'])
+
+    def test_decisions_are_per_credentials(self):
+        self.assertTrue(policy.authorize('is_admin', ADMIN, ADMIN))
+        self.assertFalse(policy.authorize('is_admin', MEMBER, MEMBER))
+        self.assertTrue(policy.authorize('is_admin', ADMIN, ADMIN))
+        self.assertFalse(policy.authorize('is_admin', MEMBER, MEMBER))
+        self.assertEqual(2, len(self.evaluations))
+
+    def test_cached_denial_raises(self):
+        policy.authorize('is_admin', MEMBER, MEMBER)
+        self.assertRaises(exception.HTTPForbidden, policy.authorize,
+                          'is_admin', MEMBER, MEMBER, do_raise=True)
+        self.assertEqual(1, len(self.evaluations))
+
+    def test_lru_eviction(self):
+        self.config(policy_cache_size=2, group='api')
+        for rule in ('is_admin', 'admin_api', 'is_admin', 'deny'):
+            policy.authorize(rule, ADMIN, ADMIN)
+        # admin_api was the least recently used when deny came in.
+        policy.authorize('is_admin', ADMIN, ADMIN)
+        policy.authorize('admin_api', ADMIN, ADMIN)
+        self.assertEqual(['is_admin', 'admin_api', 'deny', 'admin_api'],
+                         self.evaluations)
+        self.assertEqual(2, policy.get_decision_cache().stats()['evictions'])
+
+    def test_policy_reload_invalidates(self):
+        self.assertFalse(policy.authorize('is_admin', MEMBER, MEMBER))
+        with open(self.policy.policy_file_name, 'w') as policy_file:
+            policy_file.write('{"is_admin": "role:member"}')
+        # Make sure the new mtime differs on filesystems with coarse ones.
+        mtime = os.path.getmtime(self.policy.policy_file_name) + 10
+        os.utime(self.policy.policy_file_name, (mtime, mtime))
+        self.assertTrue(policy.authorize('is_admin', MEMBER, MEMBER))
+        self.assertEqual(
+            1, policy.get_decision_cache().stats()['invalidations'])
+
+    def test_policy_dir_change_invalidates(self):
+        policy_dir = self.useFixture(fixtures.TempDir()).path
+        self.config(policy_dirs=[policy_dir], group='oslo_policy')
+        self.assertFalse(policy.authorize('is_admin', MEMBER, MEMBER))
+        dir_file = os.path.join(policy_dir, 'is_admin.json')
+        with open(dir_file, 'w') as policy_file:
+            policy_file.write('{"is_admin": "role:member"}')
+        mtime = os.path.getmtime(policy_dir) + 10
+        os.utime(dir_file, (mtime, mtime))
+        os.utime(policy_dir, (mtime, mtime))
+        self.assertTrue(policy.authorize('is_admin', MEMBER, MEMBER))
+        self.assertEqual(
+            1, policy.get_decision_cache().stats()['invalidations'])
+
+    def test_files_change_invalidates_same_rules(self):
+        # oslo.policy can merge policy_dirs files into the rules object it
+        # already has, so a new files snapshot alone empties the cache.
+        cache = policy.DecisionCache(10)
+        rules = object()
+        cache.get('key', rules, (('a.json', 1.0),))
+        cache.put('key', rules, True, (('a.json', 1.0),))
+        self.assertTrue(cache.get('key', rules, (('a.json', 1.0),)))
+        self.assertIsNone(cache.get('key', rules, (('a.json', 2.0),)))
+        self.assertEqual(1, cache.stats()['invalidations'])
+
+    def test_disabled(self):
+        self.config(policy_cache_size=0, group='api')
+        policy.authorize('is_admin', ADMIN, ADMIN)
+        policy.authorize('is_admin', ADMIN, ADMIN)
+        self.assertEqual(2, len(self.evaluations))
+        self.assertIsNone(policy.get_decision_cache())
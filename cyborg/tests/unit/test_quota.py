@@ -0,0 +1,276 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Unit tests for the quota engine and drivers."""
+
+import datetime
+
+import eventlet
+import mock
+from oslo_db.sqlalchemy import enginefacade
+from oslo_utils import timeutils
+from sqlalchemy import event
+
+from cyborg.common import exception
+from cyborg.db.sqlalchemy import api as sqlalchemyapi
+from cyborg.db.sqlalchemy import models
+from cyborg import objects
+from cyborg import quota
+from cyborg.tests.unit.db import base
+
+
+class QuotaDbTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(QuotaDbTestCase, self).setUp()
+        with enginefacade.writer.using(self.context) as session:
+            devprof = models.DeviceProfile(uuid='dp1-uuid', name='dp1',
+                                           json='{}')
+            fpga = models.Device(type='FPGA', vendor='v', model='m',
+                                 hostname='host1')
+            gpu = models.Device(type='GPU', vendor='v', model='m',
+                                hostname='host1')
+            session.add_all([devprof, fpga, gpu])
+            session.flush()
+            self.devprof_id = devprof.id
+            self.deployable_ids = {}
+            for device in (fpga, gpu):
+                deployable = models.Deployable(uuid=device.type,
+                                               device_id=device.id)
+                session.add(deployable)
+                session.add_all([
+                    models.AttachHandle(type_name='PCI', device_id=device.id,
+                                        info='0000:af:00.%d' % i)
+                    for i in range(8)])
+                session.flush()
+                self.deployable_ids[device.type.lower()] = deployable.id
+
+    def _capture_statements(self):
+        """Return a list that collects, upper-cased, every statement sent
+        to the database for the rest of the test.
+        """
+        engine = enginefacade.writer.get_engine()
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, many):
+            # Skip the pool's liveness ping and transaction bookkeeping.
+            if statement not in ('SELECT 1', 'BEGIN'):
+                statements.append(statement.upper())
+
+        event.listen(engine, 'before_cursor_execute', capture)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute',
+                        capture)
+        return statements
+
+    def _bind_arqs(self, project_id, resource, count, first=0):
+        uuids = ['%s-%s-%d' % (project_id, resource, i)
+                 for i in range(first, first + count)]
+        with enginefacade.writer.using(self.context) as session:
+            session.add_all([
+                models.ExtARQ(uuid=uuid, state='Initial',
+                              project_id=project_id,
+                              device_profile_id=self.devprof_id)
+                for uuid in uuids])
+        # Deployable uuids double as device RP uuids here.
+        for uuid in uuids:
+            objects.ExtARQ.get(self.context, uuid).bind(self.context,
+                                                        resource.upper())
+        return uuids
+
+
+class CountingQuotaDriverTestCase(QuotaDbTestCase):
+
+    def setUp(self):
+        super(CountingQuotaDriverTestCase, self).setUp()
+        self.quotas = quota.QuotaEngine(
+            quota_driver_class='cyborg.quota.CountingQuotaDriver')
+        self.config(quota_fpgas=3, quota_gpus=1)
+
+    def test_driver_from_config(self):
+        self.config(quota_driver='cyborg.quota.CountingQuotaDriver')
+        self.assertIsInstance(quota.QuotaEngine()._driver,
+                              quota.CountingQuotaDriver)
+
+    def test_usage_count(self):
+        self._bind_arqs('project1', 'fpga', 2)
+        self._bind_arqs('project1', 'gpu', 1)
+        self._bind_arqs('project2', 'fpga', 1)
+        dbapi = quota.CountingQuotaDriver.dbapi
+        self.assertEqual({'project1': {'fpga': 2, 'gpu': 1},
+                          'project2': {'fpga': 1}},
+                         dbapi.quota_usage_count(self.context))
+        self.assertEqual({'project1': {'fpga': 2}},
+                         dbapi.quota_usage_count(self.context,
+                                                 project_id='project1',
+                                                 resources=['fpga']))
+
+    def test_unbind_stops_counting(self):
+        uuids = self._bind_arqs('project1', 'fpga', 2)
+        objects.ExtARQ.get(self.context, uuids[0]).unbind(self.context)
+        self.assertEqual({'project1': {'fpga': 1}},
+                         quota.CountingQuotaDriver.dbapi.quota_usage_count(
+                             self.context))
+
+    def test_reserve_within_quota(self):
+        self._bind_arqs('project1', 'fpga', 2)
+        self.assertEqual([], self.quotas.reserve(self.context, {'fpga': 1},
+                                                 project_id='project1'))
+        # Releasing never fails, whatever the usage.
+        self.quotas.reserve(self.context, {'gpu': -1},
+                            project_id='project1')
+
+    def test_reserve_over_quota(self):
+        self._bind_arqs('project1', 'fpga', 2)
+        self._bind_arqs('project1', 'gpu', 1)
+        exc = self.assertRaises(exception.OverQuota, self.quotas.reserve,
+                                self.context, {'fpga': 2, 'gpu': 1},
+                                project_id='project1')
+        self.assertEqual(['fpga', 'gpu'], exc.kwargs['overs'])
+
+    def test_concurrent_reserve_scaling(self):
+        # Not a timing benchmark: SQLite in memory serializes every
+        # statement.  It checks what bounds reservations per second as
+        # workers are added, namely the work done per reservation.  That
+        # stays at a single unlocked SELECT, with no writes, whatever the
+        # worker count, so no reservation waits on another's row lock.
+        statements = self._capture_statements()
+        self._bind_arqs('project1', 'fpga', 1)
+
+        for workers in (1, 4, 16):
+            del statements[:]
+            pool = eventlet.GreenPool(workers)
+            for _ in range(workers * 10):
+                pool.spawn(self.quotas.reserve, self.context, {'fpga': 1},
+                           project_id='project1')
+            pool.waitall()
+            self.assertEqual(workers * 10, len(statements))
+            self.assertTrue(all(s.lstrip().startswith('SELECT')
+                                for s in statements))
+            self.assertFalse(any('FOR UPDATE' in s for s in statements))
+
+
+class DbQuotaDriverTestCase(QuotaDbTestCase):
+
+    def setUp(self):
+        super(DbQuotaDriverTestCase, self).setUp()
+        self.quotas = quota.QuotaEngine(
+            quota_driver_class='cyborg.quota.DbQuotaDriver')
+        self.dbapi = quota.DbQuotaDriver.dbapi
+
+    def _usages(self, project_id='project1'):
+        usages = self.dbapi._get_quota_usages(self.context, project_id)
+        return {resource: (usage.in_use, usage.reserved)
+                for resource, usage in usages.items()}
+
+    def _reservation_count(self):
+        with self.dbapi.read_transaction(self.context):
+            return sqlalchemyapi.model_query(
+                self.context, models.Reservation).count()
+
+    def test_reserve_syncs_usage(self):
+        self._bind_arqs('project1', 'fpga', 2)
+        self.quotas.reserve(self.context, {'fpga': 1}, project_id='project1')
+        self.assertEqual({'fpga': (2, 1)}, self._usages())
+
+    def test_rollback(self):
+        reservations = self.quotas.reserve(self.context, {'fpga': 1, 'gpu': 2},
+                                           project_id='project1')
+        self.assertEqual({'fpga': (0, 1), 'gpu': (0, 2)}, self._usages())
+
+        self.quotas.rollback(self.context, reservations)
+        self.assertEqual({'fpga': (0, 0), 'gpu': (0, 0)}, self._usages())
+        self.assertEqual(0, self._reservation_count())
+
+    def test_expire_in_batches(self):
+        past = timeutils.utcnow() - datetime.timedelta(seconds=1)
+        for _ in range(3):
+            self.quotas.reserve(self.context, {'fpga': 1}, expire=past,
+                                project_id='project1')
+        live = self.quotas.reserve(self.context, {'fpga': 1},
+                                   project_id='project1')
+        self.assertEqual({'fpga': (0, 4)}, self._usages())
+
+        self.assertEqual(3, self.dbapi.reservation_expire(self.context,
+                                                          batch_size=2))
+        self.assertEqual({'fpga': (0, 1)}, self._usages())
+        self.assertEqual(1, self._reservation_count())
+        self.quotas.rollback(self.context, live)
+        self.assertEqual({'fpga': (0, 0)}, self._usages())
+
+    def test_expire_resyncs_usage(self):
+        self.quotas.reserve(self.context, {'fpga': 1}, project_id='project1')
+        # ARQs bound behind the quota engine's back: usage has drifted.
+        self._bind_arqs('project1', 'fpga', 2)
+        self._bind_arqs('project2', 'gpu', 1)
+
+        self.config(reservation_sweep_batch_size=10)
+        self.quotas.expire(self.context)
+        self.assertEqual({'fpga': (2, 1)}, self._usages())
+        self.assertEqual({'gpu': (1, 0)}, self._usages('project2'))
+
+    def test_expire_keeps_committed_usage(self):
+        # The usual flow: reserve, bind the ARQ, commit.  The sweep must
+        # agree with the usage the commit left behind.
+        self._bind_arqs('project1', 'fpga', 1)
+        reservations = self.quotas.reserve(self.context, {'fpga': 1},
+                                           project_id='project1')
+        self._bind_arqs('project1', 'fpga', 1, first=1)
+        self.dbapi.reservation_commit(self.context, reservations,
+                                      project_id='project1')
+        self.assertEqual({'fpga': (2, 0)}, self._usages())
+
+        self.quotas.expire(self.context)
+        self.assertEqual({'fpga': (2, 0)}, self._usages())
+
+    def test_refresh_locks_one_project_at_a_time(self):
+        self.quotas.reserve(self.context, {'fpga': 1}, project_id='project1')
+        self.quotas.reserve(self.context, {'gpu': 1}, project_id='project3')
+        self._bind_arqs('project1', 'fpga', 1)
+        self._bind_arqs('project2', 'gpu', 1)
+
+        refresh = sqlalchemyapi.Connection._quota_usage_refresh_project
+        with mock.patch.object(sqlalchemyapi.Connection,
+                               '_quota_usage_refresh_project', autospec=True,
+                               side_effect=refresh) as m_refresh:
+            self.assertEqual(2, self.dbapi.quota_usage_refresh(self.context))
+        # project3 has not drifted, so its usages are never locked.
+        self.assertEqual(['project1', 'project2'],
+                         [c[0][2] for c in m_refresh.call_args_list])
+        self.assertEqual({'fpga': (1, 1)}, self._usages())
+        self.assertEqual({'gpu': (1, 0)}, self._usages('project2'))
+        self.assertEqual({'gpu': (0, 1)}, self._usages('project3'))
+
+    def test_statements_per_reservation(self):
+        # Microbenchmark: the statements sent to the database must not grow
+        # with the number of resources in one reserve or commit call.
+        statements = self._capture_statements()
+
+        for n_resources in (1, 10):
+            deltas = {'res%d-%d' % (n_resources, i): 1
+                      for i in range(n_resources)}
+            # New usages: lock, count, insert usages, read their ids,
+            # insert reservations.
+            del statements[:]
+            self.quotas.reserve(self.context, deltas, project_id='project1')
+            self.assertEqual(5, len(statements))
+
+            # Existing usages: lock, update usages, insert reservations.
+            del statements[:]
+            reservations = self.quotas.reserve(self.context, deltas,
+                                               project_id='project1')
+            self.assertEqual(3, len(statements))
+
+            # Commit: lock reservations, lock usages, update, delete.
+            del statements[:]
+            self.quotas.commit(self.context, reservations)
+            self.assertEqual(4, len(statements))
+        self.assertEqual((1, 1), self._usages()['res10-9'])